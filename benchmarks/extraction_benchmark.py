@@ -0,0 +1,110 @@
+"""
+Compare the spider's single-pass post extraction against the original.
+
+Runs `SitemapSpeeder.extract` and `SitemapSpeeder.extract_reference` over
+stored post pages, checks that they produce the same posts and reports
+pages per second for each. Uses the HTML fixtures in
+benchmarks/fixtures/posts by default, or the posts of a crawl recorded with
+`-s HTTPCACHE_MODE=record`.
+
+Usage:
+    poetry run python benchmarks/extraction_benchmark.py
+    poetry run python benchmarks/extraction_benchmark.py --httpcache scraper/.scrapy/httpcache
+"""
+import os
+import sys
+import glob
+import gzip
+import time
+import pickle
+import argparse
+
+from scrapy.http import HtmlResponse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scraper'))
+from scraper.spiders.speeder import SitemapSpeeder  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'posts')
+
+
+def _read(path):
+    """A file's bytes, gunzipped if the HTTP cache stored it compressed."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return gzip.decompress(data) if data[:2] == b'\x1f\x8b' else data
+
+
+def fixture_pages(directory):
+    """
+    Post pages saved as HTML files.
+    """
+    return [HtmlResponse(url=f'https://dfoarchive.blogspot.com/'
+                             f'{os.path.basename(path)}',
+                         body=_read(path), encoding='utf-8')
+            for path in sorted(glob.glob(os.path.join(directory, '*.html')))]
+
+
+def httpcache_pages(directory):
+    """
+    Post pages of a crawl stored by Scrapy's FilesystemCacheStorage.
+    """
+    pages = []
+    pattern = os.path.join(directory, '**', 'response_body')
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        meta = pickle.loads(_read(os.path.join(os.path.dirname(path),
+                                               'pickled_meta')))
+        body = _read(path)
+        if meta.get('status') == 200 and b'post-body' in body:
+            pages.append(HtmlResponse(url=meta['response_url'], body=body,
+                                      encoding='utf-8'))
+    return pages
+
+
+def throughput(extract, pages, repeat: int) -> float:
+    """Pages extracted per second, over `repeat` passes."""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for page in pages:
+            extract(page)
+    return repeat * len(pages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--fixtures', default=FIXTURES,
+                        help='Directory of post pages saved as HTML')
+    parser.add_argument('--httpcache',
+                        help='HTTP cache directory of a recorded crawl; '
+                             'used instead of --fixtures')
+    parser.add_argument('--repeat', type=int, default=20,
+                        help='Passes over the pages per measurement')
+    args = parser.parse_args()
+
+    pages = (httpcache_pages(args.httpcache) if args.httpcache
+             else fixture_pages(args.fixtures))
+    if not pages:
+        parser.error('No post pages found')
+
+    spider = SitemapSpeeder()
+    paths = {
+        'reference': lambda page: dict(next(spider.extract_reference(page)),
+                                       url=page.url),
+        'single-pass': spider.extract,
+    }
+
+    mismatches = [page.url for page in pages
+                  if paths['reference'](page) != paths['single-pass'](page)]
+    print(f'{len(pages)} pages, {len(mismatches)} mismatches')
+    for url in mismatches:
+        print(f'  differs: {url}')
+
+    results = {name: throughput(extract, pages, args.repeat)
+               for name, extract in paths.items()}
+    print(f"{'path':<12} {'pages/s':>9} {'speedup':>8}")
+    for name, rate in results.items():
+        print(f"{name:<12} {rate:>9.1f} "
+              f"{rate / results['reference']:>7.2f}x")
+
+
+if __name__ == '__main__':
+    main()
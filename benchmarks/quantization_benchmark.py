@@ -0,0 +1,113 @@
+"""
+Compare quantized NumpyVectorStore indexes against full precision.
+
+For each storage dtype, with and without exact re-scoring, reports the
+total size of the index on disk (including the float32 copy re-scoring
+keeps), load time, query latency and recall@k against an exact float32
+search. Quantized indexes are smaller but score slower, as numpy widens
+them to float32 block by block. Uses the embeddings of an existing numpy index when
+one is given, random clustered vectors shaped like OpenAI embeddings
+otherwise.
+
+Usage:
+    poetry run python benchmarks/quantization_benchmark.py
+    poetry run python benchmarks/quantization_benchmark.py --index db_numpy -k 5
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from landy.utils.vector_store import NumpyVectorStore, dequantize  # noqa: E402
+
+
+def synthetic_vectors(n: int, dim: int, seed: int = 0) -> np.ndarray:
+    """
+    Vectors bunched around a few topics, like embeddings of one corpus.
+    """
+    rng = np.random.default_rng(seed)
+    topics = rng.normal(size=(max(n // 20, 1), dim))
+    vectors = topics[rng.integers(len(topics), size=n)] + rng.normal(
+        scale=0.6, size=(n, dim))
+    return vectors.astype(np.float32)
+
+
+def load_vectors(index: str) -> np.ndarray:
+    """
+    Full-precision embeddings of an existing numpy index.
+    """
+    store = NumpyVectorStore(index)
+    full = store._full if store._full is not None else store._vectors
+    return dequantize(full, None if store._full is not None
+                      else store._scales)
+
+
+def disk_size(directory: str) -> int:
+    """Bytes of every file in an index directory."""
+    return sum(entry.stat().st_size for entry in os.scandir(directory)
+               if entry.is_file())
+
+
+def recall(expected, found) -> float:
+    """Share of the exact top k found, averaged over queries."""
+    return float(np.mean([
+        len({hit[0] for hit in e} & {hit[0] for hit in f}) / len(e)
+        for e, f in zip(expected, found)]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--index', help='Existing numpy index directory')
+    parser.add_argument('-n', type=int, default=778,
+                        help='Synthetic vectors when no index is given')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('-k', type=int, default=10)
+    args = parser.parse_args()
+
+    vectors = (load_vectors(args.index) if args.index
+               else synthetic_vectors(args.n, args.dim))
+    rng = np.random.default_rng(1)
+    # Paraphrase-like queries: noisy copies of corpus vectors
+    picks = rng.integers(len(vectors), size=args.queries)
+    queries = (vectors[picks] + rng.normal(
+        scale=0.5 * np.abs(vectors).mean(), size=(args.queries,
+                                                  vectors.shape[1]))).tolist()
+    ids = [str(i) for i in range(len(vectors))]
+    print(f'{len(vectors)} vectors x {vectors.shape[1]} dims, '
+          f'{args.queries} queries, k={args.k}\n')
+    print(f"{'dtype':<8} {'rescore':>7} {'disk MB':>9} {'load ms':>8} "
+          f"{'query us':>9} {'recall':>7}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        expected = None
+        for dtype in ('float32', 'float16', 'int8'):
+            for rescore_factor in ((0,) if dtype == 'float32' else (0, 4)):
+                # Re-scoring changes what is persisted, so each gets its own
+                directory = os.path.join(tmp, f'{dtype}-{rescore_factor}')
+                store = NumpyVectorStore(directory, dtype=dtype,
+                                         rescore_factor=rescore_factor)
+                store.upsert(ids, vectors, ids, [{}] * len(ids))
+                store.persist()
+                size = disk_size(directory) / 2 ** 20
+                started = time.perf_counter()
+                store = NumpyVectorStore(directory,
+                                         rescore_factor=rescore_factor)
+                load_ms = (time.perf_counter() - started) * 1000
+                started = time.perf_counter()
+                found = [store.query([query], args.k)[0] for query in queries]
+                query_us = ((time.perf_counter() - started) * 1e6
+                            / len(queries))
+                if expected is None:
+                    expected = found
+                print(f'{dtype:<8} {rescore_factor or "-":>7} {size:>9.2f} '
+                      f'{load_ms:>8.2f} {query_us:>9.1f} '
+                      f'{recall(expected, found):>7.4f}')
+
+
+if __name__ == '__main__':
+    main()
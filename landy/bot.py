@@ -1,5 +1,6 @@
 import os
 import uuid
+import asyncio
 import traceback
 from datetime import datetime
 from dotenv import load_dotenv
@@ -9,9 +10,21 @@ from discord import Intents, ApplicationContext, Interaction, Embed
 from discord.ext import commands
 from discord.ui import Modal, View, InputText, button
 
+from landy.utils.admission import (
+    AdmissionQueue,
+    QueueFullError,
+    RateLimitedError
+)
+from landy.utils.feedback_writer import FeedbackWriter
 from landy.utils.lc_handler import LangChainHandler
-from landy.utils.logger import CustomLogger
+from landy.utils.logger import CustomLogger, configure_logging
 from landy.utils.qna_database import QnADatabase
+from landy.utils.qna_log_sink import (
+    install_qna_log_sink,
+    question_uuid_var,
+    uninstall_qna_log_sink
+)
+from landy.utils.tracing import latency, span, start_metrics_server, trace
 
 
 # Load environment variables from .env file
@@ -20,13 +33,74 @@ load_dotenv()
 # Set-up logger
 logger = CustomLogger(__name__)
 
+# Create QnADatabase instance
+DB_URI = os.environ.get('DB_URI')
+# Connection pool sizing and per-connection prepared statement cache size
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', 1))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', 10))
+DB_STATEMENT_CACHE_SIZE = int(os.environ.get('DB_STATEMENT_CACHE_SIZE', 100))
+
+# Stream GPT-4 tokens into the follow-up message while they are generated
+STREAM_ANSWERS = os.environ.get('STREAM_ANSWERS', 'true').lower() == 'true'
+# Minimum seconds between edits of a streamed answer; Discord rate-limits
+# message edits
+STREAM_EDIT_INTERVAL = float(os.environ.get('STREAM_EDIT_INTERVAL', 1.0))
+# Discord's message length limit
+MAX_MESSAGE_LENGTH = 2000
+
+# Long-lived LangChainHandler, warmed in on_ready and shared by every command
+lc_handler = None
+
+async def get_lc_handler() -> LangChainHandler:
+    """
+    Return the process-wide LangChainHandler, creating and warming it on
+    first use.
+
+    Returns:
+        LangChainHandler: The shared, ready-to-use handler.
+    """
+    global lc_handler
+    if lc_handler is None:
+        lc_handler = LangChainHandler()
+    await lc_handler.setup()
+    return lc_handler
+
+# Bounded queue and rate limits in front of the answering pipeline
+ask_queue = AdmissionQueue()
+
+# Batches feedback clicks into bulk inserts, so the user is thanked without
+# waiting for the database
+feedback_writer = FeedbackWriter(DB_URI)
+
+# Server of the /metrics endpoint, started in on_ready
+metrics_runner = None
+
+class LandyBot(commands.Bot):
+    """
+    Bot subclass that releases Landy's shared resources on shutdown.
+    """
+    async def close(self):
+        """
+        Stop the ask queue, close the shared LangChainHandler, write out the
+        buffered feedback and question logs, stop the metrics endpoint and
+        close the database pool before closing the bot itself.
+        """
+        global metrics_runner
+        await ask_queue.close()
+        if lc_handler is not None:
+            await lc_handler.close()
+        await feedback_writer.close()
+        await uninstall_qna_log_sink()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+            metrics_runner = None
+        await QnADatabase.close_pool()
+        await super().close()
+
 # Set up the bot
 intents = Intents.default()
 intents.message_content = True
-bot = commands.Bot(intents=intents)
-
-# Create QnADatabase instance
-DB_URI = os.environ.get('DB_URI')
+bot = LandyBot(intents=intents)
 
 # Set-up feedback modal for downvotes
 class ThumbsDownFeedbackModal(Modal):
@@ -51,7 +125,7 @@ class ThumbsDownFeedbackModal(Modal):
             interaction (Interaction): The user interaction that triggered the
                                        modal.
         """
-        # Record feedback in DB
+        # Queue feedback for the DB; the user doesn't wait for the write
         feedback_data = {
             'feedback_uuid': str(uuid.uuid4()),
             'question_uuid': self.question_uuid,
@@ -59,9 +133,12 @@ class ThumbsDownFeedbackModal(Modal):
             'is_positive': False,
             'feedback_commentary': self.children[0].value
         }
-        async with QnADatabase(DB_URI) as db:
-            await db.insert_data('qna_feedback', feedback_data)
-        logger.info(f'Question {self.question_uuid} provided negative feedback')
+        feedback_writer.submit(feedback_data)
+        logger.info('Question %s provided negative feedback',
+                    self.question_uuid)
+        # Stop reusing the disliked answer for similar questions
+        if lc_handler is not None:
+            lc_handler.answer_cache.invalidate(self.question_uuid)
         
         embed = Embed(title="Thank you for your feedback!")
         embed.add_field(name="We'll take a look at the following...",
@@ -92,7 +169,7 @@ class FeedbackView(View):
             interaction (Interaction): The user interaction that triggered the
                                        view.
         """
-        # Record feedback in DB
+        # Queue feedback for the DB; the user doesn't wait for the write
         feedback_data = {
             'feedback_uuid': str(uuid.uuid4()),
             'question_uuid': self.question_uuid,
@@ -100,9 +177,9 @@ class FeedbackView(View):
             'is_positive': True,
             'feedback_commentary': None
         }
-        async with QnADatabase(DB_URI) as db:
-            await db.insert_data('qna_feedback', feedback_data)
-        logger.info(f'Question {self.question_uuid} provided positive feedback')
+        feedback_writer.submit(feedback_data)
+        logger.info('Question %s provided positive feedback',
+                    self.question_uuid)
         
         # Thank user for feedback
         await interaction.response.send_message(
@@ -129,14 +206,141 @@ class FeedbackView(View):
             ThumbsDownFeedbackModal(title='ThumbsDownFeedbackModal',
                                     question_uuid=self.question_uuid))
 
+def format_answer(question: str, answer: str) -> str:
+    """
+    Format the follow-up message for an answered question.
+
+    Args:
+        question (str): The user's question.
+        answer (str): The answer to it.
+
+    Returns:
+        str: The message text.
+    """
+    return (f'> Q: {question}\n\nAnswer below:\n\n{answer}\n\n'
+            f'*Please give this answer feedback with the buttons below!*')
+
+class StreamedFollowup:
+    """
+    Shows an answer while it is being generated.
+
+    The follow-up message is sent as soon as the first tokens arrive and is
+    then edited at most once every `edit_interval` seconds, so streaming
+    stays within Discord's rate limits. `finish` writes the final answer.
+    """
+    def __init__(self, ctx: ApplicationContext, question: str,
+                 edit_interval: float = STREAM_EDIT_INTERVAL):
+        self.ctx = ctx
+        self.question = question
+        self.edit_interval = edit_interval
+        self.tokens = []
+        self.message = None
+        self._pending = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._publisher = None
+
+    async def on_token(self, token: str):
+        """
+        Collect a generated token and make sure it gets published.
+
+        Args:
+            token (str): The new token.
+        """
+        self.tokens.append(token)
+        self._pending.set()
+        if self._publisher is None:
+            self._publisher = asyncio.create_task(self._publish())
+
+    def _partial_text(self) -> str:
+        """The message text for the answer generated so far."""
+        text = (f'> Q: {self.question}\n\nAnswer below:\n\n'
+                f'{"".join(self.tokens)} …')
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH - 1] + '…'
+        return text
+
+    async def _publish(self):
+        """Send, then periodically edit, the partial answer until finished."""
+        while not self._finished.is_set():
+            await self._pending.wait()
+            if self._finished.is_set():
+                return
+            self._pending.clear()
+            try:
+                if self.message is None:
+                    self.message = await self.ctx.send_followup(
+                        self._partial_text(), ephemeral=False)
+                else:
+                    await self.message.edit(content=self._partial_text())
+            except discord.HTTPException as error:
+                logger.warning('Could not stream answer update: %s', error)
+            # Waiting out the edit interval, unless the answer is complete
+            try:
+                await asyncio.wait_for(self._finished.wait(),
+                                       self.edit_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def stop(self):
+        """Stop publishing partial answers, e.g. when answering failed."""
+        self._finished.set()
+        self._pending.set()
+        if self._publisher is not None:
+            await self._publisher
+
+    async def finish(self, answer: str, view: View):
+        """
+        Show the complete answer with the feedback buttons.
+
+        Args:
+            answer (str): The complete answer.
+            view (View): The view to attach to the message.
+        """
+        await self.stop()
+        text = format_answer(self.question, answer)
+        if self.message is None:
+            await self.ctx.send_followup(text, ephemeral=False, view=view)
+        else:
+            await self.message.edit(content=text, view=view)
+
 # Log when a bot is ready
 @bot.event
 async def on_ready():
     """
     An event that is triggered when the bot is ready.
 
-    This function logs that the bot is ready and online.
+    This function starts writing feedback and storing question logs in
+    qna_logs, sets up the database pool and schema, serves latency metrics,
+    warms the shared LangChainHandler, so the first question doesn't pay for
+    loading the vector store, and logs that the bot is ready and online.
     """
+    global metrics_runner
+    # Both keep what they can't write yet until the database is reachable,
+    # so they start first, whatever state it is in
+    feedback_writer.start()
+    install_qna_log_sink(DB_URI)
+    try:
+        await QnADatabase.init_pool(
+            DB_URI,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE)
+    except Exception as error:
+        # Without the pool each query connects on its own, and the first
+        # to get through sets up the schema; on_ready fires again after
+        # reconnects and retries the pool
+        logger.error('Could not set up the database pool, going on '
+                     'without it: %s', error)
+    # on_ready fires again after reconnects
+    if metrics_runner is None:
+        try:
+            metrics_runner = await start_metrics_server()
+        except OSError as error:
+            # E.g. the port is taken; answering matters more than metrics
+            logger.error('Could not serve latency metrics, running '
+                         'without them: %s', error)
+    await get_lc_handler()
+    ask_queue.start()
     logger.info(f"{bot.user} is ready and online!")
 
 # Ask command
@@ -146,35 +350,82 @@ async def ask(ctx: ApplicationContext, *, question: str):
     The function that handles the "ask" command.
 
     When a user enters a query, this function processes the query and returns an
-    answer. It also shows the user a FeedbackView, which allows them to provide
-    feedback on the answer they received.
+    answer, streaming it into the reply while it's generated. It also shows
+    the user a FeedbackView, which allows them to provide feedback on the
+    answer they received.
 
     Args:
         ctx (ApplicationContext): The context of the command.
         question (str): The query that the user entered.
     """
-    
+    # Time each stage of answering, for the logs and /latency
+    with trace('ask') as stages:
+        await _ask(ctx, question)
+    logger.info('Question answered in %.2fs (%s)', stages['ask'],
+                ', '.join(f'{stage} {seconds:.2f}s'
+                          for stage, seconds in stages.items()
+                          if stage != 'ask'),
+                extra={'latency': stages})
+
+async def _ask(ctx: ApplicationContext, question: str):
+    """
+    Answer a question for the "ask" command; see `ask`.
+    """
     # Show user bot is thinking
-    await ctx.defer(ephemeral=False)
+    with span('defer'):
+        await ctx.defer(ephemeral=False)
     
     # Get the answer for the query based on the documents
     
     question_uuid = str(uuid.uuid4())
-    logger.info((
-        f'Starting to answer question {question_uuid} from {ctx.user}: '
-        f'"{question}"'
-    ))
+    # Every command runs in its own task, so this tags this question's logs
+    # for qna_logs, including those of the queued job, and nothing else
+    question_uuid_var.set(question_uuid)
+    logger.info('Starting to answer question %s from %s: %r',
+                question_uuid, ctx.user, question)
     
-    async with LangChainHandler() as LC:
-        answer = await LC.ask_doc_based_question(question, question_uuid)
-
-        # Send the answer back to the user
-        follow_up_text = (f'> Q: {question}\n\nAnswer below:\n\n{answer}\n\n'
-                          f'*Please give this answer feedback with the buttons'
-                          f' below!*')
-        await ctx.send_followup(follow_up_text,
-                                ephemeral=False,
-                                view=FeedbackView(question_uuid=question_uuid,
+    LC = await get_lc_handler()
+    # Show the answer as it's generated, if streaming is on
+    followup = StreamedFollowup(ctx, question)
+    on_token = followup.on_token if STREAM_ANSWERS else None
+
+    async def notify_queued(position: int):
+        """Tell the user where their question is in the queue."""
+        await ctx.interaction.edit_original_response(
+            content=f"Lots of questions right now! You're #{position} in "
+                    f"line, hang tight...")
+
+    # Wait for a free worker, unless the user, server or queue is at its
+    # limit; a question identical to one already waiting or being answered
+    # shares its answer instead
+    try:
+        answer = await LC.ask_doc_based_question(
+            question, question_uuid, on_token=on_token,
+            admit=lambda start: ask_queue.submit(
+                start,
+                user_id=ctx.user.id,
+                guild_id=ctx.guild_id,
+                on_queued=notify_queued))
+    except RateLimitedError as error:
+        logger.info('Question %s rejected: %s', question_uuid, error)
+        await ctx.send_followup(
+            f"Whoa, slow down! {error.scope} question limit reached, please "
+            f"try again in {error.retry_after:.0f} seconds.")
+        return
+    except QueueFullError as error:
+        logger.info('Question %s rejected: %s', question_uuid, error)
+        await ctx.send_followup(
+            "Landy is swamped with questions right now, please try again in "
+            "a minute.")
+        return
+    except BaseException:
+        await followup.stop()
+        raise
+
+    # Send the answer back to the user
+    with span('followup'):
+        await followup.finish(answer,
+                              view=FeedbackView(question_uuid=question_uuid,
                                                 timeout=None))
 
 # Ask command error handler
@@ -213,6 +464,46 @@ async def ask_error(ctx: discord.ApplicationContext, error):
     )
     await ctx.send_followup(error_message)
 
+def format_latency_table(summary) -> str:
+    """
+    Format per-stage latency percentiles as a table for Discord.
+
+    Args:
+        summary: (stage, count, p50, p95, p99) rows, as from
+                 `LatencyRecorder.summary`, in seconds.
+
+    Returns:
+        str: The table in a code block.
+    """
+    lines = [f"{'stage':<14}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}"
+             f"{'p99 ms':>10}"]
+    for stage, count, *percentiles in summary:
+        lines.append(f'{stage:<14}{count:>7}' + ''.join(
+            f'{seconds * 1000:>10.0f}' for seconds in percentiles))
+    return '```\n' + '\n'.join(lines) + '\n```'
+
+# Latency command, for admins only
+@bot.slash_command(name='latency',
+                   description='Show how long each stage of answering takes')
+@discord.default_permissions(administrator=True)
+async def latency_stats(ctx: ApplicationContext):
+    """
+    The function that handles the "latency" command.
+
+    Replies, only to the admin who asked, with the p50/p95/p99 latency of
+    each stage of answering questions since the bot started.
+
+    Args:
+        ctx (ApplicationContext): The context of the command.
+    """
+    summary = latency.summary()
+    if not summary:
+        await ctx.respond('No questions answered yet.', ephemeral=True)
+        return
+    await ctx.respond(format_latency_table(summary), ephemeral=True)
+
 # Run bot
 if __name__ == '__main__':
+    # Keep writing logs off the event loop unless told otherwise
+    configure_logging(mode=os.environ.get('LOG_MODE', 'queue'))
     bot.run(os.environ['DISCORD_API_TOKEN'])
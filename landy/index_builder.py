@@ -0,0 +1,429 @@
+import os
+import json
+import argparse
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.text_splitter import TextSplitter, TokenTextSplitter
+
+from landy.utils.context_assembler import TOKENIZER_MODEL, count_tokens
+from landy.utils.corpus_store import (
+    CORPUS_PATH,
+    content_hash,
+    is_url_id,
+    read_corpus,
+    read_legacy
+)
+from landy.utils.embedding_cache import CachedEmbeddings
+from landy.utils.logger import CustomLogger
+from landy.utils.text_preprocessor import TextPreprocessor
+from landy.utils.vector_store import (
+    QUANTIZED_DTYPES,
+    VECTOR_BACKEND,
+    VECTOR_DTYPE,
+    default_persist_directory,
+    get_vector_store
+)
+
+logger = CustomLogger(__name__)
+
+# Name of the file, inside the persist directory, recording what is indexed
+MANIFEST_NAME = 'manifest.json'
+# Chunks are small so that several relevant ones fit in a prompt
+CHUNK_SIZE = 500
+CHUNK_OVERLAP = 50
+# Number of chunks embedded and upserted per request
+BATCH_SIZE = 100
+
+
+def iter_corpus(path: str = CORPUS_PATH) -> Iterator[Tuple[str, str]]:
+    """
+    Iterate over the posts of the scraped corpus.
+
+    Posts are identified by URL, as the spider's IndexingPipeline indexes
+    them. A post still under its old blogs.json row key is left out once
+    the same text was scraped under a URL.
+
+    Args:
+        path (str): Path of the JSONL corpus, or of a file `read_legacy`
+                    understands, such as the old blogs.json.
+
+    Yields:
+        Tuple[str, str]: Document ID and post text.
+    """
+    read = read_corpus if path.endswith('.jsonl') else read_legacy
+    scraped = {post.content_hash for post in read(path)
+               if is_url_id(post.id)}
+    for post in read(path):
+        if is_url_id(post.id) or post.content_hash not in scraped:
+            yield post.id, post.text
+
+
+def empty_manifest() -> Dict:
+    """
+    A manifest for an index with nothing in it.
+
+    Returns:
+        Dict: The empty manifest.
+    """
+    return {'chunk_size': None, 'chunk_overlap': None, 'version': None,
+            'documents': {}}
+
+
+def load_manifest(persist_directory: str) -> Dict:
+    """
+    Load the manifest of what is indexed, or an empty one.
+
+    Args:
+        persist_directory (str): Directory the index is persisted in.
+
+    Returns:
+        Dict: The manifest.
+    """
+    path = os.path.join(persist_directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return empty_manifest()
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(persist_directory: str, manifest: Dict):
+    """
+    Atomically write the manifest, stamping it with a version that changes
+    whenever the set of indexed chunks does.
+
+    Args:
+        persist_directory (str): Directory the index is persisted in.
+        manifest (Dict): The manifest to write.
+    """
+    chunk_ids = sorted(chunk_id
+                       for document in manifest['documents'].values()
+                       for chunk_id in document['chunk_ids'])
+    manifest['version'] = content_hash('\n'.join(chunk_ids))
+    path = os.path.join(persist_directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+class _DeferredEmbeddings(Embeddings):
+    """
+    Embeddings that defer to a builder's embedder, so it is only created
+    when something is embedded.
+    """
+
+    def __init__(self, builder: 'IndexBuilder'):
+        self.builder = builder
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.builder.embedder.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.builder.embedder.embed_query(text)
+
+
+class IndexBuilder:
+    """
+    Incrementally syncs the vector index with the corpus.
+
+    Documents are compared by content hash against the manifest; only chunks
+    of new or changed documents are embedded and upserted, and chunks of
+    changed or removed documents are deleted.
+
+    Usage:
+        builder = IndexBuilder()
+        builder.sync(iter_corpus())
+    """
+
+    def __init__(self, persist_directory: Optional[str] = None,
+                 chunk_size: int = CHUNK_SIZE, batch_size: int = BATCH_SIZE,
+                 chunk_overlap: int = CHUNK_OVERLAP,
+                 backend: str = VECTOR_BACKEND, dtype: str = VECTOR_DTYPE,
+                 embedder: Optional[Embeddings] = None,
+                 text_splitter: Optional[TextSplitter] = None):
+        """
+        Initialize the builder and load the existing index and manifest.
+
+        The OpenAI embedder and the tokenizer are only created once they are
+        needed, so planning and dry runs work without an API key, and
+        without the tokenizer when a text splitter is given.
+
+        Args:
+            persist_directory (Optional[str]): Directory the index is
+                                              persisted in; defaults to the
+                                              backend's own.
+            chunk_size (int): Tokens per chunk.
+            batch_size (int): Chunks embedded and upserted per request.
+            chunk_overlap (int): Tokens shared by consecutive chunks.
+            backend (str): Vector store backend, 'chroma' or 'numpy'.
+            dtype (str): How the numpy backend stores embeddings: 'float32',
+                         'float16' or 'int8'.
+            embedder (Optional[Embeddings]): Embeds chunks; defaults to
+                                             cached OpenAI embeddings.
+            text_splitter (Optional[TextSplitter]): Splits documents into
+                chunks; defaults to one counting the chat model's tokens.
+        """
+        self.persist_directory = (persist_directory
+                                  or default_persist_directory(backend))
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.preprocessor = TextPreprocessor()
+        self._text_splitter = text_splitter
+        self._embedder = embedder
+        # Chroma would load a local model without an embedding function;
+        # this one only creates the embedder if Chroma ever embeds
+        self.db = get_vector_store(backend, self.persist_directory,
+                                   _DeferredEmbeddings(self), dtype)
+        self.manifest = load_manifest(self.persist_directory)
+
+    @property
+    def text_splitter(self) -> TextSplitter:
+        """Splits documents into chunks, created on first use."""
+        if self._text_splitter is None:
+            # Counted with the chat model's tokenizer, like the prompt budget
+            self._text_splitter = TokenTextSplitter(
+                model_name=TOKENIZER_MODEL, chunk_size=self.chunk_size,
+                chunk_overlap=self.chunk_overlap)
+        return self._text_splitter
+
+    @property
+    def embedder(self) -> Embeddings:
+        """Embeds chunks, created on first use."""
+        if self._embedder is None:
+            self._embedder = CachedEmbeddings(OpenAIEmbeddings())
+        return self._embedder
+
+    def close(self):
+        """Close the embedding cache, if it was opened."""
+        if isinstance(self._embedder, CachedEmbeddings):
+            self._embedder.close()
+
+    def chunk(self, doc_id: str, text: str) -> List[Tuple[str, str]]:
+        """
+        Preprocess and split a document into content-addressed chunks.
+
+        Args:
+            doc_id (str): ID of the document.
+            text (str): Raw text of the document.
+
+        Returns:
+            List[Tuple[str, str]]: Chunk IDs and chunk texts.
+        """
+        return self.split(doc_id, self.preprocessor.preprocess(text))
+
+    def split(self, doc_id: str, text: str) -> List[Tuple[str, str]]:
+        """
+        Split an already preprocessed document into content-addressed chunks.
+
+        Args:
+            doc_id (str): ID of the document.
+            text (str): Preprocessed text of the document.
+
+        Returns:
+            List[Tuple[str, str]]: Chunk IDs and chunk texts.
+        """
+        chunks = self.text_splitter.split_text(text)
+        return [(content_hash(f'{doc_id}\0{chunk}'), chunk)
+                for chunk in chunks]
+
+    @property
+    def rechunk(self) -> bool:
+        """Whether the manifest's documents were chunked differently."""
+        return (self.manifest.get('chunk_size') != self.chunk_size
+                or self.manifest.get('chunk_overlap') != self.chunk_overlap)
+
+    def is_current(self, doc_id: str, doc_hash: str) -> bool:
+        """
+        Whether a document is indexed as it is now.
+
+        Args:
+            doc_id (str): ID of the document.
+            doc_hash (str): `content_hash` of its raw text.
+
+        Returns:
+            bool: True if nothing needs to be done for it.
+        """
+        old = self.manifest['documents'].get(doc_id)
+        return (old is not None and old['content_hash'] == doc_hash
+                and not self.rechunk)
+
+    def plan_document(self, doc_id: str, doc_hash: str,
+                      text: str) -> Tuple[Dict, Dict, List[str]]:
+        """
+        Work out which chunks of one new or changed document to upsert and
+        delete.
+
+        Args:
+            doc_id (str): ID of the document.
+            doc_hash (str): `content_hash` of its raw text.
+            text (str): Its preprocessed text.
+
+        Returns:
+            Tuple[Dict, Dict, List[str]]: The document's manifest entry,
+            its chunks to upsert as {chunk_id: (doc_id, index, text)} and its
+            chunk IDs to delete.
+        """
+        old = self.manifest['documents'].get(doc_id)
+        chunks = self.split(doc_id, text)
+        old_ids = set(old['chunk_ids']) if old else set()
+        upserts = {chunk_id: (doc_id, index, chunk)
+                   for index, (chunk_id, chunk) in enumerate(chunks)
+                   if chunk_id not in old_ids}
+        new_ids = [chunk_id for chunk_id, _ in chunks]
+        deletes = list(old_ids - set(new_ids))
+        return ({'content_hash': doc_hash, 'chunk_ids': new_ids}, upserts,
+                deletes)
+
+    def plan(self, corpus: Iterator[Tuple[str, str]]) -> Tuple[Dict, Dict,
+                                                               List[str]]:
+        """
+        Work out which chunks to upsert and delete.
+
+        Args:
+            corpus (Iterator[Tuple[str, str]]): Document IDs and texts.
+
+        Returns:
+            Tuple[Dict, Dict, List[str]]: The new manifest documents, the
+            chunks to upsert as {chunk_id: (doc_id, index, text)} and the
+            chunk IDs to delete.
+        """
+        old_documents = self.manifest['documents']
+        documents, upserts, deletes = {}, {}, []
+        changed = []
+        for doc_id, text in corpus:
+            doc_hash = content_hash(text)
+            if self.is_current(doc_id, doc_hash):
+                documents[doc_id] = old_documents[doc_id]
+            else:
+                changed.append((doc_id, text, doc_hash))
+
+        # Preprocessing is CPU-bound, so spread it over every core
+        cleaned = self.preprocessor.preprocess_many(
+            (text for _, text, _ in changed),
+            processes=min(os.cpu_count() or 1, len(changed)) or 1)
+        for (doc_id, _, doc_hash), text in zip(changed, cleaned):
+            documents[doc_id], doc_upserts, doc_deletes = self.plan_document(
+                doc_id, doc_hash, text)
+            upserts.update(doc_upserts)
+            deletes.extend(doc_deletes)
+        for doc_id, old in old_documents.items():
+            if doc_id not in documents:
+                deletes.extend(old['chunk_ids'])
+        return documents, upserts, deletes
+
+    def sync(self, corpus: Iterator[Tuple[str, str]],
+             dry_run: bool = False) -> Dict[str, int]:
+        """
+        Bring the index in line with the corpus and record the manifest.
+
+        Args:
+            corpus (Iterator[Tuple[str, str]]): Document IDs and texts.
+            dry_run (bool): Only report what would change.
+
+        Returns:
+            Dict[str, int]: Counts of documents, upserted and deleted chunks.
+        """
+        documents, upserts, deletes = self.plan(corpus)
+        stats = {'documents': len(documents), 'upserted': len(upserts),
+                 'deleted': len(deletes)}
+        if dry_run:
+            return stats
+
+        self.write(upserts, deletes)
+        self.db.persist()
+
+        self.manifest = {'chunk_size': self.chunk_size,
+                         'chunk_overlap': self.chunk_overlap,
+                         'documents': documents}
+        save_manifest(self.persist_directory, self.manifest)
+        return stats
+
+    def write(self, upserts: Dict, deletes: List[str]):
+        """
+        Delete chunks, then embed and upsert chunks in batches. Changes are
+        only durable after `self.db.persist()`.
+
+        Args:
+            upserts (Dict): Chunks as {chunk_id: (doc_id, index, text)}.
+            deletes (List[str]): Chunk IDs.
+        """
+        if deletes:
+            self.db.delete(deletes)
+        items = list(upserts.items())
+        for start in range(0, len(items), self.batch_size):
+            batch = items[start:start + self.batch_size]
+            texts = [text for _, (_, _, text) in batch]
+            self.db.upsert(
+                ids=[chunk_id for chunk_id, _ in batch],
+                embeddings=self.embedder.embed_documents(texts),
+                documents=texts,
+                # Token counts let prompts be assembled without tokenizing
+                metadatas=[{'doc_id': doc_id, 'chunk_index': index,
+                            'n_tokens': count_tokens(text)}
+                           for _, (doc_id, index, text) in batch])
+            logger.info(f'Upserted {start + len(batch)}/{len(items)} chunks')
+
+    def reset(self):
+        """
+        Delete every chunk from the index and forget the manifest.
+        """
+        ids = self.db.get_all()[0]
+        if ids:
+            self.db.delete(ids)
+        self.manifest = empty_manifest()
+
+
+def main(argv: List[str] = None):
+    """
+    Command line entry point: `landy-index` or `python -m landy.index_builder`.
+    """
+    parser = argparse.ArgumentParser(
+        description='Incrementally update the vector index from the corpus.')
+    parser.add_argument('--corpus', default=CORPUS_PATH,
+                        help='Path of the corpus file')
+    parser.add_argument('--backend', default=VECTOR_BACKEND,
+                        choices=['chroma', 'numpy'],
+                        help='Vector store to build')
+    parser.add_argument('--dtype', default=VECTOR_DTYPE,
+                        choices=QUANTIZED_DTYPES,
+                        help='How the numpy backend stores embeddings; '
+                             'applied on every run')
+    parser.add_argument('--persist-dir', default=None,
+                        help="Directory the index is persisted in; defaults "
+                             "to the backend's own")
+    parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                        help='Tokens per chunk; changing it re-chunks all')
+    parser.add_argument('--chunk-overlap', type=int, default=CHUNK_OVERLAP,
+                        help='Tokens shared by consecutive chunks; changing '
+                             'it re-chunks all')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='Chunks embedded and upserted per request')
+    parser.add_argument('--rebuild', action='store_true',
+                        help='Drop everything indexed and start over')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Only report what would change')
+    args = parser.parse_args(argv)
+
+    builder = IndexBuilder(args.persist_dir, args.chunk_size, args.batch_size,
+                           args.chunk_overlap, args.backend, args.dtype)
+    if args.rebuild and args.dry_run:
+        builder.manifest = empty_manifest()
+    elif args.rebuild:
+        builder.reset()
+    elif not builder.manifest['documents'] and builder.db.count():
+        parser.error('the index has no manifest, so it was not built by this '
+                     'tool; run once with --rebuild')
+    stats = builder.sync(iter_corpus(args.corpus), dry_run=args.dry_run)
+    builder.close()
+    logger.info(f"{stats['documents']} documents: {stats['upserted']} "
+                f"chunks upserted, {stats['deleted']} deleted"
+                f"{' (dry run)' if args.dry_run else ''}")
+    if isinstance(builder._embedder, CachedEmbeddings):
+        logger.info(f"{builder._embedder.hits} cached embeddings, "
+                    f"{builder._embedder.misses} new")
+
+
+if __name__ == '__main__':
+    main()
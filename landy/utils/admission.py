@@ -0,0 +1,280 @@
+import os
+import time
+import asyncio
+import contextvars
+from collections import deque
+from typing import Awaitable, Callable, Dict, Hashable, Optional, TypeVar
+
+from landy.utils.logger import CustomLogger
+
+logger = CustomLogger(__name__)
+
+# Questions being answered at once; the rest wait in the queue
+ASK_WORKERS = int(os.environ.get('ASK_WORKERS', 4))
+# Questions allowed to wait before new ones are turned away
+ASK_QUEUE_SIZE = int(os.environ.get('ASK_QUEUE_SIZE', 50))
+# Token-bucket limits: sustained questions per minute and burst size
+USER_RATE_PER_MINUTE = float(os.environ.get('USER_RATE_PER_MINUTE', 3))
+USER_BURST = int(os.environ.get('USER_BURST', 3))
+GUILD_RATE_PER_MINUTE = float(os.environ.get('GUILD_RATE_PER_MINUTE', 30))
+GUILD_BURST = int(os.environ.get('GUILD_BURST', 10))
+
+T = TypeVar('T')
+
+
+class AdmissionError(Exception):
+    """
+    Raised when a job is not admitted to the queue.
+    """
+
+
+class QueueFullError(AdmissionError):
+    """
+    Raised when the queue has no room for another job.
+    """
+
+
+class RateLimitedError(AdmissionError):
+    """
+    Raised when a user or guild has used up its rate limit.
+
+    Attributes:
+        retry_after (float): Seconds until a job would be admitted.
+    """
+    def __init__(self, scope: str, retry_after: float):
+        super().__init__(f'{scope} rate limit exceeded, retry in '
+                         f'{retry_after:.0f}s')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens and refills at
+    `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, capacity: int,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated_at = clock()
+
+    def _refill(self):
+        """Add the tokens earned since the last update."""
+        now = self.clock()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self) -> float:
+        """
+        Seconds until a token is available; 0 if one is available now.
+        """
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self):
+        """Take a token; call only after `wait_time` returned 0."""
+        self._refill()
+        self.tokens -= 1
+
+    @property
+    def is_full(self) -> bool:
+        """Whether the bucket has refilled completely, i.e. is idle."""
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class _Job:
+    """
+    A queued job, the future its submitter waits on and the submitter's
+    context, which the job runs in.
+    """
+    __slots__ = ('func', 'future', 'context')
+
+    def __init__(self, func: Callable[[], Awaitable], future: asyncio.Future):
+        self.func = func
+        self.future = future
+        self.context = contextvars.copy_context()
+
+
+class AdmissionQueue:
+    """
+    Bounded work queue with a fixed number of workers, guarded by per-user
+    and per-guild token-bucket rate limits.
+
+    Jobs that can't run right away wait in FIFO order; once `max_size` jobs
+    are waiting, new ones are rejected instead of piling up.
+
+    Usage:
+        queue = AdmissionQueue(workers=4, max_size=50)
+        queue.start()
+        answer = await queue.submit(lambda: ask(question), user_id, guild_id)
+    """
+
+    def __init__(self, workers: int = ASK_WORKERS,
+                 max_size: int = ASK_QUEUE_SIZE,
+                 user_rate_per_minute: float = USER_RATE_PER_MINUTE,
+                 user_burst: int = USER_BURST,
+                 guild_rate_per_minute: float = GUILD_RATE_PER_MINUTE,
+                 guild_burst: int = GUILD_BURST,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize the queue; `start` launches the workers.
+
+        Args:
+            workers (int): Jobs run at once.
+            max_size (int): Jobs allowed to wait.
+            user_rate_per_minute (float): Sustained jobs per user per minute.
+            user_burst (int): Jobs a user can submit in a burst.
+            guild_rate_per_minute (float): Sustained jobs per guild per
+                                           minute.
+            guild_burst (int): Jobs a guild can submit in a burst.
+            clock (Callable[[], float]): Monotonic time source.
+        """
+        self.workers = workers
+        self.max_size = max_size
+        self.user_rate = user_rate_per_minute / 60
+        self.user_burst = user_burst
+        self.guild_rate = guild_rate_per_minute / 60
+        self.guild_burst = guild_burst
+        self.clock = clock
+        self.busy = 0
+        self._pending = deque()
+        self._user_buckets: Dict[Hashable, TokenBucket] = {}
+        self._guild_buckets: Dict[Hashable, TokenBucket] = {}
+        self._wakeup = None
+        self._tasks = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def start(self):
+        """Launch the worker tasks; must be called from the event loop."""
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Condition()
+        self._tasks = [asyncio.create_task(self._work())
+                       for _ in range(self.workers)]
+        logger.info(f'Admission queue started with {self.workers} workers')
+
+    async def close(self):
+        """Stop the workers and fail the jobs that are still waiting."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._pending:
+            job = self._pending.popleft()
+            if not job.future.done():
+                job.future.set_exception(AdmissionError('queue closed'))
+
+    def _bucket(self, buckets: Dict[Hashable, TokenBucket], key: Hashable,
+                rate: float, burst: int) -> TokenBucket:
+        """Get, or create, the bucket for a key, forgetting idle ones."""
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= 10_000:
+                for idle in [k for k, b in buckets.items() if b.is_full]:
+                    del buckets[idle]
+            bucket = buckets[key] = TokenBucket(rate, burst, self.clock)
+        return bucket
+
+    def admit(self, user_id: Hashable, guild_id: Optional[Hashable] = None):
+        """
+        Charge a job to the user's and guild's rate limits.
+
+        Args:
+            user_id (Hashable): Who submitted the job.
+            guild_id (Optional[Hashable]): Where; None for direct messages.
+
+        Raises:
+            RateLimitedError: If the user or guild is over its limit.
+            QueueFullError: If no worker is free and the queue is full.
+        """
+        buckets = [('User', self._bucket(self._user_buckets, user_id,
+                                         self.user_rate, self.user_burst))]
+        if guild_id is not None:
+            buckets.append(('Server', self._bucket(
+                self._guild_buckets, guild_id, self.guild_rate,
+                self.guild_burst)))
+        for scope, bucket in buckets:
+            wait = bucket.wait_time()
+            if wait > 0:
+                raise RateLimitedError(scope, wait)
+        if self.busy >= self.workers and len(self._pending) >= self.max_size:
+            raise QueueFullError(f'{len(self._pending)} jobs already waiting')
+        for _, bucket in buckets:
+            bucket.consume()
+
+    async def submit(self, func: Callable[[], Awaitable[T]],
+                     user_id: Hashable, guild_id: Optional[Hashable] = None,
+                     on_queued: Optional[
+                         Callable[[int], Awaitable[None]]] = None) -> T:
+        """
+        Run a job once a worker is free and return its result.
+
+        Args:
+            func (Callable[[], Awaitable[T]]): Starts the job.
+            user_id (Hashable): Who submitted the job.
+            guild_id (Optional[Hashable]): Where; None for direct messages.
+            on_queued (Optional[Callable[[int], Awaitable[None]]]): Called
+                with the job's 1-based position if it has to wait.
+
+        Returns:
+            T: The job's result.
+
+        Raises:
+            RateLimitedError: If the user or guild is over its limit.
+            QueueFullError: If no worker is free and the queue is full.
+        """
+        self.admit(user_id, guild_id)
+        self.start()
+        job = _Job(func, asyncio.get_running_loop().create_future())
+        self._pending.append(job)
+        position = len(self._pending) - (self.workers - self.busy)
+        async with self._wakeup:
+            self._wakeup.notify()
+        try:
+            if position > 0 and on_queued is not None:
+                await on_queued(position)
+            return await job.future
+        except BaseException:
+            # Cancelled, or telling the user failed: don't spend a worker or
+            # a queue slot on a job nobody is waiting for
+            if job in self._pending:
+                self._pending.remove(job)
+            job.future.cancel()
+            raise
+
+    async def _work(self):
+        """Worker loop: run waiting jobs one at a time."""
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: self._pending)
+                job = self._pending.popleft()
+            if job.future.done():
+                continue
+            self.busy += 1
+            try:
+                # A task started inside the submitter's context runs in a
+                # copy of it, so context variables such as the question
+                # being answered carry over to the worker
+                result = await job.context.run(
+                    lambda: asyncio.ensure_future(job.func()))
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as error:
+                if not job.future.done():
+                    job.future.set_exception(error)
+            else:
+                if not job.future.done():
+                    job.future.set_result(result)
+            finally:
+                self.busy -= 1
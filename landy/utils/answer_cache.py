@@ -0,0 +1,331 @@
+import re
+import time
+import asyncio
+from collections import OrderedDict
+from typing import (Any, Awaitable, Callable, Dict, Hashable, List,
+                    NamedTuple, Optional, Tuple)
+
+import numpy as np
+
+from landy.utils.logger import CustomLogger
+
+
+logger = CustomLogger(__name__)
+
+# Anything that isn't a word character or whitespace counts as punctuation
+_PUNCTUATION_RE = re.compile(r"[^\w\s]+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Fold case, punctuation and whitespace so trivially different spellings of
+    a question compare equal.
+
+    Args:
+        question (str): The question text.
+
+    Returns:
+        str: The normalized question.
+    """
+    return " ".join(_PUNCTUATION_RE.sub(" ", question.casefold()).split())
+
+
+class CachedAnswer(NamedTuple):
+    """
+    An earlier answer that can be served again.
+
+    question_uuids holds the question the answer was generated for followed
+    by every question it has since been reused for.
+    """
+    question: str
+    answer: str
+    question_uuids: List[str]
+
+
+class _Entry:
+    """
+    A cached answer with its normalized question embedding and age.
+    """
+    __slots__ = ('cached_answer', 'vector', 'created_at',
+                 'normalized_question')
+
+    def __init__(self, cached_answer: CachedAnswer, vector: np.ndarray,
+                 created_at: float):
+        self.cached_answer = cached_answer
+        self.vector = vector
+        self.created_at = created_at
+        self.normalized_question = normalize_question(cached_answer.question)
+
+
+class SemanticAnswerCache:
+    """
+    Size-bounded, expiring cache of answers keyed by question embedding.
+
+    `lookup_exact` returns the answer to the same question after
+    normalization, without needing an embedding. `lookup` returns the answer
+    to the most similar cached question when its cosine similarity reaches
+    the threshold. Entries are evicted least recently used first, expire
+    after `ttl` seconds and are all dropped when the cache version (e.g.
+    commit hash and index version) changes.
+
+    Usage:
+        cache = SemanticAnswerCache(threshold=0.96)
+        cache.add(question_uuid, question, answer, embedding)
+        cached = cache.lookup_exact(same_question)
+        cached = cache.lookup(other_embedding)
+    """
+
+    def __init__(self, threshold: float = 0.96, max_size: int = 1024,
+                 ttl: float = 24 * 60 * 60,
+                 clock: Callable[[], float] = time.monotonic):
+        """
+        Initialize an empty SemanticAnswerCache.
+
+        Args:
+            threshold (float): Minimum cosine similarity for a hit.
+            max_size (int): Maximum number of cached answers; 0 disables the
+                            cache.
+            ttl (float): Seconds after which an entry expires.
+            clock (Callable[[], float]): Monotonic time source.
+        """
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        # Source question UUID -> entry, least recently used first
+        self._entries = OrderedDict()
+        # Any question UUID an answer was served for -> source question UUID
+        self._aliases = {}
+        # Normalized question -> source question UUID
+        self._exact = {}
+        # Stacked entry vectors, rebuilt lazily after the entries change
+        self._matrix = None
+        self._matrix_keys = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the cache stores anything at all."""
+        return self.max_size > 0
+
+    def set_version(self, version: Hashable) -> bool:
+        """
+        Set the version cached answers belong to, clearing the cache when it
+        changes.
+
+        Args:
+            version (Hashable): E.g. a (commit hash, index version) tuple.
+
+        Returns:
+            bool: True if the cache was invalidated.
+        """
+        if version == self.version:
+            return False
+        invalidated = self.version is not None and len(self) > 0
+        if invalidated:
+            logger.info(f'Answer cache invalidated, {len(self)} entries '
+                        f'dropped')
+        self.version = version
+        self.clear()
+        return invalidated
+
+    def clear(self):
+        """Drop every cached answer."""
+        self._entries.clear()
+        self._aliases.clear()
+        self._exact.clear()
+        self._matrix = None
+
+    def add(self, question_uuid: str, question: str, answer: str,
+            embedding: List[float], age: float = 0.0):
+        """
+        Cache an answer under its question's embedding.
+
+        Args:
+            question_uuid (str): UUID of the answered question.
+            question (str): The question text.
+            answer (str): The answer text.
+            embedding (List[float]): The question's embedding.
+            age (float): Seconds since the answer was generated, for answers
+                         loaded from the database; they expire that much
+                         sooner.
+        """
+        if not self.enabled:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return
+        cached_answer = CachedAnswer(question, answer, [question_uuid])
+        entry = _Entry(cached_answer, vector / norm, self.clock() - age)
+        self._entries[question_uuid] = entry
+        self._entries.move_to_end(question_uuid)
+        self._aliases[question_uuid] = question_uuid
+        self._exact[entry.normalized_question] = question_uuid
+        while len(self._entries) > self.max_size:
+            self._drop(next(iter(self._entries)))
+        self._matrix = None
+
+    def lookup_exact(self, question: str) -> Optional[CachedAnswer]:
+        """
+        Find the cached answer to the same question after normalization.
+
+        Args:
+            question (str): The new question's text.
+
+        Returns:
+            Optional[CachedAnswer]: The cached answer, or None on a miss.
+        """
+        self._expire()
+        key = self._exact.get(normalize_question(question))
+        if key is None:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        logger.debug('Answer cache exact hit on %s', key)
+        return self._entries[key].cached_answer
+
+    def lookup(self, embedding: List[float]) -> Optional[CachedAnswer]:
+        """
+        Find the cached answer to the most similar question.
+
+        Args:
+            embedding (List[float]): The new question's embedding.
+
+        Returns:
+            Optional[CachedAnswer]: The cached answer, or None on a miss.
+        """
+        self._expire()
+        if not self._entries:
+            self.misses += 1
+            return None
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries)
+            self._matrix = np.stack([self._entries[key].vector
+                                     for key in self._matrix_keys])
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            self.misses += 1
+            return None
+        scores = self._matrix @ (vector / norm)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+        key = self._matrix_keys[best]
+        self._entries.move_to_end(key)
+        self.hits += 1
+        logger.debug('Answer cache hit on %s (similarity %.3f)', key,
+                     scores[best])
+        return self._entries[key].cached_answer
+
+    def link(self, question_uuid: str, source_question_uuid: str):
+        """
+        Record that a cached answer was reused for another question, so that
+        feedback on either question can invalidate it.
+
+        Args:
+            question_uuid (str): UUID of the question the answer was reused
+                                 for.
+            source_question_uuid (str): UUID of the cached answer's question.
+        """
+        source = self._aliases.get(source_question_uuid)
+        if source is None:
+            return
+        self._aliases[question_uuid] = source
+        self._entries[source].cached_answer.question_uuids.append(
+            question_uuid)
+
+    def invalidate(self, question_uuid: str) -> bool:
+        """
+        Drop the cached answer a question was served, e.g. after negative
+        feedback.
+
+        Args:
+            question_uuid (str): UUID of any question the answer was served
+                                 for.
+
+        Returns:
+            bool: True if an entry was dropped.
+        """
+        source = self._aliases.get(question_uuid)
+        if source is None:
+            return False
+        self._drop(source)
+        self._matrix = None
+        logger.debug('Answer cache entry %s invalidated', source)
+        return True
+
+    def _drop(self, source: str):
+        """Remove an entry and all of its aliases."""
+        entry = self._entries.pop(source)
+        for question_uuid in entry.cached_answer.question_uuids:
+            self._aliases.pop(question_uuid, None)
+        if self._exact.get(entry.normalized_question) == source:
+            del self._exact[entry.normalized_question]
+
+    def _expire(self):
+        """Remove entries older than the TTL."""
+        cutoff = self.clock() - self.ttl
+        expired = [key for key, entry in self._entries.items()
+                   if entry.created_at < cutoff]
+        for key in expired:
+            self._drop(key)
+        if expired:
+            self._matrix = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one computation.
+
+    The first caller for a key starts the computation; everyone who asks for
+    the same key while it is running awaits the same result. A caller being
+    cancelled doesn't cancel the computation for the others.
+
+    Usage:
+        flights = SingleFlight()
+        result, is_leader = await flights.run(key, lambda: compute(key))
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    async def run(self, key: Hashable,
+                  func: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Run `func` for `key` unless a run for the same key is in flight.
+
+        Args:
+            key (Hashable): Identifies identical work.
+            func (Callable[[], Awaitable[Any]]): Starts the computation; only
+                                                 called by the leader.
+
+        Returns:
+            Tuple[Any, bool]: The result and whether this caller started the
+            computation.
+        """
+        future = self._in_flight.get(key)
+        is_leader = future is None
+        if is_leader:
+            future = asyncio.ensure_future(func())
+            self._in_flight[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(future), is_leader
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        """Stop sharing a finished computation."""
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,179 @@
+import os
+import asyncio
+from typing import List, Optional, Sequence, Union
+
+import numpy as np
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chat_models import ChatOpenAI
+from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.schema import BaseMessage
+
+from landy.utils.logger import CustomLogger
+
+logger = CustomLogger(__name__)
+
+# Maximum OpenAI requests in flight at once, per kind of request
+CHAT_MAX_CONCURRENCY = int(os.environ.get('CHAT_MAX_CONCURRENCY', 8))
+EMBEDDING_MAX_CONCURRENCY = int(
+    os.environ.get('EMBEDDING_MAX_CONCURRENCY', 32))
+# Seconds a single call may take, including the model's own retries
+CHAT_TIMEOUT = float(os.environ.get('CHAT_TIMEOUT', 120))
+EMBEDDING_TIMEOUT = float(os.environ.get('EMBEDDING_TIMEOUT', 20))
+
+
+class AsyncLLMClient:
+    """
+    asyncio-native OpenAI chat completions and embeddings.
+
+    Calls are coroutines rather than blocked threads, so waiting questions
+    cost next to nothing. Each kind of call has its own concurrency limit,
+    and every call is cut off after its timeout.
+
+    Usage:
+        client = AsyncLLMClient(OpenAIEmbeddings())
+        vectors = await client.embed(["How do I farm gold?"])
+        answer = await client.chat(ChatOpenAI(), messages)
+    """
+
+    def __init__(self, embedder: OpenAIEmbeddings,
+                 chat_max_concurrency: int = CHAT_MAX_CONCURRENCY,
+                 embedding_max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+                 chat_timeout: float = CHAT_TIMEOUT,
+                 embedding_timeout: float = EMBEDDING_TIMEOUT):
+        """
+        Initialize the client. Must be created inside the event loop it is
+        used from.
+
+        Args:
+            embedder (OpenAIEmbeddings): Supplies the embedding model and
+                                         request settings.
+            chat_max_concurrency (int): Chat completions in flight at once.
+            embedding_max_concurrency (int): Embedding requests in flight at
+                                             once.
+            chat_timeout (float): Seconds before a chat completion is
+                                  abandoned.
+            embedding_timeout (float): Seconds before an embedding request is
+                                       abandoned.
+        """
+        self.embedder = embedder
+        self.chat_timeout = chat_timeout
+        self.embedding_timeout = embedding_timeout
+        self._chat_semaphore = asyncio.Semaphore(chat_max_concurrency)
+        self._embedding_semaphore = asyncio.Semaphore(
+            embedding_max_concurrency)
+
+    async def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, batched and length-safe like
+        `OpenAIEmbeddings.embed_documents`.
+
+        Up to the embedder's `chunk_size` inputs are sent per request, and
+        requests run concurrently within the concurrency limit. Texts longer
+        than the model's context are embedded in pieces, whose embeddings are
+        averaged, weighted by their token counts.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+        # Inputs to send, with the text each belongs to and its weight
+        pieces: List[Union[str, List[int]]] = []
+        owners, weights = [], []
+        for index, text in enumerate(texts):
+            if self.embedder.model.endswith('001'):
+                # Newlines hurt the first-generation models, see
+                # OpenAIEmbeddings
+                text = text.replace('\n', ' ')
+            # A token spans at least one byte, so short texts can't be too
+            # long, and don't need tokenizing
+            if len(text.encode('utf-8')) <= self.embedder.embedding_ctx_length:
+                pieces.append(text)
+                owners.append(index)
+                weights.append(1)
+                continue
+            for part in self._split_tokens(text):
+                pieces.append(part)
+                owners.append(index)
+                weights.append(len(part))
+
+        # The API takes strings or token lists, but not both in one request
+        strings = [i for i, piece in enumerate(pieces)
+                   if isinstance(piece, str)]
+        token_lists = [i for i, piece in enumerate(pieces)
+                       if not isinstance(piece, str)]
+        chunk_size = self.embedder.chunk_size
+        batches = [group[start:start + chunk_size]
+                   for group in (strings, token_lists)
+                   for start in range(0, len(group), chunk_size)]
+        results = await asyncio.gather(*[
+            self._embed_batch([pieces[i] for i in batch])
+            for batch in batches])
+        embeddings = [None] * len(pieces)
+        for batch, vectors in zip(batches, results):
+            for i, vector in zip(batch, vectors):
+                embeddings[i] = vector
+
+        if len(pieces) == len(texts):
+            return embeddings
+        grouped = [[] for _ in texts]
+        for owner, weight, vector in zip(owners, weights, embeddings):
+            grouped[owner].append((weight, vector))
+        averaged = []
+        for parts in grouped:
+            if len(parts) == 1:
+                averaged.append(parts[0][1])
+                continue
+            average = np.average([vector for _, vector in parts], axis=0,
+                                 weights=[weight for weight, _ in parts])
+            averaged.append((average / np.linalg.norm(average)).tolist())
+        return averaged
+
+    def _split_tokens(self, text: str) -> List[List[int]]:
+        """A text's tokens, in pieces that fit the model's context."""
+        # Imported here like OpenAIEmbeddings does; only long texts need it
+        import tiktoken
+        encoding = tiktoken.encoding_for_model(self.embedder.model)
+        tokens = encoding.encode(
+            text, allowed_special=self.embedder.allowed_special,
+            disallowed_special=self.embedder.disallowed_special)
+        size = self.embedder.embedding_ctx_length
+        return [tokens[start:start + size]
+                for start in range(0, len(tokens), size)]
+
+    async def _embed_batch(self, inputs: Sequence[Union[str, List[int]]]
+                           ) -> List[List[float]]:
+        """Embed one batch of inputs with one request."""
+        async with self._embedding_semaphore:
+            response = await asyncio.wait_for(
+                self.embedder.client.acreate(
+                    input=list(inputs),
+                    engine=self.embedder.deployment,
+                    request_timeout=self.embedder.request_timeout,
+                    headers=self.embedder.headers),
+                self.embedding_timeout)
+        data = sorted(response['data'], key=lambda item: item['index'])
+        return [item['embedding'] for item in data]
+
+    async def chat(self, chat_model: ChatOpenAI, messages: List[BaseMessage],
+                   callbacks: Optional[List[BaseCallbackHandler]] = None
+                   ) -> str:
+        """
+        Get a chat completion.
+
+        Args:
+            chat_model (ChatOpenAI): The model to ask; a streaming model
+                                     passes tokens to the callbacks.
+            messages (List[BaseMessage]): The prompt messages.
+            callbacks (Optional[List[BaseCallbackHandler]]): Callback
+                handlers for this call.
+
+        Returns:
+            str: The completion's text.
+        """
+        async with self._chat_semaphore:
+            result = await asyncio.wait_for(
+                chat_model.agenerate([messages], callbacks=callbacks),
+                self.chat_timeout)
+        return result.generations[0][0].message.content
@@ -0,0 +1,123 @@
+import os
+import json
+import subprocess
+from datetime import datetime, timezone
+from functools import lru_cache
+from typing import NamedTuple
+
+from landy.utils.logger import CustomLogger
+import landy
+
+logger = CustomLogger(__name__)
+
+# Where `python -m landy.utils.build_info` bakes the metadata so that it ships
+# inside the wheel and works without a .git directory
+BUILD_INFO_PATH = os.path.join(os.path.dirname(os.path.abspath(landy.__file__)),
+                               'build_info.json')
+
+# Checkout the package runs from, if any
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(landy.__file__)), '..')
+
+# Used when neither a baked file nor git is available
+UNKNOWN_COMMIT_HASH = 'unknown'
+UNKNOWN_COMMIT_TIMESTAMP = datetime.fromtimestamp(0, tz=timezone.utc)
+
+
+class BuildInfo(NamedTuple):
+    """
+    Commit metadata recorded alongside every answered question.
+    """
+    commit_hash: str
+    commit_timestamp: datetime
+
+
+def _read_baked_build_info(path: str) -> BuildInfo:
+    """
+    Read build metadata from a JSON file written at build time.
+
+    Args:
+        path (str): Path of the JSON file.
+
+    Returns:
+        BuildInfo: The baked commit hash and timestamp.
+    """
+    with open(path, 'r') as f:
+        data = json.load(f)
+    return BuildInfo(data['commit_hash'],
+                     datetime.fromisoformat(data['commit_timestamp']))
+
+
+def _read_git_build_info() -> BuildInfo:
+    """
+    Ask git for the current commit hash and timestamp with a single fork.
+
+    Returns:
+        BuildInfo: The current commit hash and timestamp.
+    """
+    output = subprocess.check_output(
+        ['git', 'log', '-1', '--format=%H%n%cI'],
+        cwd=os.path.dirname(os.path.abspath(landy.__file__)),
+        stderr=subprocess.DEVNULL).decode().split()
+    return BuildInfo(output[0], datetime.fromisoformat(output[1]))
+
+
+@lru_cache(maxsize=None)
+def get_build_info(path: str = BUILD_INFO_PATH,
+                   repo_dir: str = REPO_DIR) -> BuildInfo:
+    """
+    Get the commit hash and timestamp of the running code.
+
+    In a git checkout git is asked, as a baked build_info.json there is
+    likely left over from an earlier build; elsewhere the baked file is
+    read. The result is cached for the life of the process, so this is cheap
+    to call per question.
+
+    Args:
+        path (str): Path of the baked build metadata file.
+        repo_dir (str): Root of the checkout the code runs from.
+
+    Returns:
+        BuildInfo: The commit hash and timestamp.
+    """
+    build_info = None
+    # .git is a file in worktrees, hence exists rather than isdir
+    if os.path.exists(os.path.join(repo_dir, '.git')):
+        try:
+            build_info = _read_git_build_info()
+            source = 'git'
+        except (OSError, subprocess.CalledProcessError, IndexError):
+            logger.warning('Could not ask git for the commit')
+    if build_info is None:
+        if not os.path.exists(path):
+            logger.warning('No build metadata found, recording commit as '
+                           'unknown')
+            return BuildInfo(UNKNOWN_COMMIT_HASH, UNKNOWN_COMMIT_TIMESTAMP)
+        build_info = _read_baked_build_info(path)
+        source = path
+    logger.info(f'Running commit {build_info.commit_hash} '
+                f'({build_info.commit_timestamp.isoformat()}) from {source}')
+    return build_info
+
+
+def write_build_info(path: str = BUILD_INFO_PATH) -> BuildInfo:
+    """
+    Resolve the current commit from git and bake it into a JSON file.
+
+    Args:
+        path (str): Where to write the build metadata.
+
+    Returns:
+        BuildInfo: The metadata that was written.
+    """
+    build_info = _read_git_build_info()
+    with open(path, 'w') as f:
+        json.dump({
+            'commit_hash': build_info.commit_hash,
+            'commit_timestamp': build_info.commit_timestamp.isoformat()
+        }, f)
+    return build_info
+
+
+if __name__ == '__main__':
+    written = write_build_info()
+    logger.info(f'Wrote {written.commit_hash} to {BUILD_INFO_PATH}')
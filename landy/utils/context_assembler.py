@@ -0,0 +1,131 @@
+import os
+from functools import lru_cache
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import tiktoken
+
+from landy.utils.logger import CustomLogger
+
+
+logger = CustomLogger(__name__)
+
+# Model whose tokenizer chunk sizes and prompt budgets are measured with
+TOKENIZER_MODEL = 'gpt-4'
+# Tokens of retrieved context allowed in a prompt, and most chunks used
+CONTEXT_TOKEN_BUDGET = int(os.environ.get('CONTEXT_TOKEN_BUDGET', 2000))
+CONTEXT_MAX_CHUNKS = int(os.environ.get('CONTEXT_MAX_CHUNKS', 5))
+# Goes between chunks in the prompt
+CHUNK_SEPARATOR = '\n\n---\n\n'
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str = TOKENIZER_MODEL) -> tiktoken.Encoding:
+    """
+    Load a model's tokenizer once.
+
+    Args:
+        model (str): Name of the OpenAI model.
+
+    Returns:
+        tiktoken.Encoding: The model's tokenizer.
+    """
+    return tiktoken.encoding_for_model(model)
+
+
+def count_tokens(text: str) -> int:
+    """
+    Count the tokens of text for the chat model.
+
+    Args:
+        text (str): The text to count.
+
+    Returns:
+        int: Number of tokens.
+    """
+    return len(get_encoding().encode(text, disallowed_special=()))
+
+
+class ContextAssembler:
+    """
+    Picks the retrieved chunks that fit a prompt's token budget.
+
+    Chunks are taken in rank order; one that would overflow the budget is
+    skipped in favour of smaller, lower-ranked ones. Token counts stored with
+    the chunks at index time are used when available, so assembling a prompt
+    usually tokenizes nothing.
+
+    Usage:
+        assembler = ContextAssembler(token_budget=2000, max_chunks=5)
+        context = assembler.assemble([(text, n_tokens), ...])
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET,
+                 max_chunks: int = CONTEXT_MAX_CHUNKS,
+                 count_tokens: Callable[[str], int] = count_tokens,
+                 separator: str = CHUNK_SEPARATOR):
+        """
+        Initialize the assembler.
+
+        Args:
+            token_budget (int): Tokens the assembled context may use.
+            max_chunks (int): Most chunks the context may contain.
+            count_tokens (Callable[[str], int]): Counts a text's tokens when
+                                                 its count isn't known.
+            separator (str): Goes between chunks.
+        """
+        self.token_budget = token_budget
+        self.max_chunks = max_chunks
+        self.count_tokens = count_tokens
+        self.separator = separator
+        self._separator_tokens = None
+
+    def select(self, chunks: Iterable[Tuple[str, Optional[int]]]
+               ) -> List[str]:
+        """
+        Pick the chunks for a prompt.
+
+        Args:
+            chunks (Iterable[Tuple[str, Optional[int]]]): Chunk texts and
+                their token counts, or None if unknown, most relevant first.
+
+        Returns:
+            List[str]: The chosen chunk texts, most relevant first.
+        """
+        if self._separator_tokens is None:
+            self._separator_tokens = self.count_tokens(self.separator)
+        selected, used = [], 0
+        for text, n_tokens in chunks:
+            if len(selected) >= self.max_chunks:
+                break
+            if n_tokens is None:
+                n_tokens = self.count_tokens(text)
+            cost = n_tokens + (self._separator_tokens if selected else 0)
+            if used + cost > self.token_budget:
+                if not selected:
+                    # Better a truncated best chunk than no context at all
+                    selected.append(self._truncate(text))
+                    used = self.token_budget
+                continue
+            selected.append(text)
+            used += cost
+        logger.debug('Assembled %d chunks, about %d tokens', len(selected), used)
+        return selected
+
+    def assemble(self, chunks: Iterable[Tuple[str, Optional[int]]]) -> str:
+        """
+        Join the chunks picked by `select` into the prompt's context.
+
+        Args:
+            chunks (Iterable[Tuple[str, Optional[int]]]): Chunk texts and
+                their token counts, or None if unknown, most relevant first.
+
+        Returns:
+            str: The context text.
+        """
+        return self.separator.join(self.select(chunks))
+
+    def _truncate(self, text: str) -> str:
+        """Cut text down to roughly the token budget."""
+        n_tokens = self.count_tokens(text)
+        # Tokens aren't spread evenly, so leave a little headroom
+        return text[:len(text) * self.token_budget * 9 // (n_tokens * 10)]
@@ -0,0 +1,261 @@
+import os
+import json
+import hashlib
+import argparse
+from typing import (Dict, Iterable, Iterator, List, NamedTuple, Optional,
+                    Tuple)
+
+from landy.utils.logger import CustomLogger
+import landy
+
+logger = CustomLogger(__name__)
+
+# The scraped posts, one JSON object per line
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(landy.__file__)),
+                           '..', 'data', 'interim', 'corpus.jsonl')
+
+
+def content_hash(text: str) -> str:
+    """
+    Hash text for change detection.
+
+    Args:
+        text (str): The text to hash.
+
+    Returns:
+        str: Hex SHA-256 digest of the text.
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def is_url_id(post_id: str) -> bool:
+    """
+    Whether a post ID is the URL the post was scraped from, rather than the
+    row key of the old blogs.json.
+
+    Args:
+        post_id (str): ID of the post.
+
+    Returns:
+        bool: True for scraped posts.
+    """
+    return post_id.startswith(('http://', 'https://'))
+
+
+class Post(NamedTuple):
+    """
+    A post of the corpus.
+
+    Scraped posts are identified by their URL; posts converted from the old
+    blogs.json keep their row key until the same text is scraped under a
+    URL, which then replaces them (see `iter_corpus` in landy.index_builder).
+    """
+    id: str
+    url: Optional[str]
+    date: Optional[str]
+    content_hash: str
+    text: str
+
+    @classmethod
+    def from_text(cls, id: str, text: str, url: Optional[str] = None,
+                  date: Optional[str] = None) -> 'Post':
+        """
+        Make a post, hashing its text.
+
+        Args:
+            id (str): Stable ID of the post.
+            text (str): The post's text.
+            url (Optional[str]): Where it was scraped from.
+            date (Optional[str]): When it was last updated, as YYYY-MM-DD.
+
+        Returns:
+            Post: The post.
+        """
+        return cls(id, url, date, content_hash(text), text)
+
+    @classmethod
+    def from_record(cls, record: Dict) -> 'Post':
+        """
+        Make a post from a line of the corpus file.
+
+        Args:
+            record (Dict): The decoded line.
+
+        Returns:
+            Post: The post.
+        """
+        text = record['text']
+        return cls(record['id'], record.get('url'), record.get('date'),
+                   record.get('content_hash') or content_hash(text), text)
+
+
+def _dumps(post: Post) -> str:
+    """A post as a line of the corpus file."""
+    return json.dumps(post._asdict(), ensure_ascii=False) + '\n'
+
+
+def read_corpus(path: str = CORPUS_PATH) -> Iterator[Post]:
+    """
+    Stream the posts of a corpus file.
+
+    A post appended again replaces its earlier versions: each ID is yielded
+    once, with its last version, in the order those were written. Only the
+    IDs and their line offsets are held in memory. A half-written last line,
+    left by an interrupted append, is skipped with a warning.
+
+    Args:
+        path (str): Path of the JSONL corpus file.
+
+    Yields:
+        Post: The posts.
+
+    Raises:
+        ValueError: If a line other than the last isn't a valid post.
+    """
+    latest = {}
+    for offset, record in _read_records(path):
+        latest[record['id']] = offset
+    for offset, record in _read_records(path):
+        if latest[record['id']] == offset:
+            yield Post.from_record(record)
+
+
+def _read_records(path: str) -> Iterator[Tuple[int, Dict]]:
+    """Decoded lines of a corpus file, with their byte offsets."""
+    with open(path, 'rb') as f:
+        offset = 0
+        for number, line in enumerate(f, start=1):
+            start, offset = offset, offset + len(line)
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            if not (isinstance(record, dict) and 'id' in record
+                    and 'text' in record):
+                if not line.endswith(b'\n'):
+                    logger.warning(f'{path}:{number}: ignoring truncated '
+                                   f'last line')
+                    return
+                raise ValueError(f'{path}:{number}: not a valid post')
+            yield start, record
+
+
+def append_posts(posts: Iterable[Post], path: str = CORPUS_PATH) -> int:
+    """
+    Add posts to the end of a corpus file, creating it if needed.
+
+    Args:
+        posts (Iterable[Post]): The posts; new versions of posts already in
+                                the file replace them.
+        path (str): Path of the JSONL corpus file.
+
+    Returns:
+        int: Number of posts written.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    count = 0
+    with open(path, 'a', encoding='utf-8') as f:
+        for post in posts:
+            f.write(_dumps(post))
+            count += 1
+    return count
+
+
+def write_corpus(posts: Iterable[Post], path: str = CORPUS_PATH) -> int:
+    """
+    Replace a corpus file with the given posts, atomically.
+
+    Args:
+        posts (Iterable[Post]): The posts.
+        path (str): Path of the JSONL corpus file.
+
+    Returns:
+        int: Number of posts written.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    count = 0
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for post in posts:
+            f.write(_dumps(post))
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_legacy(path: str) -> Iterator[Post]:
+    """
+    Read posts from the files the corpus used to be kept in.
+
+    Understands the pandas-shaped blogs.json ({"blog": {"0": ...},
+    "date": {...}}) and the spider's output, as a JSON array or as JSON
+    lines. Scraped posts get their URL as ID.
+
+    Args:
+        path (str): Path of the file.
+
+    Yields:
+        Post: The posts.
+    """
+    if path.endswith('.jsonl'):
+        items = _json_lines(path)
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            dates = data.get('date', {})
+            for key, text in data['blog'].items():
+                date = dates.get(key)
+                # Older exports have placeholder numbers here
+                yield Post.from_text(str(key), text, date=date
+                                     if isinstance(date, str) else None)
+            return
+        items = data
+    for number, item in enumerate(items):
+        url = item.get('url')
+        yield Post.from_text(url or str(number), item['blog'], url=url,
+                             date=item.get('metadata', {}).get('date'))
+
+
+def _json_lines(path: str) -> Iterator[Dict]:
+    """The decoded lines of a JSON lines file."""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def main(argv: List[str] = None):
+    """
+    Command line entry point: `landy-corpus` or
+    `python -m landy.utils.corpus_store`.
+    """
+    parser = argparse.ArgumentParser(
+        description='Convert blogs.json or scraper output to the JSONL '
+                    'corpus.')
+    parser.add_argument('source', nargs='?',
+                        help='blogs.json, or the spider\'s results.json(l)')
+    parser.add_argument('-o', '--output', default=CORPUS_PATH,
+                        help='Corpus file to write')
+    parser.add_argument('--append', action='store_true',
+                        help='Add to the corpus instead of replacing it')
+    parser.add_argument('--compact', action='store_true',
+                        help='Drop the superseded versions of appended posts')
+    args = parser.parse_args(argv)
+
+    if args.compact:
+        count = write_corpus(read_corpus(args.output), args.output)
+        logger.info(f'Compacted {args.output} to {count} posts')
+        return
+    if not args.source:
+        parser.error('a source file is required unless --compact is given')
+    write = append_posts if args.append else write_corpus
+    count = write(read_legacy(args.source), args.output)
+    logger.info(f"{'Appended' if args.append else 'Wrote'} {count} posts "
+                f"to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
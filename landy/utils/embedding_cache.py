@@ -0,0 +1,309 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from array import array
+from contextlib import contextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain.embeddings.base import Embeddings
+
+from landy.utils.logger import CustomLogger
+import landy
+
+logger = CustomLogger(__name__)
+
+# Default on-disk location, shared by the bot and the index builder
+EMBEDDING_CACHE_PATH = os.environ.get(
+    'EMBEDDING_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(landy.__file__)), '..',
+                 'data', 'cache', 'embeddings.sqlite3'))
+EMBEDDING_CACHE_MAX_ENTRIES = int(
+    os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 200_000))
+# Cache hits whose last_used update is held back before it is written
+_MAX_PENDING_TOUCHES = 1000
+
+
+def embedding_key(model: str, text: str) -> str:
+    """
+    Content address of a text's embedding under a given model.
+
+    Args:
+        model (str): Name of the embedding model.
+        text (str): The embedded text.
+
+    Returns:
+        str: Hex SHA-256 digest of the model and text.
+    """
+    digest = hashlib.sha256(model.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Drop-in Embeddings wrapper that stores every embedding in SQLite, keyed
+    by a hash of (model, text), so each text is only ever embedded once.
+
+    The store is shared between threads and processes. When it grows past
+    `max_entries`, the least recently used embeddings are evicted. Hits only
+    note when an embedding was used; those times are written with the next
+    insert, so lookups never wait for a write lock held by another process.
+    The async methods do all SQLite work in a thread.
+
+    Usage:
+        embedder = CachedEmbeddings(OpenAIEmbeddings())
+        vectors = embedder.embed_documents(texts)
+        vector = await embedder.aembed_query(text)
+        print(embedder.hits, embedder.misses)
+    """
+
+    def __init__(self, embedder: Embeddings,
+                 path: str = EMBEDDING_CACHE_PATH,
+                 max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+                 model: Optional[str] = None,
+                 async_embed: Optional[
+                     Callable[[List[str]], Awaitable[List[List[float]]]]
+                 ] = None):
+        """
+        Initialize the cache, creating the SQLite store if needed.
+
+        Args:
+            embedder (Embeddings): The embedder to call on cache misses.
+            path (str): Path of the SQLite file.
+            max_entries (int): Number of embeddings kept before evicting.
+            model (Optional[str]): Model name used in cache keys; defaults to
+                                   the embedder's `model` attribute.
+            async_embed (Optional[Callable]): Coroutine function embedding a
+                list of texts, used by the async methods on cache misses.
+                Without it they run the embedder in a thread.
+        """
+        self.embedder = embedder
+        self.async_embed = async_embed
+        self.path = path
+        self.max_entries = max_entries
+        self.model = model or getattr(embedder, 'model',
+                                      type(embedder).__name__)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Key -> last time it was served, not yet written
+        self._touched: Dict[str, float] = {}
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL;')
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL
+            );
+        ''')
+        self._conn.execute('''
+            CREATE INDEX IF NOT EXISTS embeddings_last_used_idx
+                ON embeddings (last_used);
+        ''')
+        # At least the number of stored embeddings: this instance's inserts
+        # are added, and it is recounted before evicting. Other processes'
+        # inserts only show up then, so each evicts once its own inserts
+        # take the file past max_entries
+        self._count = self._conn.execute(
+            'SELECT COUNT(*) FROM embeddings;').fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM embeddings;').fetchone()[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed texts, only calling the wrapped embedder for unseen ones.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+        keys, found, missing = self._lookup(texts)
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            self._store(found, missing, vectors)
+        return [found[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        """
+        Embed a query, only calling the wrapped embedder if it is unseen.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The query's embedding.
+        """
+        key = embedding_key(self.model, text)
+        found = self._get([key])
+        if key in found:
+            self.hits += 1
+            return found[key]
+        self.misses += 1
+        vector = self.embedder.embed_query(text)
+        self._put({key: vector})
+        return vector
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Async version of `embed_documents`.
+
+        Args:
+            texts (List[str]): The texts to embed.
+
+        Returns:
+            List[List[float]]: One embedding per text, in input order.
+        """
+        # The file is shared with the index builder, so SQLite can wait on its
+        # lock; keep that off the event loop
+        keys, found, missing = await asyncio.to_thread(self._lookup, texts)
+        if missing:
+            if self.async_embed is not None:
+                vectors = await self.async_embed(list(missing.values()))
+            else:
+                vectors = await asyncio.to_thread(
+                    self.embedder.embed_documents, list(missing.values()))
+            await asyncio.to_thread(self._store, found, missing, vectors)
+        return [found[key] for key in keys]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """
+        Async version of `embed_query`.
+
+        Args:
+            text (str): The query to embed.
+
+        Returns:
+            List[float]: The query's embedding.
+        """
+        if self.async_embed is None:
+            return await asyncio.to_thread(self.embed_query, text)
+        return (await self.aembed_documents([text]))[0]
+
+    def close(self):
+        """Write the pending last_used times and close the SQLite connection."""
+        with self._lock:
+            try:
+                with self._transaction():
+                    self._write_touches()
+            finally:
+                self._conn.close()
+        logger.debug(f'Embedding cache closed ({self.hits} hits, '
+                     f'{self.misses} misses)')
+
+    def _lookup(self, texts: List[str]) -> Tuple[List[str],
+                                                 Dict[str, List[float]],
+                                                 Dict[str, str]]:
+        """
+        Look texts up, counting hits and misses.
+
+        Returns the texts' keys, the embeddings found by key and the texts
+        still to embed by key.
+        """
+        keys = [embedding_key(self.model, text) for text in texts]
+        found = self._get(keys)
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, text)
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        return keys, found, missing
+
+    def _store(self, found: Dict[str, List[float]], missing: Dict[str, str],
+               vectors: List[List[float]]):
+        """Store freshly embedded texts and add them to `found`."""
+        new = dict(zip(missing, vectors))
+        self._put(new)
+        found.update(new)
+
+    def _get(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Fetch stored embeddings and note that they were used."""
+        found = {}
+        now = time.time()
+        flush = False
+        # Stay well below SQLite's limit on the number of query parameters
+        for start in range(0, len(keys), 500):
+            batch = list(set(keys[start:start + 500]))
+            placeholders = ', '.join('?' * len(batch))
+            with self._lock:
+                rows = self._conn.execute(
+                    f'SELECT key, vector FROM embeddings '
+                    f'WHERE key IN ({placeholders});', batch).fetchall()
+                for key, _ in rows:
+                    self._touched[key] = now
+                flush = len(self._touched) >= _MAX_PENDING_TOUCHES
+            for key, blob in rows:
+                found[key] = array('f', blob).tolist()
+        if flush:
+            with self._lock, self._transaction():
+                self._write_touches()
+        return found
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Run the block in a transaction, rolled back if anything fails, e.g.
+        with SQLITE_BUSY while another process writes; otherwise the
+        connection would be stuck inside it. Call with the lock held.
+        """
+        self._conn.execute('BEGIN;')
+        try:
+            yield
+            self._conn.execute('COMMIT;')
+        except BaseException:
+            if self._conn.in_transaction:
+                self._conn.execute('ROLLBACK;')
+            raise
+
+    def _write_touches(self):
+        """
+        Write the pending last_used times; call with the lock held, inside a
+        transaction.
+        """
+        if self._touched:
+            self._conn.executemany(
+                'UPDATE embeddings SET last_used = ? WHERE key = ?;',
+                [(used, key) for key, used in self._touched.items()])
+            self._touched.clear()
+
+    def _put(self, vectors: Dict[str, List[float]]):
+        """Store embeddings, evicting the least recently used if needed."""
+        now = time.time()
+        rows = [(key, array('f', vector).tobytes(), now)
+                for key, vector in vectors.items()]
+        with self._lock:
+            with self._transaction():
+                # Before evicting, so recently served embeddings are kept
+                self._write_touches()
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO embeddings (key, vector, '
+                    'last_used) VALUES (?, ?, ?);', rows)
+                count = self._count + len(rows)
+                if count > self.max_entries:
+                    # Replaced rows and other processes make the running
+                    # count drift, so only a real count decides
+                    count = self._conn.execute(
+                        'SELECT COUNT(*) FROM embeddings;').fetchone()[0]
+                if count > self.max_entries:
+                    # Evict a little extra so we don't evict on every insert
+                    excess = count - int(self.max_entries * 0.9)
+                    self._conn.execute(
+                        'DELETE FROM embeddings WHERE key IN ('
+                        'SELECT key FROM embeddings ORDER BY last_used '
+                        'LIMIT ?);', [excess])
+                    count -= excess
+                    logger.debug(f'Evicted {excess} cached embeddings')
+            self._count = count
@@ -0,0 +1,286 @@
+import os
+import json
+import time
+import asyncio
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import asyncpg
+
+from landy.utils.logger import CustomLogger
+from landy.utils.qna_database import QnADatabase
+import landy
+
+logger = CustomLogger(__name__)
+
+# Feedback rows inserted per statement, and most seconds a row waits to be
+# written
+FEEDBACK_BATCH_SIZE = int(os.environ.get('FEEDBACK_BATCH_SIZE', 100))
+FEEDBACK_FLUSH_INTERVAL = float(os.environ.get('FEEDBACK_FLUSH_INTERVAL', 1.0))
+# Rows kept in memory; beyond that they go straight to the spill file
+FEEDBACK_MAX_BUFFER = int(os.environ.get('FEEDBACK_MAX_BUFFER', 1000))
+# Most seconds between attempts to reach the database while it is down
+FEEDBACK_MAX_RETRY_INTERVAL = float(
+    os.environ.get('FEEDBACK_MAX_RETRY_INTERVAL', 60.0))
+# Feedback that couldn't be written yet, one JSON object per line
+FEEDBACK_SPILL_PATH = os.environ.get(
+    'FEEDBACK_SPILL_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(landy.__file__)), '..',
+                 'data', 'feedback_spill.jsonl'))
+
+
+class FeedbackWriter:
+    """
+    Write-behind buffer for qna_feedback rows.
+
+    `submit` only appends a row to memory, so the bot can thank the user
+    right away. A background task inserts the buffered rows in batches once
+    `FEEDBACK_BATCH_SIZE` are waiting or every `FEEDBACK_FLUSH_INTERVAL`
+    seconds.
+
+    When the database can't be reached, the rows are appended to a local
+    spill file instead of being lost, and the writer retries with a growing
+    interval. Once the database is back, the spill file is replayed before
+    newer rows are written. Rows are inserted with ON CONFLICT DO NOTHING,
+    so replaying after a partial write doesn't duplicate them.
+
+    Usage:
+        writer = FeedbackWriter(db_uri)
+        writer.start()
+        writer.submit({'feedback_uuid': ..., 'question_uuid': ..., ...})
+        await writer.close()
+    """
+
+    def __init__(self, db_uri: str, batch_size: int = FEEDBACK_BATCH_SIZE,
+                 flush_interval: float = FEEDBACK_FLUSH_INTERVAL,
+                 max_buffer: int = FEEDBACK_MAX_BUFFER,
+                 max_retry_interval: float = FEEDBACK_MAX_RETRY_INTERVAL,
+                 spill_path: str = FEEDBACK_SPILL_PATH,
+                 clock=time.monotonic):
+        """
+        Initialize the writer; `start` begins writing.
+
+        Args:
+            db_uri (str): The database connection URI.
+            batch_size (int): Rows inserted per statement.
+            flush_interval (float): Most seconds between writes.
+            max_buffer (int): Rows kept in memory at most.
+            max_retry_interval (float): Most seconds between attempts while
+                                        the database is down.
+            spill_path (str): File rows are kept in while the database is
+                              down.
+            clock (Callable[[], float]): Monotonic time source.
+        """
+        self.db_uri = db_uri
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.max_retry_interval = max_retry_interval
+        self.spill_path = spill_path
+        self.clock = clock
+        self.written = 0
+        self.spilled = 0
+        self._buffer: List[Dict] = []
+        # Rows beyond max_buffer, spilled by the next flush
+        self._overflow: List[Dict] = []
+        self._retry_interval = 0.0
+        self._retry_at = 0.0
+        self._wakeup = None
+        self._task = None
+
+    @property
+    def database_down(self) -> bool:
+        """Whether the last attempt to write failed."""
+        return self._retry_interval > 0
+
+    def start(self):
+        """
+        Start the background writer; must be called from the event loop.
+        Feedback spilled by an earlier run is replayed on its first flush.
+        """
+        if self._task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the writer, writing or spilling everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        self._retry_at = 0.0
+        await self.flush()
+
+    def submit(self, feedback: Dict):
+        """
+        Queue a qna_feedback row to be written; never waits for the
+        database.
+
+        Args:
+            feedback (Dict): The row, by column name.
+        """
+        if len(self._buffer) >= self.max_buffer:
+            # Nothing is lost, but it waits for the database to come back;
+            # the file is written by the writer task, off the caller's path
+            self._overflow.append(feedback)
+        else:
+            self._buffer.append(feedback)
+        if ((self._overflow or len(self._buffer) >= self.batch_size)
+                and self._wakeup is not None):
+            self._wakeup.set()
+
+    async def _run(self):
+        """Writer loop: flush on a full batch or every flush_interval."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """
+        Spill the rows beyond the buffer, replay the spill file, then write
+        the buffered rows. While the database is down, buffered rows are
+        spilled instead, and it is only tried again once the retry interval
+        has passed.
+
+        Returns:
+            int: Number of rows written.
+        """
+        rows, self._buffer = self._buffer, []
+        overflow, self._overflow = self._overflow, []
+        await self._spill(overflow)
+        if self.database_down and self.clock() < self._retry_at:
+            await self._spill(rows)
+            return 0
+        written = 0
+        try:
+            written += await self._replay()
+            written += await self._insert(rows)
+        except Exception as error:
+            # Anything can go wrong talking to a database that's down, and
+            # the writer must survive it. _replay keeps its file until it's
+            # written, so only the buffered rows need saving
+            await self._spill(rows)
+            self._retry_interval = min(
+                max(self._retry_interval * 2, self.flush_interval),
+                self.max_retry_interval)
+            self._retry_at = self.clock() + self._retry_interval
+            logger.warning('Could not write feedback, retrying in %.0fs: %s',
+                           self._retry_interval, error)
+            return written
+        if self.database_down:
+            logger.info('Database is back, feedback is written again')
+            self._retry_interval = 0.0
+        return written
+
+    async def _insert(self, rows: List[Dict]) -> int:
+        """Insert rows into qna_feedback in batches."""
+        if not rows:
+            return 0
+        async with QnADatabase(self.db_uri) as db:
+            for start in range(0, len(rows), self.batch_size):
+                batch = rows[start:start + self.batch_size]
+                try:
+                    await db.insert_data('qna_feedback', batch,
+                                         ignore_conflicts=True)
+                except asyncpg.ForeignKeyViolationError:
+                    await self._insert_one_by_one(db, batch)
+        self.written += len(rows)
+        return len(rows)
+
+    async def _insert_one_by_one(self, db: QnADatabase, rows: List[Dict]):
+        """
+        Insert rows separately, dropping those whose question was never
+        stored, e.g. because the database was down while it was answered;
+        retrying them would fail forever.
+        """
+        for row in rows:
+            try:
+                await db.insert_data('qna_feedback', row,
+                                     ignore_conflicts=True)
+            except asyncpg.ForeignKeyViolationError:
+                logger.warning('Dropping feedback %s for unknown question %s',
+                               row['feedback_uuid'], row['question_uuid'],
+                               extra={'feedback': _encode(row)})
+
+    async def _replay(self) -> int:
+        """
+        Write the spilled rows, removing the spill file once they are in.
+        The file is renamed first, so rows spilled meanwhile aren't lost.
+        """
+        replaying_path = f'{self.spill_path}.replaying'
+        written = 0
+        while True:
+            # A replay that failed, or was cut short by a crash, left its
+            # file behind; it goes first
+            if not os.path.exists(replaying_path):
+                if not os.path.exists(self.spill_path):
+                    return written
+                os.replace(self.spill_path, replaying_path)
+            rows = await asyncio.to_thread(
+                lambda: list(_read_spill(replaying_path)))
+            written += await self._insert(rows)
+            os.remove(replaying_path)
+            logger.info('Replayed %d spilled feedback rows', len(rows))
+
+    async def _spill(self, rows: List[Dict]):
+        """
+        Append rows to the spill file and sync it to disk, in a thread so
+        the event loop doesn't wait on the disk.
+        """
+        if not rows:
+            return
+        await asyncio.to_thread(_append_spill, self.spill_path, rows)
+        self.spilled += len(rows)
+
+
+def _encode(row: Dict) -> Dict:
+    """A feedback row with its timestamp as ISO text, for JSON."""
+    timestamp = row.get('feedback_timestamp')
+    if isinstance(timestamp, datetime):
+        row = {**row, 'feedback_timestamp': timestamp.isoformat()}
+    return row
+
+
+def _append_spill(path: str, rows: List[Dict]):
+    """Append rows to a spill file and sync it to disk."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'a+b') as f:
+        # A crash while spilling leaves a line without its newline; end it,
+        # or the first row appended now would be glued onto it and lost
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+        for row in rows:
+            f.write((json.dumps(_encode(row), ensure_ascii=False)
+                     + '\n').encode('utf-8'))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _read_spill(path: str) -> Iterator[Dict]:
+    """
+    The rows of a spill file. Lines that aren't valid JSON, such as one
+    half-written by a crash, are skipped with a warning.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                # Only a crash while spilling leaves a half-written line, and
+                # one bad row mustn't hold back the rest forever
+                logger.warning('%s:%d: ignoring invalid line', path, number)
+                continue
+            timestamp: Optional[str] = row.get('feedback_timestamp')
+            if timestamp is not None:
+                row['feedback_timestamp'] = datetime.fromisoformat(timestamp)
+            yield row
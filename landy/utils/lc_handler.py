@@ -1,38 +1,147 @@
 import os
+import time
 import asyncio
-from typing import List
-from datetime import datetime
+from typing import (Any, Awaitable, Callable, Dict, Hashable, List,
+                    NamedTuple, Optional, Tuple)
+from datetime import datetime, timedelta
 
 # Importing necessary modules from the langchain and seria libraries.
+from langchain.callbacks.base import AsyncCallbackHandler
 from langchain.chat_models import ChatOpenAI
 from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.text_splitter import TokenTextSplitter
-from langchain.vectorstores import Chroma
 from langchain.prompts.chat import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate
 )
+from langchain.schema import BaseMessage
 
+from landy.index_builder import MANIFEST_NAME, load_manifest
+from landy.utils.answer_cache import (
+    CachedAnswer,
+    SemanticAnswerCache,
+    SingleFlight,
+    normalize_question
+)
+from landy.utils.async_llm import AsyncLLMClient
+from landy.utils.build_info import get_build_info
+from landy.utils.context_assembler import ContextAssembler
+from landy.utils.embedding_cache import CachedEmbeddings
+from landy.utils.lexical_index import BM25Index, reciprocal_rank_fusion
 from landy.utils.logger import CustomLogger
 from landy.utils.qna_database import QnADatabase
-import landy
+from landy.utils.qna_log_sink import mark_question_stored
+from landy.utils.tracing import span
+from landy.utils.vector_store import VECTOR_BACKEND, get_vector_store
 
 # Instantiating the logger
 logger = CustomLogger(__name__)
 
+# Semantic answer cache settings; a size of 0 disables the cache
+SEMANTIC_CACHE_THRESHOLD = float(
+    os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.96))
+SEMANTIC_CACHE_SIZE = int(os.environ.get('SEMANTIC_CACHE_SIZE', 1024))
+SEMANTIC_CACHE_TTL = float(os.environ.get('SEMANTIC_CACHE_TTL', 24 * 60 * 60))
+# Number of past answers loaded from qna_results into the cache at startup
+SEMANTIC_CACHE_WARM_SIZE = int(os.environ.get('SEMANTIC_CACHE_WARM_SIZE', 200))
+# Hybrid retrieval: candidates taken from each of the BM25 and vector
+# rankings, and the damping constant of the rank fusion merging them
+HYBRID_SEARCH_K = int(os.environ.get('HYBRID_SEARCH_K', 10))
+RRF_K = int(os.environ.get('RRF_K', 60))
+# Vector search is skipped when the best BM25 score is at least this many
+# times the runner-up's; 0 always runs it
+LEXICAL_DECISIVE_RATIO = float(os.environ.get('LEXICAL_DECISIVE_RATIO', 2.0))
+# Seconds between checks for a re-indexed vector store; 0 never reloads it
+INDEX_RELOAD_INTERVAL = float(os.environ.get('INDEX_RELOAD_INTERVAL', 60))
+
+
+def _get_index_version(manifest: Dict) -> str:
+    """
+    Version of an index, from its manifest.
+
+    Args:
+        manifest (Dict): The index's manifest.
+
+    Returns:
+        str: A short hex digest that changes whenever the set of indexed
+        chunks does, and only then.
+    """
+    return (manifest.get('version') or 'empty')[:16]
+
+
+def _manifest_stamp(persist_directory: str) -> Optional[Tuple[int, int]]:
+    """
+    Modification time and size of an index's manifest, which `landy-index`
+    and the spider's IndexingPipeline rewrite after every change they
+    persist; None if there is none.
+    """
+    try:
+        stat = os.stat(os.path.join(persist_directory, MANIFEST_NAME))
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class TokenCallbackHandler(AsyncCallbackHandler):
+    """
+    Forwards each streamed LLM token to an async callback.
+    """
+
+    def __init__(self, on_token: Callable[[str], Awaitable[None]]):
+        self.on_token = on_token
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        """Pass a newly generated token on."""
+        await self.on_token(token)
+
+
+class Answer(NamedTuple):
+    """
+    An answer and the UUID of the question it was originally generated for.
+    """
+    answer: str
+    source_question_uuid: str
+
 
 class LangChainHandler:
     """
     A class for handling the LangChain library components.
     """
 
-    def __init__(self):
-        # Creating instances of TokenTextSplitter, OpenAIEmbeddings and
-        # ChatOpenAI
-        self.text_splitter = TokenTextSplitter(chunk_size=6500)
-        self.embedder = OpenAIEmbeddings()
+    def __init__(self, persist_directory: Optional[str] = None):
+        """
+        Initialize the handler; `setup` loads the index.
+
+        Args:
+            persist_directory (Optional[str]): Directory of the vector index;
+                                               defaults to VECTOR_BACKEND's
+                                               own.
+        """
+        self.persist_directory = persist_directory
+        # Creating instances of OpenAIEmbeddings and ChatOpenAI
+        openai_embedder = OpenAIEmbeddings()
+        # Async OpenAI calls with bounded concurrency and timeouts
+        self.llm_client = AsyncLLMClient(openai_embedder)
+        # Embeddings are cached on disk, so repeated texts skip the API call
+        self.embedder = CachedEmbeddings(openai_embedder,
+                                         async_embed=self.llm_client.embed)
         self.chat = ChatOpenAI(temperature=0.9, model_name="gpt-4")
+        # Same model, but yields tokens as they are generated
+        self.streaming_chat = ChatOpenAI(temperature=0.9, model_name="gpt-4",
+                                         streaming=True)
+        # Previous answers, reused for near-paraphrased questions
+        self.answer_cache = SemanticAnswerCache(
+            threshold=SEMANTIC_CACHE_THRESHOLD,
+            max_size=SEMANTIC_CACHE_SIZE,
+            ttl=SEMANTIC_CACHE_TTL)
+        # Answers being computed, keyed by normalized question
+        self.in_flight = SingleFlight()
+        # Keyword index over the same chunks as the vector store
+        self.lexical_index = BM25Index()
+        # Token counts stored with the chunks at index time, by chunk ID
+        self.chunk_tokens = {}
+        # Fits the best retrieved chunks into the prompt's token budget
+        self.context_assembler = ContextAssembler()
 
         # Define the system and human message templates
         self.system_template_str = (
@@ -53,13 +162,60 @@ class LangChainHandler:
         )
         self.human_template_str = "Q: {question}"
 
+        # Guards the one-time warm-up so concurrent callers share it; also
+        # held while reloading a re-indexed store
+        self._setup_lock = asyncio.Lock()
+        self.is_ready = False
+        # When to next look for a re-indexed store
+        self._next_index_check = 0.0
+        # The Chroma client shares one duckdb connection, which isn't safe to
+        # query from several threads at once; also held while closing
+        self._db_lock = asyncio.Lock()
+
     async def __aenter__(self):
-        await self._build_templates()
-        await self._get_chroma_db()
+        await self.setup()
         return self
 
     async def __aexit__(self, exc_type, exc, tb):
-        pass
+        await self.close()
+
+    async def setup(self):
+        """
+        Build the prompt templates and load the vector store once.
+
+        Safe to call repeatedly and concurrently; only the first call does
+        any work, so a long-lived handler can be warmed at startup and shared
+        by every command afterwards.
+        """
+        if self.is_ready:
+            return
+        async with self._setup_lock:
+            if self.is_ready:
+                return
+            await self._build_templates()
+            await self._load_vector_store()
+            await self._build_lexical_index()
+            # Resolve the commit metadata now rather than on the first answer
+            await asyncio.to_thread(get_build_info)
+            await self._warm_answer_cache()
+            self.is_ready = True
+            logger.info("LangChainHandler warmed up")
+
+    async def close(self):
+        """
+        Release the vector store and embedding cache so the handler can be
+        discarded cleanly. The handler can't be used after closing.
+        """
+        async with self._setup_lock:
+            if not self.is_ready:
+                return
+            # Wait for any in-flight similarity search before dropping the DB
+            async with self._db_lock:
+                self.db.close()
+                self.db = None
+            self.embedder.close()
+            self.is_ready = False
+            logger.info("LangChainHandler closed")
 
     async def _build_templates(self):
         """
@@ -74,28 +230,300 @@ class LangChainHandler:
         self.chat_template = ChatPromptTemplate.from_messages([sys_template,
                                                                hum_template])
 
-    async def _get_chroma_db(self):
+    async def _load_vector_store(self):
+        """
+        Load the configured vector store, creating an empty one if needed.
+        The store in use, if any, is only replaced once the new one loaded.
+
+        Raises:
+            RuntimeError: If the index holds chunks but has no manifest, i.e.
+                          it predates `landy-index` and its chunks are too
+                          large for the prompt's token budget.
+        """
+        db = await asyncio.to_thread(get_vector_store, VECTOR_BACKEND,
+                                     persist_directory=self.persist_directory,
+                                     embedder=self.embedder)
+        # Taken before the manifest is read, so a change while loading is
+        # picked up by the next check
+        stamp = await asyncio.to_thread(_manifest_stamp, db.persist_directory)
+        manifest = await asyncio.to_thread(load_manifest,
+                                           db.persist_directory)
+        if not manifest['documents'] and db.count():
+            db.close()
+            raise RuntimeError(
+                f'The index in {db.persist_directory} was not built by '
+                f'landy-index; rebuild it with `landy-index --rebuild`')
+        if not manifest['documents']:
+            logger.warning('The index is empty; build it with `landy-index`')
+        self.db = db
+        self.persist_directory = db.persist_directory
+        self._loaded_stamp = stamp
+        # Every answer is retrieved from this version until the index is
+        # reloaded
+        self.index_version = _get_index_version(manifest)
+        logger.info(f"Existing {VECTOR_BACKEND} DB loaded")
+
+    async def _reload_if_reindexed(self):
+        """
+        Reload the vector store, the keyword index and the answer cache if
+        the index was rebuilt since it was loaded, e.g. by `landy-index` or
+        a crawl with INDEX_ITEMS on. Looks at most every
+        INDEX_RELOAD_INTERVAL seconds; a failed reload keeps the old index.
+        """
+        now = time.monotonic()
+        if INDEX_RELOAD_INTERVAL <= 0 or now < self._next_index_check:
+            return
+        self._next_index_check = now + INDEX_RELOAD_INTERVAL
+        stamp = await asyncio.to_thread(_manifest_stamp,
+                                        self.persist_directory)
+        if stamp == self._loaded_stamp:
+            return
+        async with self._setup_lock:
+            if not self.is_ready or stamp == self._loaded_stamp:
+                return
+            logger.info('The index was rebuilt, reloading it')
+            old_db = self.db
+            try:
+                await self._load_vector_store()
+            except Exception as error:
+                logger.error('Could not reload the index, keeping the one '
+                             'loaded: %s', error)
+                self._loaded_stamp = stamp
+                return
+            async with self._db_lock:
+                old_db.close()
+            await self._build_lexical_index()
+            # A new index version clears the answers retrieved from the old
+            await self._warm_answer_cache()
+
+    async def _build_lexical_index(self):
+        """
+        Index the vector store's chunks for keyword search and note their
+        token counts.
+        """
+        async with self._db_lock:
+            ids, documents, metadatas = await asyncio.to_thread(
+                self.db.get_all)
+        # Chunks indexed before token counts were stored are counted on use
+        self.chunk_tokens = {chunk_id: metadata.get('n_tokens')
+                             for chunk_id, metadata in zip(ids, metadatas)}
+        # Built aside and swapped in, as searches may run meanwhile
+        lexical_index = BM25Index()
+        await asyncio.to_thread(lexical_index.build, zip(ids, documents))
+        self.lexical_index = lexical_index
+        logger.info(f"Lexical index built over {len(self.lexical_index)} "
+                    f"chunks")
+
+    async def _vector_search(self, query_embedding: List[float],
+                             k: int) -> List[Tuple[str, str]]:
+        """
+        Find the chunks nearest to a query embedding.
+
+        Args:
+            query_embedding (List[float]): The query's embedding.
+            k (int): Maximum number of results.
+
+        Returns:
+            List[Tuple[str, str]]: Chunk IDs and texts, nearest first.
+        """
+        async with self._db_lock:
+            with span('vector_search'):
+                if self.db.runs_inline:
+                    hits = self.db.query([query_embedding], k)[0]
+                else:
+                    hits = (await asyncio.to_thread(
+                        self.db.query, [query_embedding], k))[0]
+        return [(chunk_id, text) for chunk_id, text, _ in hits]
+
+    async def _retrieve(
+            self, lexical_hits: List[Tuple[Hashable, float]],
+            query_embedding: Optional[List[float]]) -> List[Tuple[str, str]]:
         """
-        Create a Chroma database if it does not already exist, or load an
-        existing one.
+        Rank chunks for a query by fusing its BM25 and vector rankings.
+
+        Args:
+            lexical_hits (List[Tuple[Hashable, float]]): The query's BM25
+                                                        results.
+            query_embedding (Optional[List[float]]): The query's embedding;
+                None when the lexical match is decisive, which skips vector
+                search.
+
+        Returns:
+            List[Tuple[str, str]]: Chunk IDs and texts, most relevant first.
         """
-        # Constructing the directory path for the Chroma DB
-        here = os.path.dirname(os.path.abspath(landy.__file__)) # landy/landy
-        persist_directory = os.path.join(here, "..", "db")
-        # Creating a Chroma instance with the directory and the embedder
-        self.db = Chroma(persist_directory=persist_directory,
-                         embedding_function=self.embedder)
-        logger.info("Existing DB loaded")
+        lexical_ids = [chunk_id for chunk_id, _ in lexical_hits]
+        if query_embedding is None:
+            logger.debug('Lexical match is decisive, skipped vector search')
+            return [(chunk_id, self.lexical_index.text(chunk_id))
+                    for chunk_id in lexical_ids]
+        vector_hits = await self._vector_search(query_embedding,
+                                                HYBRID_SEARCH_K)
+        texts = dict(vector_hits)
+        fused = reciprocal_rank_fusion(
+            [lexical_ids, [chunk_id for chunk_id, _ in vector_hits]], k=RRF_K)
+        return [(chunk_id,
+                 texts.get(chunk_id) or self.lexical_index.text(chunk_id))
+                for chunk_id, _ in fused]
+
+    async def _warm_answer_cache(self):
+        """
+        Load recent answers without negative feedback, from the running
+        commit and index, into the answer cache.
+
+        Best-effort: the cache only saves work, so if the database or the
+        embeddings can't be reached, the handler starts with it empty.
+        """
+        build_info = get_build_info()
+        # The commit is resolved once; the index version changes when the
+        # index is reloaded
+        self.answer_cache.set_version((build_info.commit_hash,
+                                       self.index_version))
+        if not self.answer_cache.enabled or SEMANTIC_CACHE_WARM_SIZE <= 0:
+            return
+        now = datetime.utcnow()
+        try:
+            async with QnADatabase(os.environ.get("DB_URI")) as db:
+                rows = await db.fetch_reusable_answers(
+                    build_info.commit_hash, self.index_version,
+                    now - timedelta(seconds=self.answer_cache.ttl),
+                    SEMANTIC_CACHE_WARM_SIZE)
+            if not rows:
+                return
+            embeddings = await self.embedder.aembed_documents(
+                [row['question'] for row in rows])
+        except Exception as error:
+            logger.warning('Could not warm the answer cache: %s', error)
+            return
+        # Oldest first, so the newest answers are the last to be evicted
+        for row, embedding in reversed(list(zip(rows, embeddings))):
+            # question_timestamp is written as naive UTC, which asyncpg takes
+            # for local time; converting back the same way undoes that
+            asked_at = row['question_timestamp'].astimezone().replace(
+                tzinfo=None)
+            self.answer_cache.add(str(row['question_uuid']), row['question'],
+                                  row['answer'], embedding,
+                                  age=(now - asked_at).total_seconds())
+        logger.info(f"Answer cache warmed with {len(self.answer_cache)} "
+                    f"answers")
+
+    async def _lookup_cached_answer(
+            self, query: str,
+            query_embedding: Optional[List[float]] = None
+    ) -> Optional[CachedAnswer]:
+        """
+        Find a reusable answer to the same or a similar, earlier question.
+
+        Without an embedding only the same question, after normalization, is
+        looked up. Answers are dropped from the cache as soon as they get
+        negative feedback (see FeedbackView), so a hit is served without
+        asking the database.
+
+        Args:
+            query (str): The new question.
+            query_embedding (Optional[List[float]]): Embedding of the new
+                                                     question.
+
+        Returns:
+            Optional[CachedAnswer]: The reusable answer, if any.
+        """
+        if not self.answer_cache.enabled:
+            return None
+        if query_embedding is None:
+            cached = self.answer_cache.lookup_exact(query)
+        else:
+            cached = self.answer_cache.lookup(query_embedding)
+        return cached
+
+    async def _answer(
+            self, query: str, question_uuid: str,
+            on_token: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> Answer:
+        """
+        Produce an answer from the answer cache or the LLM.
+
+        Args:
+            query (str): The query to be asked.
+            question_uuid (str): UUID of the question a fresh answer is
+                                 generated for.
+            on_token (Optional[Callable[[str], Awaitable[None]]]): Called
+                with each token of a freshly generated answer.
+
+        Returns:
+            Answer: The answer and the question it was generated for.
+        """
+        # Reusing the answer to the same earlier question, if any
+        cached = await self._lookup_cached_answer(query)
+        if cached is not None:
+            return self._reuse(query, cached)
+
+        # Keyword search is local and takes well under a millisecond
+        lexical_hits = self.lexical_index.search(query, HYBRID_SEARCH_K)
+        decisive = BM25Index.is_decisive(lexical_hits, LEXICAL_DECISIVE_RATIO)
+        query_embedding = None
+        # A decisive keyword match answers without calling the embeddings
+        # API; the semantic cache is only consulted when there is an
+        # embedding anyway
+        if not decisive:
+            # Embedding the query
+            with span('embed'):
+                query_embedding = await self.embedder.aembed_query(query)
+            # Reusing the answer to a near-identical earlier question, if any
+            cached = await self._lookup_cached_answer(query, query_embedding)
+            if cached is not None:
+                return self._reuse(query, cached)
+
+        chunks = await self._retrieve(
+            lexical_hits, None if decisive else query_embedding)
+        with span('prompt'):
+            context = self.context_assembler.assemble(
+                (text, self.chunk_tokens.get(chunk_id))
+                for chunk_id, text in chunks)
+            # Formatting the chat prompt with the question and the retrieved
+            # context
+            msgs = self.chat_template.format_prompt(
+                question=query, doc=context).to_messages()
+        answer = await self._ask_llm(query, msgs, on_token)
+        # Making the answer available to similar future questions; answers
+        # found by keywords alone have no embedding to be cached under
+        if query_embedding is not None:
+            self.answer_cache.add(question_uuid, query, answer,
+                                  query_embedding)
+        return Answer(answer, question_uuid)
+
+    @staticmethod
+    def _reuse(query: str, cached: CachedAnswer) -> Answer:
+        """
+        Serve a cached answer to a new question.
+        """
+        logger.info('Reused answer to %r for %r', cached.question, query)
+        logger.debug('Reused answer: %r', cached.answer)
+        return Answer(cached.answer, cached.question_uuids[0])
 
     @logger.log_execution_time
-    async def ask_doc_based_question(self, query: str,
-                                     question_uuid: str) -> str:
+    async def ask_doc_based_question(
+            self, query: str, question_uuid: str,
+            on_token: Optional[Callable[[str], Awaitable[None]]] = None,
+            admit: Optional[Callable[[Callable[[], Awaitable[Any]]],
+                                     Awaitable[Any]]] = None
+    ) -> str:
         """
         Ask a question based on a list of input texts
                 and a query.
 
+        Concurrent questions that are identical after normalization share one
+        answer, but each is still recorded under its own question_uuid.
+
         Args:
             query (str): The query to be asked.
+            question_uuid (str): UUID the question is recorded under.
+            on_token (Optional[Callable[[str], Awaitable[None]]]): Called
+                with each token as the LLM generates the answer. Cached
+                answers, and answers shared with an identical question that
+                was already being answered, arrive in one piece instead.
+            admit (Optional[Callable]): Runs the answering, e.g. through
+                AdmissionQueue.submit. Only the first of identical
+                questions goes through it; the others wait for its answer
+                without taking a worker, a queue slot or a rate limit token.
 
         Returns:
             str: The answer to the query based on the input texts.
@@ -103,47 +531,75 @@ class LangChainHandler:
         
         # Generate question timestamp for DB
         question_timestamp = datetime.utcnow()
+        # Pick up a rebuilt index, if any, before answering from it
+        await self._reload_if_reindexed()
 
-        # Querying the Chroma DB for documents similar to the query
-        result_docs = await asyncio.to_thread(self.db.similarity_search, query)
-        # Getting the most relevant document
-        most_relevant_doc = result_docs[0].page_content
-        logger.debug('Found most relevant document from vecstore')
-
-        # Formatting the chat prompt with the question and the most relevant
-        # document
-        prompt = self.chat_template.format_prompt(
-            question=query,
-            doc=most_relevant_doc)
-        msgs = prompt.to_messages()
-        logger.debug('Asking LLM for doc-based answer...')
-        
-        # Sending the prompt to the chat model and getting the answer
-        answer = await asyncio.to_thread(self.chat, msgs)
-        answer = answer.content
-        logger.info(f'LLM answered "{query}": "{answer}"')
+        # Answering, or joining an identical question that is being answered
+        def answer():
+            return self._answer(query, question_uuid, on_token)
+
+        result, _ = await self.in_flight.run(
+            normalize_question(query),
+            answer if admit is None else lambda: admit(answer))
+        answer = result.answer
         
         # Collecting question data, including the ID, timestamp, commit hash, 
         # and commit timestamp
-        # Inserting the question data into the QnADatabase
+        # Inserting the question data into the QnADatabase; the schema is set
+        # up once at startup by QnADatabase.init_pool
+        build_info = get_build_info()
         async with QnADatabase(os.environ.get("DB_URI")) as db:
-            await db.create_tables()
-            current_commit_hash =  await db._get_current_commit_hash()
-            current_commit_timestamp =  (
-                await db._get_current_commit_timestamp()
-            )
-            current_commit_timestamp = datetime.strptime(
-                current_commit_timestamp, "%a %b %d %H:%M:%S %Y %z")
             question_data = {
                 'question_uuid': question_uuid,
                 'question': query,
                 'answer': answer,
                 'question_timestamp': question_timestamp,
-                'commit_hash': current_commit_hash,
-                'commit_hash_timestamp': current_commit_timestamp
+                'commit_hash': build_info.commit_hash,
+                'commit_hash_timestamp': build_info.commit_timestamp,
+                'index_version': self.index_version
             }
-            await db.insert_data('qna_results', question_data)
+            with span('db_write'):
+                await db.insert_data('qna_results', question_data)
         logger.debug('Question data inserted into the database')
+        # Its logs can reference it now
+        mark_question_stored(question_uuid)
+
+        # Tying feedback on this question to the reused answer
+        if result.source_question_uuid != question_uuid:
+            self.answer_cache.link(question_uuid, result.source_question_uuid)
         
         # Returning the answer
         return answer
+
+    async def _ask_llm(
+            self, query: str, msgs: List[BaseMessage],
+            on_token: Optional[Callable[[str], Awaitable[None]]] = None
+    ) -> str:
+        """
+        Have the LLM answer with the retrieved context.
+
+        Args:
+            query (str): The query to be asked.
+            msgs (List[BaseMessage]): The chat prompt, with the most relevant
+                                      chunks assembled to fit its token
+                                      budget.
+            on_token (Optional[Callable[[str], Awaitable[None]]]): If given,
+                the answer is streamed and each token passed to it.
+
+        Returns:
+            str: The LLM's answer.
+        """
+        logger.debug('Asking LLM for doc-based answer...')
+        
+        # Sending the prompt to the chat model and getting the answer
+        with span('llm'):
+            if on_token is not None:
+                answer = await self.llm_client.chat(
+                    self.streaming_chat, msgs,
+                    callbacks=[TokenCallbackHandler(on_token)])
+            else:
+                answer = await self.llm_client.chat(self.chat, msgs)
+        # The answer itself is long; keep it out of INFO logs
+        logger.info('LLM answered %r (%d chars)', query, len(answer))
+        logger.debug('LLM answer: %r', answer)
+        return answer
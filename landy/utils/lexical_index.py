@@ -0,0 +1,177 @@
+import re
+import math
+import heapq
+from collections import Counter, defaultdict
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+from landy.utils.logger import CustomLogger
+
+
+logger = CustomLogger(__name__)
+
+# Words, numbers and names; apostrophes and hyphens split terms
+_TERM_RE = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Split text into case-folded terms.
+
+    Args:
+        text (str): The text to tokenize.
+
+    Returns:
+        List[str]: The text's terms, in order.
+    """
+    return _TERM_RE.findall(text.casefold())
+
+
+def reciprocal_rank_fusion(rankings: Iterable[Sequence[Hashable]],
+                           k: int = 60) -> List[Tuple[Hashable, float]]:
+    """
+    Merge several rankings into one with reciprocal rank fusion.
+
+    Each document scores the sum of 1 / (k + rank) over the rankings it
+    appears in, so documents ranked well by several retrievers rise to the
+    top without their raw scores having to be comparable.
+
+    Args:
+        rankings (Iterable[Sequence[Hashable]]): Document IDs, best first,
+                                                 one sequence per retriever.
+        k (int): Damping constant; larger values flatten the rank weights.
+
+    Returns:
+        List[Tuple[Hashable, float]]: Document IDs and fused scores, best
+        first.
+    """
+    scores = defaultdict(float)
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+class BM25Index:
+    """
+    In-memory inverted index scored with Okapi BM25.
+
+    Exact terms such as item, dungeon and class names are matched locally,
+    without an embedding request.
+
+    Usage:
+        index = BM25Index()
+        index.build([("chunk-1", "Slenikon drops ..."), ...])
+        hits = index.search("Where does Slenikon drop?", k=10)
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        """
+        Initialize an empty BM25Index.
+
+        Args:
+            k1 (float): Term frequency saturation.
+            b (float): Document length normalization, from 0 (none) to 1.
+        """
+        self.k1 = k1
+        self.b = b
+        # Term -> [(document number, term frequency), ...]
+        self._postings: Dict[str, List[Tuple[int, int]]] = {}
+        self._idf: Dict[str, float] = {}
+        self._doc_ids: List[Hashable] = []
+        self._numbers: Dict[Hashable, int] = {}
+        self._texts: List[str] = []
+        self._norms: List[float] = []
+
+    def __len__(self):
+        return len(self._doc_ids)
+
+    def build(self, documents: Iterable[Tuple[Hashable, str]]):
+        """
+        Index documents, replacing anything indexed before.
+
+        Args:
+            documents (Iterable[Tuple[Hashable, str]]): Document IDs and
+                                                        texts.
+        """
+        postings = defaultdict(list)
+        doc_ids, texts, lengths = [], [], []
+        for number, (doc_id, text) in enumerate(documents):
+            terms = tokenize(text)
+            for term, frequency in Counter(terms).items():
+                postings[term].append((number, frequency))
+            doc_ids.append(doc_id)
+            texts.append(text)
+            lengths.append(len(terms))
+
+        count = len(doc_ids)
+        average_length = (sum(lengths) / count) if count else 0
+        self._postings = dict(postings)
+        self._idf = {
+            term: math.log(1 + (count - len(hits) + 0.5) / (len(hits) + 0.5))
+            for term, hits in postings.items()}
+        self._doc_ids = doc_ids
+        self._numbers = {doc_id: number
+                         for number, doc_id in enumerate(doc_ids)}
+        self._texts = texts
+        # Per-document part of the BM25 denominator, computed once
+        self._norms = [self.k1 * (1 - self.b + self.b * length
+                                  / (average_length or 1))
+                       for length in lengths]
+        logger.debug(f'BM25 index built over {count} documents and '
+                     f'{len(self._postings)} terms')
+
+    def text(self, doc_id: Hashable) -> str:
+        """
+        The indexed text of a document.
+
+        Args:
+            doc_id (Hashable): ID of the document.
+
+        Returns:
+            str: The document's text.
+        """
+        return self._texts[self._numbers[doc_id]]
+
+    def search(self, query: str, k: int = 10) -> List[Tuple[Hashable, float]]:
+        """
+        Find the documents best matching the query's terms.
+
+        Args:
+            query (str): The query text.
+            k (int): Maximum number of results.
+
+        Returns:
+            List[Tuple[Hashable, float]]: Document IDs and BM25 scores, best
+            first. Documents sharing no term with the query are left out.
+        """
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            idf = self._idf.get(term)
+            if idf is None:
+                continue
+            for number, frequency in self._postings[term]:
+                scores[number] += idf * frequency * (self.k1 + 1) / (
+                    frequency + self._norms[number])
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self._doc_ids[number], score) for number, score in best]
+
+    @staticmethod
+    def is_decisive(hits: Sequence[Tuple[Hashable, float]],
+                    ratio: float) -> bool:
+        """
+        Whether the best lexical hit clearly beats the rest, so that vector
+        search is unlikely to change the outcome.
+
+        Args:
+            hits (Sequence[Tuple[Hashable, float]]): Results of `search`.
+            ratio (float): How many times the runner-up's score the best
+                           score must be; 0 means never decisive.
+
+        Returns:
+            bool: True if the best hit is decisive.
+        """
+        if ratio <= 0 or not hits:
+            return False
+        if len(hits) == 1:
+            return True
+        return hits[0][1] >= ratio * hits[1][1]
@@ -1,8 +1,208 @@
+import os
 import sys
+import json
 import time
+import queue
+import atexit
 import logging
 import asyncio
+import threading
+from datetime import datetime, timezone
 from functools import wraps
+from typing import Any, Dict, Optional
+from logging.handlers import QueueHandler, QueueListener
+
+# Defaults of configure_logging, which reads LOG_MODE, LOG_FORMAT,
+# LOG_QUEUE_SIZE and LOG_QUEUE_POLICY from the environment when it runs
+LOG_MODE = 'sync'
+LOG_FORMAT = 'text'
+LOG_QUEUE_SIZE = 10_000
+LOG_QUEUE_POLICY = 'drop'
+
+TEXT_FORMAT = "[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"
+# Attributes every LogRecord has; anything else came in through `extra`
+_RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord(
+    '', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def record_extras(record: logging.LogRecord) -> Dict[str, Any]:
+    """
+    The fields a record was given through `extra`.
+
+    Args:
+        record (logging.LogRecord): The record.
+
+    Returns:
+        Dict[str, Any]: The extra fields by name.
+    """
+    return {key: value for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats each record as a single-line JSON object with its time, level,
+    logger name, message, exception if any, and any `extra` fields.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc)
+                            .isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        for key, value in record_extras(record).items():
+            entry.setdefault(key, value)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    QueueHandler for a bounded queue that either drops records or blocks
+    the caller once the queue is full.
+
+    Dropped records are counted and reported in a warning as soon as the
+    queue has room again.
+    """
+
+    def __init__(self, log_queue: queue.Queue, policy: str = LOG_QUEUE_POLICY):
+        if policy not in ('drop', 'block'):
+            raise ValueError(f"Unknown log queue policy {policy!r}; "
+                             f"expected 'drop' or 'block'")
+        super().__init__(log_queue)
+        self.policy = policy
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Only merge the arguments into the message; the listener's
+        # formatter does the rest, off the caller's thread
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(
+                record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.policy == 'block':
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return
+        if self.dropped:
+            with self._lock:
+                dropped, self.dropped = self.dropped, 0
+            try:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    'name': __name__, 'levelno': logging.WARNING,
+                    'levelname': 'WARNING',
+                    'msg': f'Dropped {dropped} log records; the log queue '
+                           f'was full'}))
+            except queue.Full:
+                with self._lock:
+                    self.dropped += dropped
+
+
+class _Listener(QueueListener):
+    """QueueListener whose stop waits for room in a full queue."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+def _formatter(fmt: str) -> logging.Formatter:
+    """The formatter for a LOG_FORMAT."""
+    if fmt == 'json':
+        return JsonFormatter()
+    if fmt == 'text':
+        return logging.Formatter(TEXT_FORMAT)
+    raise ValueError(f"Unknown log format {fmt!r}; expected 'text' or "
+                     f"'json'")
+
+
+# The handler every CustomLogger writes through, and the background
+# listener behind it in 'queue' mode
+_handler = None
+_listener = None
+_logger_names = set()
+
+
+def configure_logging(mode: Optional[str] = None, fmt: Optional[str] = None,
+                      queue_size: Optional[int] = None,
+                      policy: Optional[str] = None):
+    """
+    Set how every CustomLogger, existing or future, writes its records.
+
+    Options left out are read from the environment, falling back to the
+    LOG_* defaults above.
+
+    Args:
+        mode (Optional[str]): 'sync' writes records from the calling thread;
+            'queue' hands them to a background thread, so a slow stdout
+            never blocks the event loop.
+        fmt (Optional[str]): 'text' for human-readable lines, 'json' for one
+            JSON object per record.
+        queue_size (Optional[int]): Records allowed to wait for the
+            background thread in 'queue' mode.
+        policy (Optional[str]): When the queue is full, 'drop' the record or
+            'block' the caller.
+
+    Raises:
+        ValueError: If an option isn't one of its choices.
+    """
+    global _handler, _listener
+    mode = mode or os.environ.get('LOG_MODE', LOG_MODE)
+    fmt = fmt or os.environ.get('LOG_FORMAT', LOG_FORMAT)
+    queue_size = queue_size or int(os.environ.get('LOG_QUEUE_SIZE',
+                                                  LOG_QUEUE_SIZE))
+    policy = policy or os.environ.get('LOG_QUEUE_POLICY', LOG_QUEUE_POLICY)
+    if mode not in ('sync', 'queue'):
+        raise ValueError(f"Unknown log mode {mode!r}; expected 'sync' or "
+                         f"'queue'")
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(_formatter(fmt))
+    if mode == 'queue':
+        log_queue = queue.Queue(maxsize=queue_size)
+        handler = BoundedQueueHandler(log_queue, policy)
+        listener = _Listener(log_queue, stream_handler)
+        listener.start()
+    else:
+        handler, listener = stream_handler, None
+
+    old_handler, old_listener = _handler, _listener
+    _handler, _listener = handler, listener
+    for name in _logger_names:
+        logger = logging.getLogger(name)
+        if old_handler is not None:
+            logger.removeHandler(old_handler)
+        logger.addHandler(handler)
+    if old_listener is not None:
+        # Writes out whatever is still queued
+        old_listener.stop()
+
+
+def shutdown_logging():
+    """Write out queued records and stop the background thread, if any."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(shutdown_logging)
 
 
 class CustomLogger:
@@ -37,33 +237,44 @@ class CustomLogger:
         self.logger.handlers = []
 
     def _add_custom_handler(self):
-        """Add a custom stream handler to the logger."""
-        handler = logging.StreamHandler(sys.stdout)
-        handler.setLevel(self.level)
-        log_format = "[%(asctime)s] [%(levelname)s] %(name)s: %(message)s"
-        formatter = logging.Formatter(log_format)
-        handler.setFormatter(formatter)
-        self.logger.addHandler(handler)
-
-    def info(self, msg):
+        """Add the shared handler set up by `configure_logging`."""
+        if _handler is None:
+            configure_logging()
+        _logger_names.add(self.name)
+        self.logger.addHandler(_handler)
+        return _handler
+
+    # Like logging's, these take %-style arguments, which are only merged
+    # into the message if the level is enabled:
+    #     logger.debug('Embedded %d chunks', len(chunks))
+
+    def info(self, msg, *args, **kwargs):
         """Log an info message."""
-        self.logger.info(msg)
+        self.logger.info(msg, *args, **kwargs)
 
-    def warning(self, msg):
+    def warning(self, msg, *args, **kwargs):
         """Log a warning message."""
-        self.logger.warning(msg)
+        self.logger.warning(msg, *args, **kwargs)
 
-    def error(self, msg):
+    def error(self, msg, *args, **kwargs):
         """Log an error message."""
-        self.logger.error(msg)
+        self.logger.error(msg, *args, **kwargs)
 
-    def debug(self, msg):
+    def exception(self, msg, *args, **kwargs):
+        """Log an error message with the exception being handled."""
+        self.logger.exception(msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs):
         """Log a debug message."""
-        self.logger.debug(msg)
+        self.logger.debug(msg, *args, **kwargs)
 
-    def critical(self, msg):
+    def critical(self, msg, *args, **kwargs):
         """Log a critical message."""
-        self.logger.critical(msg)
+        self.logger.critical(msg, *args, **kwargs)
+
+    def is_enabled_for(self, level):
+        """Whether messages of the level are logged; guards costly ones."""
+        return self.logger.isEnabledFor(level)
 
     def log_execution_time(self, func):
         """
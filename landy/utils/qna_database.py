@@ -1,22 +1,49 @@
 import os
 import uuid
 import asyncio
-import subprocess
 from datetime import datetime
-from typing import Union, Dict, List
+from typing import Union, Dict, Iterable, List, Optional, Sequence
 
 import asyncpg
 
 from landy.utils.logger import CustomLogger
-import landy
 
 logger = CustomLogger(__file__)
 
+# Idempotent schema changes, applied in order after the tables are created
+MIGRATIONS = [
+    # Feedback is looked up per question, e.g. to find negative feedback
+    '''
+    CREATE INDEX IF NOT EXISTS qna_feedback_question_uuid_idx
+        ON qna_feedback (question_uuid);
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS qna_logs_question_uuid_idx
+        ON qna_logs (question_uuid);
+    ''',
+    # The vector index an answer was retrieved from, so answers from an
+    # older index aren't reused
+    '''
+    ALTER TABLE qna_results ADD COLUMN IF NOT EXISTS index_version VARCHAR;
+    ''',
+]
+
 class QnADatabase:
     """
     QnADatabase class for managing and interacting with a Q&A database.
+
+    By default every context opens and closes its own connection. Once
+    `init_pool` has been awaited, contexts borrow a connection from the
+    shared asyncpg pool instead. The schema is set up by `init_pool`, or,
+    without a pool, by the first connection of the process.
     """
 
+    # Process-wide connection pool shared by every QnADatabase context
+    pool: Optional[asyncpg.Pool] = None
+    # Whether this process has set up the schema
+    schema_ready: bool = False
+    _schema_lock: Optional[asyncio.Lock] = None
+
     def __init__(self, db_uri: str):
         """
         Initialize the QnADatabase instance with a connection URI.
@@ -25,16 +52,97 @@ class QnADatabase:
             db_uri (str): The database connection URI.
         """
         self.db_uri = db_uri
+        self.connection = None
+        self._pool = None
+
+    @classmethod
+    async def init_pool(cls, db_uri: str, min_size: int = 1,
+                        max_size: int = 10,
+                        statement_cache_size: int = 100) -> asyncpg.Pool:
+        """
+        Create the shared connection pool and set up the schema once.
+
+        Safe to call more than once; later calls reuse the existing pool.
+        If the schema can't be set up, the pool is closed again, so the next
+        call retries both.
+
+        Args:
+            db_uri (str): The database connection URI.
+            min_size (int): Number of connections the pool keeps open.
+            max_size (int): Maximum number of connections in the pool.
+            statement_cache_size (int): Size of each connection's prepared
+                                        statement cache; 0 disables it.
+
+        Returns:
+            asyncpg.Pool: The shared connection pool.
+        """
+        if cls.pool is None:
+            logger.debug("Creating the database connection pool")
+            pool = await asyncpg.create_pool(
+                db_uri,
+                min_size=min_size,
+                max_size=max_size,
+                statement_cache_size=statement_cache_size)
+            try:
+                async with pool.acquire() as connection:
+                    db = cls(db_uri)
+                    db.connection = connection
+                    await db.setup_schema()
+            except BaseException:
+                await pool.close()
+                raise
+            cls.pool = pool
+            cls.schema_ready = True
+            logger.info(f"Database pool ready ({min_size}-{max_size} conns)")
+        return cls.pool
+
+    @classmethod
+    async def close_pool(cls):
+        """Close the shared connection pool, if there is one."""
+        if cls.pool is not None:
+            logger.debug("Closing the database connection pool")
+            pool, cls.pool = cls.pool, None
+            await pool.close()
 
     async def connect(self):
-        """Connect to the database."""
+        """Connect to the database, borrowing from the pool if available."""
         logger.debug("Connecting to the database")
+        # Remember where the connection came from in case the pool is closed
+        # while this context is still open
+        self._pool = self.pool
+        if self._pool is not None:
+            self.connection = await self._pool.acquire()
+            return
         self.connection = await asyncpg.connect(self.db_uri)
+        if not self.schema_ready:
+            await self._setup_schema_once()
+
+    async def _setup_schema_once(self):
+        """
+        Set up the schema on this connection unless this process already
+        has; for when `init_pool` couldn't run or failed.
+        """
+        cls = type(self)
+        if cls._schema_lock is None:
+            cls._schema_lock = asyncio.Lock()
+        try:
+            async with cls._schema_lock:
+                if not cls.schema_ready:
+                    await self.setup_schema()
+                    cls.schema_ready = True
+        except BaseException:
+            await self.connection.close()
+            self.connection = None
+            raise
 
     async def disconnect(self):
-        """Disconnect from the database."""
+        """Disconnect from the database, returning pooled connections."""
         logger.debug("Disconnecting from the database")
-        await self.connection.close()
+        if self._pool is not None:
+            await self._pool.release(self.connection)
+        else:
+            await self.connection.close()
+        self.connection = None
 
     async def __aenter__(self):
         await self.connect()
@@ -43,32 +151,6 @@ class QnADatabase:
     async def __aexit__(self, exc_type, exc_value, traceback):
         await self.disconnect()
 
-    async def _get_current_commit_hash(self):
-        """
-        Get the current commit hash of the repository.
-
-        Returns:
-            str: The current commit hash of the repository.
-        """
-        return await asyncio.to_thread(
-            lambda: subprocess.check_output(
-                ['git', 'rev-parse', 'HEAD'],
-                cwd=os.path.dirname(os.path.abspath(landy.__file__))).decode().strip()
-        )
-
-    async def _get_current_commit_timestamp(self):
-        """
-        Get the current commit timestamp of the repository.
-
-        Returns:
-            str: The current commit timestamp of the repository.
-        """
-        return await asyncio.to_thread(
-            lambda: subprocess.check_output(
-                ['git', 'log', '-1', '--format=%cd'],
-                cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
-        )
-
     async def create_tables(self):
         """
         Create the necessary tables in the database if they don't exist.
@@ -111,7 +193,25 @@ class QnADatabase:
                 );
             ''')
 
-    async def insert_data(self, table_name: str, data: Union[Dict, List[Dict]]):
+    async def migrate(self):
+        """
+        Apply the schema migrations; each one is safe to re-run.
+        """
+        logger.debug("Applying schema migrations")
+        async with self.connection.transaction():
+            for migration in MIGRATIONS:
+                await self.connection.execute(migration)
+
+    async def setup_schema(self):
+        """
+        Create the tables and apply the migrations. Meant to run once at
+        startup rather than on every request.
+        """
+        await self.create_tables()
+        await self.migrate()
+
+    async def insert_data(self, table_name: str, data: Union[Dict, List[Dict]],
+                          ignore_conflicts: bool = False):
         """
         Insert data into the specified table.
 
@@ -119,8 +219,10 @@ class QnADatabase:
             table_name (str): The name of the table to insert data into.
             data (Union[Dict, List[Dict]]): A dictionary or list of dictionaries
             containing the data to be inserted.
+            ignore_conflicts (bool): Skip rows whose key already exists instead
+                                     of failing, so re-inserting is harmless.
         """
-        logger.debug(f"Inserting data into '{table_name}' table")
+        logger.debug("Inserting data into '%s' table", table_name)
         if isinstance(data, dict):
             data = [data]  # Convert single row to a list containing one row
 
@@ -130,12 +232,66 @@ class QnADatabase:
         all_values_placeholder = ', '.join([row_placeholder] * len(data))
         query = (
             f'INSERT INTO {table_name} ({columns}) VALUES '
-            f'{all_values_placeholder};'
+            f'{all_values_placeholder}'
+            f"{' ON CONFLICT DO NOTHING' if ignore_conflicts else ''};"
         )
 
         flattened_data = [value for row in data for value in row.values()]
         await self.connection.execute(query, *flattened_data)
 
+    async def copy_records(self, table_name: str, columns: Sequence[str],
+                           records: Iterable[Sequence]) -> str:
+        """
+        Bulk-insert rows with COPY, much faster than INSERT for large
+        batches.
+
+        Args:
+            table_name (str): The name of the table to copy the rows into.
+            columns (Sequence[str]): The columns the rows' values are for.
+            records (Iterable[Sequence]): The rows, as sequences of values.
+
+        Returns:
+            str: The COPY command's status, e.g. 'COPY 100'.
+        """
+        return await self.connection.copy_records_to_table(
+            table_name, records=records, columns=list(columns))
+
+    async def fetch_reusable_answers(self, commit_hash: str,
+                                     index_version: str, since: datetime,
+                                     limit: int) -> List[asyncpg.Record]:
+        """
+        Fetch the most recent answers from a commit and vector index that got
+        no negative feedback.
+
+        Args:
+            commit_hash (str): Only answers produced by this commit are
+                               returned.
+            index_version (str): Only answers retrieved from this version of
+                                 the vector index are returned.
+            since (datetime): Only answers to questions asked after this are
+                              returned.
+            limit (int): Maximum number of answers to return.
+
+        Returns:
+            List[asyncpg.Record]: Rows with question_uuid, question, answer
+            and question_timestamp, newest first.
+        """
+        query = '''
+            SELECT r.question_uuid, r.question, r.answer, r.question_timestamp
+            FROM qna_results r
+            WHERE r.commit_hash = $1
+              AND r.index_version = $2
+              AND r.question_timestamp > $3
+              AND NOT EXISTS (
+                  SELECT 1 FROM qna_feedback f
+                  WHERE f.question_uuid = r.question_uuid
+                    AND NOT f.is_positive)
+            ORDER BY r.question_timestamp DESC
+            LIMIT $4;
+        '''
+        return await self.connection.fetch(query, commit_hash, index_version,
+                                           since, limit)
+
     async def delete_data(self, table_name: str, condition: str):
         """
         Delete data from the specified table based on a given condition.
@@ -0,0 +1,306 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from landy.utils.logger import CustomLogger, record_extras
+from landy.utils.qna_database import QnADatabase
+
+logger = CustomLogger(__name__)
+
+# Records at or above this level, logged while answering a question, are
+# stored in qna_logs
+QNA_LOG_LEVEL = os.environ.get('QNA_LOG_LEVEL', 'INFO')
+# Records written per COPY, and most seconds a record waits to be written
+QNA_LOG_BATCH_SIZE = int(os.environ.get('QNA_LOG_BATCH_SIZE', 500))
+QNA_LOG_FLUSH_INTERVAL = float(os.environ.get('QNA_LOG_FLUSH_INTERVAL', 2.0))
+# Records kept in memory before new ones are dropped
+QNA_LOG_MAX_BUFFER = int(os.environ.get('QNA_LOG_MAX_BUFFER', 10_000))
+# Seconds a question's records wait for its qna_results row before they are
+# written without the reference
+QNA_LOG_HOLD_SECONDS = float(os.environ.get('QNA_LOG_HOLD_SECONDS', 300))
+
+QNA_LOG_COLUMNS = ('log_uuid', 'question_uuid', 'log_level', 'log_timestamp',
+                   'log_message', 'log_module', 'log_additional_data')
+
+# UUID of the question being answered in the current context
+question_uuid_var: ContextVar[Optional[str]] = ContextVar('question_uuid',
+                                                          default=None)
+
+# The installed sink, if any
+_sink = None
+
+
+@contextmanager
+def question_context(question_uuid: str) -> Iterator[None]:
+    """
+    Tag everything logged inside the block with a question's UUID.
+
+    Args:
+        question_uuid (str): UUID of the question being answered.
+    """
+    token = question_uuid_var.set(question_uuid)
+    try:
+        yield
+    finally:
+        question_uuid_var.reset(token)
+
+
+def mark_question_stored(question_uuid: str):
+    """
+    Tell the installed sink, if any, that a question's qna_results row
+    exists, so its records can be written.
+
+    Args:
+        question_uuid (str): UUID of the stored question.
+    """
+    if _sink is not None:
+        _sink.question_stored(question_uuid)
+
+
+class QnALogSink(logging.Handler):
+    """
+    Logging handler that stores the records of each question in qna_logs.
+
+    Records logged inside a `question_context` are buffered in memory and
+    written in batches with COPY by a background task, once
+    `QNA_LOG_BATCH_SIZE` are waiting or every `QNA_LOG_FLUSH_INTERVAL`
+    seconds. `emit` only appends to the buffer, so logging never waits for
+    the database; when the buffer is full, records are dropped.
+
+    qna_logs references qna_results, so a question's records are held back
+    until `question_stored` is called for it. Records of questions that are
+    never stored, e.g. rejected ones, are written after
+    `QNA_LOG_HOLD_SECONDS` without the reference, their question's UUID kept
+    in the additional data.
+
+    Usage:
+        sink = QnALogSink(db_uri)
+        sink.start()
+        with question_context(question_uuid):
+            logger.info('Answering...')
+        sink.question_stored(question_uuid)
+        await sink.stop()
+    """
+
+    def __init__(self, db_uri: str, level=QNA_LOG_LEVEL,
+                 batch_size: int = QNA_LOG_BATCH_SIZE,
+                 flush_interval: float = QNA_LOG_FLUSH_INTERVAL,
+                 max_buffer: int = QNA_LOG_MAX_BUFFER,
+                 hold_seconds: float = QNA_LOG_HOLD_SECONDS,
+                 clock=time.monotonic):
+        """
+        Initialize the sink; `start` begins writing.
+
+        Args:
+            db_uri (str): The database connection URI.
+            level: Lowest level of the records stored.
+            batch_size (int): Records written per COPY.
+            flush_interval (float): Most seconds between writes.
+            max_buffer (int): Records kept in memory at most.
+            hold_seconds (float): Seconds records wait for their question's
+                                  row.
+            clock (Callable[[], float]): Monotonic time source.
+        """
+        super().__init__(level)
+        self.db_uri = db_uri
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.hold_seconds = hold_seconds
+        self.clock = clock
+        self.dropped = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        # Rows ready to be written
+        self._ready: List[list] = []
+        # Question UUID -> (time first held, rows) for unstored questions
+        self._held: Dict[str, tuple] = OrderedDict()
+        self._buffered = 0
+        # Recently stored questions, whose records go straight to _ready
+        self._stored = OrderedDict()
+        self._loop = None
+        self._wakeup = None
+        self._task = None
+
+    def start(self):
+        """
+        Start the background writer and begin capturing records; must be
+        called from the event loop.
+        """
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        logging.getLogger().addHandler(self)
+        logger.info('Storing question logs in qna_logs')
+
+    async def stop(self):
+        """Stop capturing records and write everything still buffered."""
+        logging.getLogger().removeHandler(self)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush_to_db(release_held=True)
+
+    def emit(self, record: logging.LogRecord):
+        question_uuid = question_uuid_var.get()
+        # The sink's own records would feed back into it
+        if question_uuid is None or record.name == __name__:
+            return
+        try:
+            row = self._row(record, question_uuid)
+        except Exception:
+            self.handleError(record)
+            return
+        with self._lock:
+            if self._buffered >= self.max_buffer:
+                self.dropped += 1
+                return
+            self._buffered += 1
+            if question_uuid in self._stored:
+                self._ready.append(row)
+            elif question_uuid in self._held:
+                self._held[question_uuid][1].append(row)
+            else:
+                self._held[question_uuid] = (self.clock(), [row])
+            batch_ready = len(self._ready) >= self.batch_size
+        if batch_ready:
+            self._wake()
+
+    def _row(self, record: logging.LogRecord, question_uuid: str) -> list:
+        """A qna_logs row for a record, with its additional data unencoded."""
+        data = {'function': record.funcName, 'line': record.lineno}
+        if record.exc_info:
+            data['exception'] = logging.Formatter().formatException(
+                record.exc_info)
+        elif record.exc_text:
+            data['exception'] = record.exc_text
+        data.update(record_extras(record))
+        return [uuid.uuid4(), uuid.UUID(str(question_uuid)),
+                record.levelname,
+                datetime.fromtimestamp(record.created, timezone.utc),
+                record.getMessage(), record.name, data]
+
+    def _wake(self):
+        """Wake the writer from any thread."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def question_stored(self, question_uuid: str):
+        """
+        Release a question's held records, and write its later ones as they
+        come, now that its qna_results row exists.
+
+        Args:
+            question_uuid (str): UUID of the stored question.
+        """
+        with self._lock:
+            self._stored[question_uuid] = None
+            while len(self._stored) > self.max_buffer:
+                self._stored.popitem(last=False)
+            _, rows = self._held.pop(question_uuid, (None, []))
+            self._ready.extend(rows)
+            batch_ready = len(self._ready) >= self.batch_size
+        if batch_ready:
+            self._wake()
+
+    def _release_expired(self, everything: bool = False):
+        """
+        Move the records of questions held too long to _ready, without their
+        reference to qna_results. Call with the lock held.
+        """
+        now = self.clock()
+        for question_uuid in list(self._held):
+            held_at, rows = self._held[question_uuid]
+            if not everything and now - held_at < self.hold_seconds:
+                # Held in order, so the rest are newer
+                break
+            del self._held[question_uuid]
+            for row in rows:
+                row[6]['question_uuid'] = question_uuid
+                row[1] = None
+            self._ready.extend(rows)
+
+    async def _run(self):
+        """Writer loop: flush on a full batch or every flush_interval."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(),
+                                       self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush_to_db()
+
+    async def flush_to_db(self, release_held: bool = False) -> int:
+        """
+        Write the records that are ready to qna_logs.
+
+        Args:
+            release_held (bool): Also write the records of questions that
+                                 weren't stored, without the reference.
+
+        Returns:
+            int: Number of records written.
+        """
+        with self._lock:
+            self._release_expired(everything=release_held)
+            rows, self._ready = self._ready, []
+            self._buffered -= len(rows)
+        if not rows:
+            return 0
+        records = [tuple(row[:6]) + (json.dumps(row[6], default=str),)
+                   for row in rows]
+        try:
+            async with QnADatabase(self.db_uri) as db:
+                for start in range(0, len(records), self.batch_size):
+                    await db.copy_records(
+                        'qna_logs', QNA_LOG_COLUMNS,
+                        records[start:start + self.batch_size])
+        except Exception as error:
+            # Retrying could repeat the failure forever; the logs aren't
+            # worth more than the bot
+            self.dropped += len(records)
+            logger.warning('Could not write %d records to qna_logs: %s',
+                           len(records), error)
+            return 0
+        self.written += len(records)
+        return len(records)
+
+
+def install_qna_log_sink(db_uri: str, **kwargs) -> QnALogSink:
+    """
+    Create and start the process-wide sink, so `mark_question_stored`
+    reaches it; must be called from the event loop.
+
+    Args:
+        db_uri (str): The database connection URI.
+        **kwargs: Passed to QnALogSink.
+
+    Returns:
+        QnALogSink: The running sink.
+    """
+    global _sink
+    if _sink is None:
+        _sink = QnALogSink(db_uri, **kwargs)
+        _sink.start()
+    return _sink
+
+
+async def uninstall_qna_log_sink():
+    """Stop the process-wide sink, if any, writing what it still holds."""
+    global _sink
+    if _sink is not None:
+        sink, _sink = _sink, None
+        await sink.stop()
@@ -2,7 +2,11 @@ import re
 import string
 import json
 import os
-from functools import reduce
+import time
+import multiprocessing
+from collections import defaultdict
+from functools import lru_cache, reduce
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence
 from unicodedata import normalize
 from bs4 import BeautifulSoup
 from nltk.corpus import stopwords
@@ -14,12 +18,81 @@ from landy.utils.logger import CustomLogger
 
 logger = CustomLogger(__name__)
 
+# Tags, comments, doctypes and character references; without any of these
+# BeautifulSoup would return the text unchanged
+_MARKUP_RE = re.compile(r"<[a-zA-Z/!?]|&(?:#\d+|#x[\da-fA-F]+|\w+);")
+_URL_RE = re.compile(r"http\S+|www\S+|https\S+")
+_PUNCTUATION = frozenset(string.punctuation)
+
+# Token steps the compiled pipeline can run, in the order it runs them
+TOKEN_STEPS = ('remove_punctuation', 'remove_stopwords', 'lemmatize')
+
+# Each pool worker's copy of the preprocessor, set up by _init_worker
+_worker_preprocessor = None
+
+
+@lru_cache(maxsize=None)
+def _english_stopwords() -> frozenset:
+    """English stopwords, loaded once per process."""
+    return frozenset(stopwords.words("english"))
+
+
+@lru_cache(maxsize=None)
+def _lemmatize() -> Callable[[str], str]:
+    """
+    WordNet lemmatization, loaded once per process and memoized per word.
+    """
+    return lru_cache(maxsize=100_000)(WordNetLemmatizer().lemmatize)
+
+
+def _init_worker(preprocessor):
+    """Keep the preprocessor a pool worker was sent."""
+    global _worker_preprocessor
+    _worker_preprocessor = preprocessor
+
+
+def _preprocess_in_worker(text):
+    """
+    Preprocess one text in a pool worker, returning it with the timings it
+    added, if any, for the parent to merge.
+    """
+    text = _worker_preprocessor.preprocess(text)
+    if not _worker_preprocessor.timed:
+        return text, None
+    timings = dict(_worker_preprocessor.timings)
+    _worker_preprocessor.timings.clear()
+    return text, timings
+
+
 class TextPreprocessor:
     """
     Class for preprocessing text using a sequence of defined text processing
     steps.
+
+    Token steps (see TOKEN_STEPS) run in a compiled pipeline: the text is
+    tokenized once, every enabled token step is applied in a single pass over
+    the tokens and the tokens are joined back into text. Their linguistic
+    resources are loaded once per process. When timed, the token steps run
+    one after another instead, so each gets its own timing.
+
+    Usage:
+        preprocessor = TextPreprocessor(token_steps=['remove_stopwords'],
+                                        timed=True)
+        text = preprocessor.preprocess(raw_text)
+        preprocessor.log_timings()
     """
-    def __init__(self):
+    def __init__(self, token_steps: Sequence[str] = (), timed: bool = False):
+        """
+        Initialize the preprocessor.
+
+        Args:
+            token_steps (Sequence[str]): Token steps to enable, from
+                                         TOKEN_STEPS.
+            timed (bool): Record each step's wall time and throughput.
+        """
+        unknown = set(token_steps) - set(TOKEN_STEPS)
+        if unknown:
+            raise ValueError(f'Unknown token steps: {sorted(unknown)}')
         # Define preprocessing steps
         self.steps = [
             # self.convert_to_lowercase,
@@ -27,12 +100,64 @@ class TextPreprocessor:
             self.remove_urls,
             self.norm_unicode_data,
             self.replace_newlines,
-            # self.tokenize,
-            # self.remove_punctuation,
-            # self.remove_stopwords,
-            # self.lemmatize,
-            # self.tokens_to_text,
         ]
+        self.token_steps = [step for step in TOKEN_STEPS
+                            if step in token_steps]
+        self.timed = timed
+        # Step name -> [calls, seconds, characters in]
+        self.timings: Dict[str, List] = defaultdict(lambda: [0, 0.0, 0])
+        self._stages = None
+
+    def __getstate__(self):
+        # Compiled stages hold process-local resources; workers compile
+        # their own. Workers send their timings back with each result.
+        state = self.__dict__.copy()
+        state['_stages'] = None
+        state['timings'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.timings = defaultdict(lambda: [0, 0.0, 0])
+
+    @property
+    def stages(self) -> List:
+        """
+        The named functions `preprocess` runs, compiled on first use.
+        """
+        if self._stages is None:
+            stages = [(step.__name__, step) for step in self.steps]
+            if self.token_steps:
+                stages.append(('tokenize', self.tokenize))
+                if self.timed:
+                    # A fused pass can't tell its steps' times apart
+                    stages += [(step, getattr(self, step))
+                               for step in self.token_steps]
+                else:
+                    stages.append(('+'.join(self.token_steps),
+                                   self.compile_token_pass()))
+                stages.append(('tokens_to_text', self.tokens_to_text))
+            self._stages = stages
+        return self._stages
+
+    def compile_token_pass(self) -> Callable[[List[str]], List[str]]:
+        """
+        Fuse the enabled token steps into one pass over a token list.
+
+        Returns:
+            Callable[[List[str]], List[str]]: The fused token steps.
+        """
+        drop = frozenset()
+        if 'remove_punctuation' in self.token_steps:
+            drop |= _PUNCTUATION
+        if 'remove_stopwords' in self.token_steps:
+            drop |= _english_stopwords()
+        if 'lemmatize' in self.token_steps:
+            lemmatize = _lemmatize()
+            return lambda tokens: [lemmatize(token) for token in tokens
+                                   if token not in drop]
+        return lambda tokens: [token for token in tokens
+                               if token not in drop]
 
     def preprocess(self, text):
         """
@@ -44,7 +169,73 @@ class TextPreprocessor:
         Returns:
             str: The preprocessed text.
         """
-        return reduce(lambda result, step: step(result), self.steps, text)
+        if not self.timed:
+            return reduce(lambda result, stage: stage[1](result),
+                          self.stages, text)
+        for name, step in self.stages:
+            size = len(text) if isinstance(text, str) else sum(map(len, text))
+            started = time.perf_counter()
+            text = step(text)
+            timing = self.timings[name]
+            timing[0] += 1
+            timing[1] += time.perf_counter() - started
+            timing[2] += size
+        return text
+
+    def merge_timings(self, timings: Dict[str, List]):
+        """
+        Add timings recorded elsewhere, e.g. in a pool worker, to this
+        preprocessor's.
+
+        Args:
+            timings (Dict[str, List]): Step name -> [calls, seconds,
+                                       characters in].
+        """
+        for name, counts in timings.items():
+            self.timings[name] = [total + count for total, count
+                                  in zip(self.timings[name], counts)]
+
+    def log_timings(self):
+        """
+        Log each step's total wall time and throughput so far.
+        """
+        for name, (calls, seconds, characters) in self.timings.items():
+            rate = characters / seconds / 1e6 if seconds else float('inf')
+            logger.info(f'{name}: {calls} calls, {seconds * 1000:.1f} ms, '
+                        f'{rate:.1f} M chars/s')
+
+    def preprocess_many(self, texts: Iterable[str],
+                        processes: Optional[int] = None,
+                        chunksize: int = 16) -> Iterator[str]:
+        """
+        Preprocess many texts in parallel, in a pool of processes.
+
+        Texts are streamed to the workers `chunksize` at a time and the
+        results are yielded in input order as they become available. When
+        timed, the workers' timings are added to this preprocessor's.
+
+        Args:
+            texts (Iterable[str]): The input texts.
+            processes (Optional[int]): Worker processes; defaults to the
+                                       number of CPUs. 1 preprocesses in this
+                                       process.
+            chunksize (int): Texts sent to a worker at once.
+
+        Yields:
+            str: The preprocessed texts, in input order.
+        """
+        processes = processes or os.cpu_count() or 1
+        if processes == 1:
+            yield from map(self.preprocess, texts)
+            return
+        # The preprocessor is pickled to each worker once, not per text
+        with multiprocessing.Pool(processes, initializer=_init_worker,
+                                  initargs=(self,)) as pool:
+            for text, timings in pool.imap(_preprocess_in_worker, texts,
+                                           chunksize=chunksize):
+                if timings:
+                    self.merge_timings(timings)
+                yield text
 
     @staticmethod
     def convert_to_lowercase(text):
@@ -70,6 +261,10 @@ class TextPreprocessor:
         Returns:
             str: Text without HTML tags.
         """
+        # Building a parse tree is by far the slowest step; skip it for
+        # plain text
+        if not _MARKUP_RE.search(text):
+            return text
         soup = BeautifulSoup(text, "html.parser")
         return soup.get_text()
 
@@ -84,7 +279,7 @@ class TextPreprocessor:
         Returns:
             str: Text without URLs.
         """
-        return re.sub(r"http\S+|www\S+|https\S+", "", text, flags=re.MULTILINE)
+        return _URL_RE.sub("", text)
 
     @staticmethod
     def norm_unicode_data(text):
@@ -136,7 +331,7 @@ class TextPreprocessor:
         Returns:
             list: A list of tokens without punctuation.
         """
-        return [token for token in tokens if token not in string.punctuation]
+        return [token for token in tokens if token not in _PUNCTUATION]
 
     @staticmethod
     def remove_stopwords(tokens):
@@ -149,7 +344,7 @@ class TextPreprocessor:
         Returns:
             list: A list of tokens without stopwords.
         """
-        stop_words = set(stopwords.words("english"))
+        stop_words = _english_stopwords()
         return [token for token in tokens if token not in stop_words]
 
     @staticmethod
@@ -163,8 +358,8 @@ class TextPreprocessor:
         Returns:
             list: A list of lemmatized tokens.
         """
-        lemmatizer = WordNetLemmatizer()
-        return [lemmatizer.lemmatize(token) for token in tokens]
+        lemmatize = _lemmatize()
+        return [lemmatize(token) for token in tokens]
 
     @staticmethod
     def tokens_to_text(tokens):
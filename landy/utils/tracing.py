@@ -0,0 +1,242 @@
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+from landy.utils.logger import CustomLogger
+
+logger = CustomLogger(__name__)
+
+# Local port serving the latency histograms in Prometheus' text format; 0
+# turns the endpoint off
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 9108))
+
+# Upper bounds, in seconds, of the histogram buckets: roughly 1.5x apart
+# from 1 ms to 2 minutes, so percentiles are estimated within about 20%
+LATENCY_BUCKETS = (
+    0.001, 0.0015, 0.0025, 0.004, 0.006, 0.01, 0.015, 0.025, 0.04, 0.06,
+    0.1, 0.15, 0.25, 0.4, 0.6, 1.0, 1.5, 2.5, 4.0, 6.0, 10.0, 15.0, 25.0,
+    40.0, 60.0, 90.0, 120.0)
+
+# Stage durations of the request being handled in the current context
+_trace_var: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    'trace', default=None)
+
+
+class LatencyHistogram:
+    """
+    Counts of observed durations per bucket, with their sum, in the shape
+    Prometheus expects.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # One count per bucket, plus one for everything slower
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds: float):
+        """Count a duration."""
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def percentile(self, q: float) -> Optional[float]:
+        """
+        Estimate a percentile by interpolating within its bucket, like
+        Prometheus' histogram_quantile.
+
+        Args:
+            q (float): The percentile, from 0 to 100.
+
+        Returns:
+            Optional[float]: The estimate in seconds, or None if nothing was
+            observed.
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.buckets):
+                    # Slower than the last bucket; that's all we know
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class LatencyRecorder:
+    """
+    Thread-safe latency histograms, one per stage.
+
+    Usage:
+        recorder = LatencyRecorder()
+        recorder.observe('llm', 2.3)
+        recorder.summary()  # [('llm', 1, 2.3, 2.5, 2.5), ...]
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        """
+        Record how long a stage took.
+
+        Args:
+            stage (str): Name of the stage.
+            seconds (float): Its duration.
+        """
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = LatencyHistogram(
+                    self.buckets)
+            histogram.observe(seconds)
+
+    def summary(self, percentiles: Sequence[float] = (50, 95, 99)
+                ) -> List[Tuple]:
+        """
+        Observation counts and percentile estimates of every stage.
+
+        Args:
+            percentiles (Sequence[float]): The percentiles to estimate.
+
+        Returns:
+            List[Tuple]: (stage, count, *percentiles in seconds), by stage.
+        """
+        with self._lock:
+            return [(stage, histogram.count,
+                     *(histogram.percentile(q) for q in percentiles))
+                    for stage, histogram in sorted(self._histograms.items())]
+
+    def to_prometheus(self, name: str = 'landy_stage_latency_seconds') -> str:
+        """
+        The histograms in Prometheus' text exposition format.
+
+        Args:
+            name (str): Name of the metric.
+
+        Returns:
+            str: The exposition text.
+        """
+        lines = [f'# HELP {name} Time spent in each stage of answering a '
+                 f'question.',
+                 f'# TYPE {name} histogram']
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                label = f'stage="{stage}"'
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound}"}} '
+                                 f'{cumulative}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} '
+                             f'{histogram.count}')
+                lines.append(f'{name}_sum{{{label}}} {histogram.sum}')
+                lines.append(f'{name}_count{{{label}}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+
+# Process-wide histograms that spans are recorded in
+latency = LatencyRecorder()
+
+
+@contextmanager
+def span(stage: str, recorder: LatencyRecorder = latency) -> Iterator[None]:
+    """
+    Time a block as one stage of the current request.
+
+    The duration goes into the stage's histogram and, inside a `trace`, into
+    the request's breakdown. Works in coroutines as well, as long as the
+    block awaits nothing that belongs to another stage.
+
+    Args:
+        stage (str): Name of the stage.
+        recorder (LatencyRecorder): Where the duration is recorded.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        recorder.observe(stage, elapsed)
+        stages = _trace_var.get()
+        if stages is not None:
+            stages[stage] = stages.get(stage, 0.0) + elapsed
+
+
+@contextmanager
+def trace(stage: str = 'total',
+          recorder: LatencyRecorder = latency) -> Iterator[Dict[str, float]]:
+    """
+    Time a whole request as a stage and collect the durations of the spans
+    inside it, including those of tasks started from it.
+
+    Args:
+        stage (str): Name the whole request is recorded under.
+        recorder (LatencyRecorder): Where the durations are recorded.
+
+    Yields:
+        Dict[str, float]: Seconds per stage; complete once the block exits.
+    """
+    stages = {}
+    token = _trace_var.set(stages)
+    try:
+        with span(stage, recorder):
+            yield stages
+    finally:
+        _trace_var.reset(token)
+
+
+async def start_metrics_server(host: str = METRICS_HOST,
+                               port: int = METRICS_PORT,
+                               recorder: LatencyRecorder = latency
+                               ) -> Optional[web.AppRunner]:
+    """
+    Serve the latency histograms at http://host:port/metrics.
+
+    Args:
+        host (str): Interface to listen on.
+        port (int): Port to listen on; 0 doesn't start the server.
+        recorder (LatencyRecorder): The histograms to serve.
+
+    Returns:
+        Optional[web.AppRunner]: The running server, to be cleaned up on
+        shutdown, or None if it is turned off.
+
+    Raises:
+        OSError: If the port can't be listened on, e.g. it is taken.
+    """
+    if not port:
+        return None
+
+    async def metrics(request: web.Request) -> web.Response:
+        return web.Response(
+            body=recorder.to_prometheus().encode('utf-8'),
+            headers={'Content-Type': 'text/plain; version=0.0.4; '
+                                     'charset=utf-8'})
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    logger.info('Serving latency metrics on http://%s:%d/metrics', host, port)
+    return runner
@@ -0,0 +1,438 @@
+import os
+import json
+import atexit
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from landy.utils.logger import CustomLogger
+import landy
+
+logger = CustomLogger(__name__)
+
+here = os.path.dirname(os.path.abspath(landy.__file__)) # landy/landy
+# Which VectorStore the bot and the index builder use: 'chroma' or 'numpy'
+VECTOR_BACKEND = os.environ.get('VECTOR_BACKEND', 'chroma')
+# How the numpy backend stores embeddings: 'float32', 'float16' or 'int8'
+VECTOR_DTYPE = os.environ.get('VECTOR_DTYPE', 'float32')
+# Candidates per result re-scored at full precision in quantized indexes;
+# re-scoring needs a float32 copy on disk, so it's off unless asked for
+VECTOR_RESCORE_FACTOR = int(os.environ.get('VECTOR_RESCORE_FACTOR', 0))
+QUANTIZED_DTYPES = ('float32', 'float16', 'int8')
+# Quantized rows widened to float32 at a time while scoring
+SCORE_BLOCK_ROWS = 4096
+
+# A query's results: chunk IDs, texts and scores, higher scores being closer
+Hits = List[Tuple[str, str, float]]
+
+
+class VectorStore(ABC):
+    """
+    Interface of the chunk stores behind the retriever and index builder.
+    A backend missing one of the abstract methods can't be instantiated;
+    `persist` and `close` do nothing unless overridden.
+
+    Attributes:
+        runs_inline (bool): Whether queries are quick enough to run on the
+                            event loop and safe to run concurrently.
+    """
+    runs_inline = False
+
+    def __init__(self, persist_directory: str):
+        self.persist_directory = persist_directory
+
+    @abstractmethod
+    def count(self) -> int:
+        """Number of stored chunks."""
+
+    @abstractmethod
+    def get_all(self) -> Tuple[List[str], List[str], List[Dict]]:
+        """IDs, texts and metadata of every stored chunk."""
+
+    @abstractmethod
+    def query(self, embeddings: List[List[float]], k: int) -> List[Hits]:
+        """The `k` chunks nearest to each embedding, nearest first."""
+
+    @abstractmethod
+    def upsert(self, ids: List[str], embeddings: List[List[float]],
+               documents: List[str], metadatas: List[Dict]):
+        """Add chunks, replacing any with the same IDs."""
+
+    @abstractmethod
+    def delete(self, ids: List[str]):
+        """Remove chunks by ID."""
+
+    def persist(self):
+        """Write pending changes to disk."""
+
+    def close(self):
+        """Release the store's resources."""
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    VectorStore backed by a persisted Chroma collection.
+    """
+
+    def __init__(self, persist_directory: str, embedder: Embeddings):
+        """
+        Load the Chroma collection, creating it if needed.
+
+        Args:
+            persist_directory (str): Directory the collection is persisted in.
+            embedder (Embeddings): Chroma's embedding function.
+        """
+        super().__init__(persist_directory)
+        # Imported here so the numpy backend doesn't pay for duckdb & co.
+        from langchain.vectorstores import Chroma
+        self.db = Chroma(persist_directory=persist_directory,
+                         embedding_function=embedder)
+        self._collection = self.db._collection
+        # Chroma writes everything it holds back to disk at exit, which
+        # would overwrite an index rebuilt since it was loaded; only
+        # `persist` writes
+        atexit.unregister(self.db._client._db.persist)
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def get_all(self) -> Tuple[List[str], List[str], List[Dict]]:
+        chunks = self._collection.get(include=['documents', 'metadatas'])
+        return (chunks['ids'], chunks['documents'],
+                [metadata or {} for metadata in chunks['metadatas']])
+
+    def query(self, embeddings: List[List[float]], k: int) -> List[Hits]:
+        # Chroma refuses to return more results than it holds
+        n_results = min(k, self.count())
+        if n_results == 0:
+            return [[] for _ in embeddings]
+        result = self._collection.query(
+            query_embeddings=embeddings, n_results=n_results,
+            include=['documents', 'distances'])
+        return [[(chunk_id, text, -distance)
+                 for chunk_id, text, distance in zip(ids, texts, distances)]
+                for ids, texts, distances in zip(result['ids'],
+                                                 result['documents'],
+                                                 result['distances'])]
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]],
+               documents: List[str], metadatas: List[Dict]):
+        self._collection.upsert(ids=ids, embeddings=embeddings,
+                                documents=documents, metadatas=metadatas)
+
+    def delete(self, ids: List[str]):
+        self._collection.delete(ids=ids)
+
+    def persist(self):
+        self.db.persist()
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    VectorStore keeping unit-length embeddings in one `.npy` matrix, with
+    chunk IDs, texts and metadata in a JSON sidecar.
+
+    The matrix is memory-mapped, so loading is near-instant and processes
+    serving the same index share its pages. Queries are an exact cosine
+    search: one matrix product, then `argpartition` for the top k.
+
+    The matrix can be stored as float32, float16 or int8 with one scale per
+    vector, cutting its size on disk and in the page cache 2x or 4x. That
+    costs query time: numpy has no BLAS for float16 or int8, so each block
+    of rows is widened to float32 before it is scored, which is slower than
+    scoring float32 directly (several times for float16, up to 3x for int8
+    in benchmarks/quantization_benchmark.py). Quantize for size, not speed.
+
+    Quantized scores are slightly off, so quantized indexes can also keep a
+    float32 copy: the best `k * rescore_factor` candidates are then
+    re-scored exactly against it, touching only their pages. The copy makes
+    the index larger on disk than float32 alone.
+
+    Usage:
+        store = NumpyVectorStore('db_numpy', dtype='int8')
+        hits = store.query([embedding], k=10)[0]
+    """
+    runs_inline = True
+    VECTORS_NAME = 'vectors.npy'
+    SCALES_NAME = 'scales.npy'
+    FULL_VECTORS_NAME = 'vectors.f32.npy'
+    CHUNKS_NAME = 'chunks.json'
+
+    def __init__(self, persist_directory: str, dtype: str = VECTOR_DTYPE,
+                 rescore_factor: int = VECTOR_RESCORE_FACTOR):
+        """
+        Map the stored matrices and load the sidecar, if any.
+
+        Args:
+            persist_directory (str): Directory the files are persisted in.
+            dtype (str): 'float32', 'float16' or 'int8'; how `persist` stores
+                         the matrix. Queries use whatever is on disk.
+            rescore_factor (int): Candidates per result re-scored at full
+                                  precision; 0 disables re-scoring and, for
+                                  quantized indexes, the float32 copy, which
+                                  otherwise outweighs the savings on disk.
+        """
+        super().__init__(persist_directory)
+        if dtype not in QUANTIZED_DTYPES:
+            raise ValueError(f'Unknown vector dtype: {dtype!r}')
+        self.dtype = dtype
+        self.rescore_factor = rescore_factor
+        os.makedirs(persist_directory, exist_ok=True)
+        self._load()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.persist_directory, name)
+
+    def _load(self):
+        """Map the persisted files."""
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._scales = None
+        self._full = None
+        self._ids, self._documents, self._metadatas = [], [], []
+        if os.path.exists(self._path(self.CHUNKS_NAME)):
+            with open(self._path(self.CHUNKS_NAME), 'r') as f:
+                chunks = json.load(f)
+            self._ids = chunks['ids']
+            self._documents = chunks['documents']
+            self._metadatas = chunks['metadatas']
+            if self._ids:
+                self._vectors = np.load(self._path(self.VECTORS_NAME),
+                                        mmap_mode='r')
+                if chunks.get('dtype') == 'int8':
+                    self._scales = np.load(self._path(self.SCALES_NAME),
+                                           mmap_mode='r')
+                if os.path.exists(self._path(self.FULL_VECTORS_NAME)):
+                    self._full = np.load(self._path(self.FULL_VECTORS_NAME),
+                                         mmap_mode='r')
+        self._positions = {chunk_id: position
+                           for position, chunk_id in enumerate(self._ids)}
+        logger.debug(f'Loaded {len(self._ids)} {self._vectors.dtype} vectors '
+                     f'from {self.persist_directory}')
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def get_all(self) -> Tuple[List[str], List[str], List[Dict]]:
+        return list(self._ids), list(self._documents), list(self._metadatas)
+
+    def query(self, embeddings: List[List[float]], k: int) -> List[Hits]:
+        k = min(k, len(self._ids))
+        if k == 0:
+            return [[] for _ in embeddings]
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        rescore = (self._full is not None and self.rescore_factor > 0
+                   and self._full is not self._vectors)
+        candidates = k
+        if rescore:
+            candidates = min(k * self.rescore_factor, len(self._ids))
+        scores = self._score(queries)
+        # Unordered top candidates of each row, then only those get sorted
+        top = np.argpartition(-scores, candidates - 1, axis=1)[:, :candidates]
+        results = []
+        for query, row, positions in zip(queries, scores, top):
+            if rescore:
+                # Exact scores; reads only the candidates' rows from disk
+                positions = np.sort(positions)
+                exact = self._full[positions] @ query
+                order = np.argsort(-exact)[:k]
+                positions, row_scores = positions[order], exact[order]
+            else:
+                positions = positions[np.argsort(-row[positions])]
+                row_scores = row[positions]
+            results.append([(self._ids[position], self._documents[position],
+                             float(score))
+                            for position, score in zip(positions, row_scores)])
+        return results
+
+    def _score(self, queries: np.ndarray) -> np.ndarray:
+        """Similarity of each query to every stored vector."""
+        if self._vectors.dtype == np.float32:
+            return queries @ self._vectors.T
+        # Mixed-dtype products skip BLAS, so widen a block of rows at a time;
+        # only one block is ever held at full precision. The widening is what
+        # makes quantized queries slower than float32 ones
+        scores = np.empty((len(queries), len(self._vectors)),
+                          dtype=np.float32)
+        for start in range(0, len(self._vectors), SCORE_BLOCK_ROWS):
+            block = self._vectors[start:start + SCORE_BLOCK_ROWS]
+            scores[:, start:start + len(block)] = queries @ block.astype(
+                np.float32).T
+        if self._scales is not None:
+            scores *= self._scales
+        return scores
+
+    def _writable(self) -> np.ndarray:
+        """Full-precision, in-memory copy of the matrix to change."""
+        if self._full is not None:
+            return np.array(self._full)
+        # Without a float32 copy, quantized vectors are kept as they are
+        return dequantize(self._vectors, self._scales)
+
+    def _set_matrix(self, matrix: np.ndarray):
+        """Use an updated full-precision matrix until the next persist."""
+        self._vectors = self._full = matrix
+        self._scales = None
+
+    def upsert(self, ids: List[str], embeddings: List[List[float]],
+               documents: List[str], metadatas: List[Dict]):
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        matrix = self._writable()
+        new_rows = []
+        for chunk_id, vector, document, metadata in zip(
+                ids, vectors, documents, metadatas):
+            position = self._positions.get(chunk_id)
+            if position is None:
+                self._positions[chunk_id] = len(self._ids)
+                self._ids.append(chunk_id)
+                self._documents.append(document)
+                self._metadatas.append(metadata)
+                new_rows.append(vector)
+            else:
+                matrix[position] = vector
+                self._documents[position] = document
+                self._metadatas[position] = metadata
+        if new_rows:
+            new_rows = np.stack(new_rows)
+            matrix = (np.concatenate([matrix, new_rows]) if matrix.size
+                      else new_rows)
+        self._set_matrix(matrix)
+
+    def delete(self, ids: List[str]):
+        doomed = {self._positions[chunk_id] for chunk_id in ids
+                  if chunk_id in self._positions}
+        if not doomed:
+            return
+        keep = [position for position in range(len(self._ids))
+                if position not in doomed]
+        self._set_matrix(self._writable()[keep])
+        self._ids = [self._ids[position] for position in keep]
+        self._documents = [self._documents[position] for position in keep]
+        self._metadatas = [self._metadatas[position] for position in keep]
+        self._positions = {chunk_id: position
+                           for position, chunk_id in enumerate(self._ids)}
+
+    def persist(self):
+        matrix = self._writable()
+        vectors, scales = quantize(matrix, self.dtype)
+        keep_full = self.dtype != 'float32' and self.rescore_factor > 0
+        files = {self.VECTORS_NAME: vectors,
+                 self.SCALES_NAME: scales,
+                 self.FULL_VECTORS_NAME: matrix if keep_full else None}
+        # Write every file aside first, so readers never see a half-written
+        # one
+        for name, array in files.items():
+            if array is not None:
+                with open(self._path(name) + '.tmp', 'wb') as f:
+                    np.save(f, np.ascontiguousarray(array))
+        with open(self._path(self.CHUNKS_NAME) + '.tmp', 'w') as f:
+            json.dump({'dtype': self.dtype, 'ids': self._ids,
+                       'documents': self._documents,
+                       'metadatas': self._metadatas}, f)
+        for name, array in files.items():
+            if array is not None:
+                os.replace(self._path(name) + '.tmp', self._path(name))
+            elif os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+        os.replace(self._path(self.CHUNKS_NAME) + '.tmp',
+                   self._path(self.CHUNKS_NAME))
+        self._load()
+
+    def close(self):
+        # Unmap the matrices
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._scales = self._full = None
+
+
+def quantize(vectors: np.ndarray,
+             dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    Store float32 vectors in a smaller dtype.
+
+    int8 vectors get one float32 scale each, mapping their largest absolute
+    component to 127.
+
+    Args:
+        vectors (np.ndarray): The float32 vectors, one per row.
+        dtype (str): 'float32', 'float16' or 'int8'.
+
+    Returns:
+        Tuple[np.ndarray, Optional[np.ndarray]]: The quantized vectors and,
+        for int8, their scales.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if dtype == 'int8':
+        peaks = np.abs(vectors).max(axis=1, initial=0)
+        scales = (np.where(peaks == 0, 1, peaks) / 127).astype(np.float32)
+        quantized = np.rint(vectors / scales[:, None]).astype(np.int8)
+        return quantized, scales
+    return vectors.astype(dtype), None
+
+
+def dequantize(vectors: np.ndarray,
+               scales: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Turn quantized vectors back into float32.
+
+    Args:
+        vectors (np.ndarray): The quantized vectors, one per row.
+        scales (Optional[np.ndarray]): Per-vector scales of int8 vectors.
+
+    Returns:
+        np.ndarray: float32 vectors, in memory.
+    """
+    matrix = np.array(vectors, dtype=np.float32)
+    if scales is not None:
+        matrix *= scales[:, None]
+    return matrix
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale each row to unit length, leaving zero rows alone."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def default_persist_directory(backend: str = VECTOR_BACKEND) -> str:
+    """
+    Where a backend's index lives unless told otherwise.
+
+    Args:
+        backend (str): 'chroma' or 'numpy'.
+
+    Returns:
+        str: The directory.
+    """
+    # Beside Chroma's directory rather than inside it, so neither backend's
+    # files get mixed up with, or cleaned up along with, the other's
+    if backend == 'numpy':
+        return os.path.join(here, '..', 'db_numpy')
+    return os.path.join(here, '..', 'db')
+
+
+def get_vector_store(backend: str = VECTOR_BACKEND,
+                     persist_directory: Optional[str] = None,
+                     embedder: Optional[Embeddings] = None,
+                     dtype: str = VECTOR_DTYPE) -> VectorStore:
+    """
+    Open the index of a backend.
+
+    Args:
+        backend (str): 'chroma' or 'numpy'.
+        persist_directory (Optional[str]): Directory of the index; defaults
+                                           to the backend's own.
+        embedder (Optional[Embeddings]): Embedding function, needed by
+                                         Chroma.
+        dtype (str): How the numpy backend stores embeddings when persisting.
+
+    Returns:
+        VectorStore: The opened store.
+    """
+    persist_directory = persist_directory or default_persist_directory(
+        backend)
+    if backend == 'numpy':
+        return NumpyVectorStore(persist_directory, dtype=dtype)
+    if backend == 'chroma':
+        return ChromaVectorStore(persist_directory, embedder)
+    raise ValueError(f'Unknown vector backend: {backend!r}')
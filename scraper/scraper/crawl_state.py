@@ -0,0 +1,108 @@
+# Persistent per-URL crawl state, used to skip or conditionally re-fetch
+# pages that haven't changed since the last crawl.
+
+import os
+import json
+import time
+import sqlite3
+from typing import NamedTuple, Optional
+
+# The corpus and the index hash posts the same way, so one digest serves
+# all three
+from landy.utils.corpus_store import content_hash  # noqa: F401
+
+
+class CrawlState(NamedTuple):
+    """
+    What the last crawl saw of a URL.
+    """
+    url: str
+    lastmod: Optional[str]
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: Optional[str]
+    item: Optional[dict]
+    crawled_at: float
+
+
+class CrawlStateStore:
+    """
+    SQLite store of CrawlState, keyed by URL.
+
+    Usage:
+        store = CrawlStateStore('crawl_state.sqlite3')
+        state = store.get(url)
+        store.put(url, lastmod=..., etag=..., content_hash=..., item=item)
+    """
+
+    def __init__(self, path):
+        """
+        Open the store, creating it if needed.
+
+        Args:
+            path (str): Path of the SQLite file.
+        """
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS crawl_state (
+                url TEXT PRIMARY KEY,
+                lastmod TEXT,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                item TEXT,
+                crawled_at REAL NOT NULL
+            );
+        ''')
+        self._conn.commit()
+
+    def __len__(self):
+        return self._conn.execute(
+            'SELECT COUNT(*) FROM crawl_state;').fetchone()[0]
+
+    def get(self, url):
+        """
+        Look up a URL's state.
+
+        Args:
+            url (str): The URL.
+
+        Returns:
+            Optional[CrawlState]: Its state, or None if never crawled.
+        """
+        row = self._conn.execute(
+            'SELECT url, lastmod, etag, last_modified, content_hash, item, '
+            'crawled_at FROM crawl_state WHERE url = ?;', [url]).fetchone()
+        if row is None:
+            return None
+        item = json.loads(row[5]) if row[5] else None
+        return CrawlState(*row[:5], item, row[6])
+
+    def put(self, url, lastmod=None, etag=None, last_modified=None,
+            content_hash=None, item=None):
+        """
+        Record a URL's state after crawling it.
+
+        Args:
+            url (str): The URL.
+            lastmod (Optional[str]): Its lastmod in the sitemap.
+            etag (Optional[str]): Its ETag response header.
+            last_modified (Optional[str]): Its Last-Modified response header.
+            content_hash (Optional[str]): Hash of the scraped content.
+            item (Optional[dict]): The scraped item, re-emitted when the page
+                                   turns out to be unchanged.
+        """
+        self._conn.execute(
+            'INSERT OR REPLACE INTO crawl_state (url, lastmod, etag, '
+            'last_modified, content_hash, item, crawled_at) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?);',
+            [url, lastmod, etag, last_modified, content_hash,
+             json.dumps(item) if item is not None else None, time.time()])
+        self._conn.commit()
+
+    def close(self):
+        """Close the SQLite connection."""
+        self._conn.close()
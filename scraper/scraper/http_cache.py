@@ -0,0 +1,50 @@
+# Record/replay modes for Scrapy's HTTP cache, so crawls can be re-run
+# offline against a stored copy of the blog.
+
+# Settings applied on top of the project's for each HTTPCACHE_MODE
+HTTPCACHE_MODES = {
+    # Download everything, sitemaps included, and store every good response
+    'record': {
+        'HTTPCACHE_ENABLED': True,
+        'HTTPCACHE_IGNORE_MISSING': False,
+    },
+    # Serve everything from the store, never touching the network, as fast
+    # as the spider can take it
+    'replay': {
+        'HTTPCACHE_ENABLED': True,
+        'HTTPCACHE_IGNORE_MISSING': True,
+        'CRAWL_STATE_PATH': None,
+        'AUTOTHROTTLE_ENABLED': False,
+        'DOWNLOAD_DELAY': 0,
+        'RANDOMIZE_DOWNLOAD_DELAY': False,
+        'CONCURRENT_REQUESTS': 64,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 64,
+    },
+}
+
+
+def apply_http_cache_mode(settings, priority='spider'):
+    """
+    Apply the settings of the HTTPCACHE_MODE setting, if it is set.
+
+    Settings given on the command line keep precedence.
+
+    Args:
+        settings (scrapy.settings.Settings): The crawler's settings, not yet
+                                             frozen.
+        priority (str): Priority to set them with.
+
+    Returns:
+        Optional[str]: The mode, or None if the cache runs as configured.
+
+    Raises:
+        ValueError: If HTTPCACHE_MODE isn't a known mode.
+    """
+    mode = settings.get('HTTPCACHE_MODE')
+    if not mode:
+        return None
+    if mode not in HTTPCACHE_MODES:
+        raise ValueError(f'Unknown HTTPCACHE_MODE {mode!r}; expected one of '
+                         f'{", ".join(HTTPCACHE_MODES)}')
+    settings.setdict(HTTPCACHE_MODES[mode], priority=priority)
+    return mode
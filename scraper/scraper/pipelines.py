@@ -3,11 +3,244 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import time
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import defer, threads
+
+from landy.index_builder import (
+    BATCH_SIZE,
+    IndexBuilder,
+    content_hash,
+    save_manifest
+)
+from landy.utils.corpus_store import (
+    Post,
+    append_posts,
+    is_url_id,
+    read_corpus
+)
+from landy.utils.vector_store import VECTOR_BACKEND
 
 
 class ScraperPipeline:
     def process_item(self, item, spider):
         return item
+
+
+class CorpusPipeline:
+    """
+    Appends new and changed posts to the JSONL corpus as they are scraped.
+
+    Posts already in the corpus with the same content are left alone, so a
+    re-crawl only adds the lines that changed. Enable with
+    `-s CORPUS_PATH=../data/interim/corpus.jsonl`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        path = crawler.settings.get('CORPUS_PATH')
+        if not path:
+            raise NotConfigured('CORPUS_PATH is not set')
+        pipeline = cls(path)
+        pipeline.stats = crawler.stats
+        return pipeline
+
+    def open_spider(self, spider):
+        try:
+            self.hashes = {post.id: post.content_hash
+                           for post in read_corpus(self.path)}
+        except FileNotFoundError:
+            self.hashes = {}
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        url, text = adapter.get('url'), adapter.get('blog')
+        if not url or text is None:
+            return item
+        post = Post.from_text(url, text, url=url,
+                              date=(adapter.get('metadata') or {}).get('date'))
+        if self.hashes.get(url) != post.content_hash:
+            append_posts([post], self.path)
+            self.hashes[url] = post.content_hash
+            self.stats.inc_value('corpus/appended')
+        return item
+
+
+class IndexingPipeline:
+    """
+    Indexes scraped posts into the bot's vector index as they arrive.
+
+    New and changed posts are buffered INDEX_BATCH_SIZE at a time; each
+    batch is preprocessed, chunked, embedded and upserted in a thread, one
+    batch at a time, so neither the CPU work nor the OpenAI API holds up the
+    crawl's reactor. The index is persisted at most every
+    INDEX_PERSIST_INTERVAL seconds, as Chroma rewrites all of it each time,
+    and once more when the spider closes.
+
+    Posts are keyed by URL, like the corpus `landy-index` reads. A post
+    indexed under its old blogs.json row key is replaced once the same text
+    is scraped.
+
+    Safe to resume after a crash: a post is only recorded in the manifest
+    once all of its chunks are persisted, and chunk IDs are content
+    addressed, so the next crawl simply redoes the posts that weren't
+    recorded. When a crawl finishes normally, posts no longer in the
+    sitemap are removed from the index; posts that merely failed to
+    download this time are kept.
+
+    Enable with `-s INDEX_ITEMS=true`.
+    """
+
+    def __init__(self, persist_directory, backend, batch_size,
+                 persist_interval):
+        self.persist_directory = persist_directory
+        self.backend = backend
+        self.batch_size = batch_size
+        self.persist_interval = persist_interval
+        self.builder = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool('INDEX_ITEMS'):
+            raise NotConfigured('INDEX_ITEMS is off')
+        pipeline = cls(crawler.settings.get('INDEX_PERSIST_DIR'),
+                       crawler.settings.get('INDEX_BACKEND', VECTOR_BACKEND),
+                       crawler.settings.getint('INDEX_BATCH_SIZE',
+                                               BATCH_SIZE),
+                       crawler.settings.getfloat('INDEX_PERSIST_INTERVAL',
+                                                 60.0))
+        pipeline.stats = crawler.stats
+        crawler.signals.connect(pipeline.spider_closed,
+                                signal=signals.spider_closed)
+        return pipeline
+
+    def open_spider(self, spider):
+        self.builder = IndexBuilder(self.persist_directory,
+                                    batch_size=self.batch_size,
+                                    backend=self.backend)
+        manifest = self.builder.manifest
+        # Documents still chunked the old way; until none are left, the
+        # manifest keeps the old chunk settings so they get redone later
+        self.stale = (set(manifest['documents']) if self.builder.rechunk
+                      else set())
+        if self.stale:
+            spider.logger.warning(f'Chunk settings changed, re-chunking '
+                                  f'{len(self.stale)} indexed posts')
+        # Content hash -> blogs.json row key, for posts not yet scraped
+        self.legacy = {document['content_hash']: doc_id
+                       for doc_id, document in manifest['documents'].items()
+                       if not is_url_id(doc_id)}
+        # Posts waiting for the next batch, as URL -> (hash, text), and
+        # indexed posts to remove with it
+        self.posts, self.removed = {}, set()
+        # Manifest entries of posts written but not yet persisted; None
+        # removes the document
+        self.unrecorded = {}
+        self.persist_at = time.monotonic() + self.persist_interval
+        self.lock = defer.DeferredLock()
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        doc_id, text = adapter.get('url'), adapter.get('blog')
+        if not doc_id or text is None:
+            return item
+        doc_hash = content_hash(text)
+        if self.builder.is_current(doc_id, doc_hash):
+            return item
+        self.posts[doc_id] = (doc_hash, text)
+        legacy_id = self.legacy.pop(doc_hash, None)
+        if legacy_id is not None:
+            self.removed.add(legacy_id)
+        if len(self.posts) >= self.batch_size:
+            return self.flush().addCallback(lambda _: item)
+        return item
+
+    def flush(self, persist=False):
+        """
+        Write the buffered posts in a thread, after any write already under
+        way.
+
+        Args:
+            persist (bool): Persist and record them whether or not
+                            INDEX_PERSIST_INTERVAL has passed.
+
+        Returns:
+            Deferred: Fires once they are written.
+        """
+        posts, removed = self.posts, self.removed
+        if not (posts or removed or persist):
+            return defer.succeed(None)
+        self.posts, self.removed = {}, set()
+        return self.lock.run(threads.deferToThread, self.write, posts,
+                             removed, persist)
+
+    def write(self, posts, removed, persist):
+        """
+        Preprocess, chunk, embed and upsert posts and delete the chunks of
+        removed ones, persisting if it is time to.
+        """
+        documents = self.builder.manifest['documents']
+        upserts, deletes = {}, []
+        for doc_id in removed:
+            self.unrecorded[doc_id] = None
+            deletes.extend(documents[doc_id]['chunk_ids'])
+        for doc_id, (doc_hash, text) in posts.items():
+            entry, doc_upserts, doc_deletes = self.builder.plan_document(
+                doc_id, doc_hash, self.builder.preprocessor.preprocess(text))
+            self.unrecorded[doc_id] = entry
+            upserts.update(doc_upserts)
+            deletes.extend(doc_deletes)
+        self.builder.write(upserts, deletes)
+        self.stats.inc_value('index/upserted', len(upserts))
+        self.stats.inc_value('index/deleted', len(deletes))
+        if self.unrecorded and (persist
+                                or time.monotonic() >= self.persist_at):
+            self.persist()
+
+    def persist(self):
+        """
+        Persist the index and record the posts written since the last time.
+        """
+        self.builder.db.persist()
+        self.persist_at = time.monotonic() + self.persist_interval
+        manifest = self.builder.manifest
+        for doc_id, entry in self.unrecorded.items():
+            if entry is None:
+                manifest['documents'].pop(doc_id, None)
+            else:
+                manifest['documents'][doc_id] = entry
+        self.stale.difference_update(self.unrecorded)
+        if not self.stale:
+            manifest['chunk_size'] = self.builder.chunk_size
+            manifest['chunk_overlap'] = self.builder.chunk_overlap
+        save_manifest(self.builder.persist_directory, manifest)
+        self.stats.inc_value('index/documents',
+                             sum(entry is not None
+                                 for entry in self.unrecorded.values()))
+        self.unrecorded = {}
+
+    def close_spider(self, spider):
+        return self.flush(persist=True)
+
+    @defer.inlineCallbacks
+    def spider_closed(self, spider, reason):
+        listed = getattr(spider, 'sitemap_lastmods', None)
+        if reason == 'finished' and listed:
+            # Only the sitemap says a post is gone; one that failed to
+            # download this time is still on the blog
+            gone = [doc_id for doc_id in self.builder.manifest['documents']
+                    if is_url_id(doc_id) and doc_id not in listed]
+            self.removed.update(gone)
+            if gone:
+                spider.logger.info(f'Removing {len(gone)} posts no longer '
+                                   f'on the blog from the index')
+                yield self.flush(persist=True)
+        self.builder.close()
+        self.builder.db.close()
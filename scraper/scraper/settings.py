@@ -62,9 +62,10 @@ ROBOTSTXT_OBEY = True
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "scraper.pipelines.ScraperPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "scraper.pipelines.CorpusPipeline": 200,
+    "scraper.pipelines.IndexingPipeline": 300,
+}
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -81,11 +82,17 @@ ROBOTSTXT_OBEY = True
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
+# Off unless HTTPCACHE_MODE is 'record' or 'replay' (see http_cache.py).
+# Responses never expire and are stored gzipped; errors and 304s aren't
+# stored, so recording again fetches them.
 #HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = "httpcache"
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_MODE = None
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = "httpcache"
+HTTPCACHE_IGNORE_HTTP_CODES = [304, 403, 404, 408, 429, 500, 502, 503, 504]
+HTTPCACHE_STORAGE = "scrapy.extensions.httpcache.FilesystemCacheStorage"
+HTTPCACHE_POLICY = "scrapy.extensions.httpcache.DummyPolicy"
+HTTPCACHE_GZIP = True
 
 # Set settings whose default value is deprecated to a future-proof value
 REQUEST_FINGERPRINTER_IMPLEMENTATION = "2.7"
@@ -97,7 +104,25 @@ DOWNLOADER_MIDDLEWARES = {
     'scrapy.downloadermiddlewares.retry.RetryMiddleware': None,
     'scrapy_fake_useragent.middleware.RandomUserAgentMiddleware': 400,
     'scrapy_fake_useragent.middleware.RetryUserAgentMiddleware': 401,
+    # Early, so skipped pages never reach the rest of the chain
+    'scraper.middlewares.ConditionalRequestMiddleware': 50,
 }
+
+# Per-URL lastmod, validators and content hashes from earlier crawls
+CRAWL_STATE_PATH = 'crawl_state.sqlite3'
+
+# JSONL corpus new and changed posts are appended to, e.g.
+# "../data/interim/corpus.jsonl"; None leaves it alone
+CORPUS_PATH = None
+
+# Index scraped posts into the bot's vector index during the crawl; the
+# backend and directory default to the bot's (VECTOR_BACKEND)
+INDEX_ITEMS = False
+INDEX_BATCH_SIZE = 100
+INDEX_PERSIST_DIR = None
+# Most seconds between writes of the whole index to disk
+INDEX_PERSIST_INTERVAL = 60
+
 FAKEUSERAGENT_PROVIDERS = [
     'scrapy_fake_useragent.providers.FakeUserAgentProvider',  # This is the first provider we'll try
     'scrapy_fake_useragent.providers.FakerProvider',  # If FakeUserAgentProvider fails, we'll use faker to generate a user-agent string for us
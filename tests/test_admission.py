@@ -0,0 +1,139 @@
+import asyncio
+import pytest
+from landy.utils.admission import (
+    AdmissionQueue,
+    QueueFullError,
+    RateLimitedError,
+    TokenBucket
+)
+from landy.utils.answer_cache import SingleFlight
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_refills():
+    """
+    Test if a bucket allows a burst, then refills at its rate.
+    """
+    clock = FakeClock()
+    bucket = TokenBucket(rate=0.5, capacity=2, clock=clock)
+    for _ in range(2):
+        assert bucket.wait_time() == 0
+        bucket.consume()
+    assert bucket.wait_time() == pytest.approx(2.0)
+    clock.now = 2.0
+    assert bucket.wait_time() == 0
+
+@pytest.mark.asyncio
+async def test_queue_limits_workers_and_reports_position():
+    """
+    Test if only `workers` jobs run at once, waiting jobs learn their
+    position and a full queue rejects new jobs.
+    """
+    queue = AdmissionQueue(workers=1, max_size=1, user_burst=10)
+    release = asyncio.Event()
+    positions = []
+
+    async def job(value):
+        await release.wait()
+        return value
+
+    async def on_queued(position):
+        positions.append(position)
+
+    first = asyncio.ensure_future(queue.submit(lambda: job(1), user_id=1))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(queue.submit(lambda: job(2), user_id=1,
+                                                on_queued=on_queued))
+    await asyncio.sleep(0)
+    assert queue.busy == 1
+    assert positions == [1]
+    with pytest.raises(QueueFullError):
+        await queue.submit(lambda: job(3), user_id=2)
+
+    release.set()
+    assert await asyncio.gather(first, second) == [1, 2]
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_rate_limits_per_user_and_guild():
+    """
+    Test if users and guilds are limited separately.
+    """
+    queue = AdmissionQueue(user_burst=1, guild_burst=2)
+
+    async def job():
+        return 'ok'
+
+    assert await queue.submit(job, user_id=1, guild_id=10) == 'ok'
+    with pytest.raises(RateLimitedError) as error:
+        await queue.submit(job, user_id=1, guild_id=10)
+    assert error.value.scope == 'User'
+    assert await queue.submit(job, user_id=2, guild_id=10) == 'ok'
+    with pytest.raises(RateLimitedError) as error:
+        await queue.submit(job, user_id=3, guild_id=10)
+    assert error.value.scope == 'Server'
+    assert await queue.submit(job, user_id=3, guild_id=None) == 'ok'
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_failed_notification_drops_job():
+    """
+    Test if a job whose on_queued callback fails leaves the queue and never
+    runs.
+    """
+    queue = AdmissionQueue(workers=1, max_size=1, user_burst=10)
+    release = asyncio.Event()
+    ran = []
+
+    async def job(value):
+        await release.wait()
+        ran.append(value)
+        return value
+
+    async def on_queued(position):
+        raise RuntimeError('message was deleted')
+
+    first = asyncio.ensure_future(queue.submit(lambda: job(1), user_id=1))
+    while not queue.busy:
+        await asyncio.sleep(0)
+    with pytest.raises(RuntimeError):
+        await queue.submit(lambda: job(2), user_id=1, on_queued=on_queued)
+    assert len(queue) == 0
+
+    release.set()
+    assert await first == 1
+    await asyncio.sleep(0)
+    assert ran == [1]
+    await queue.close()
+
+@pytest.mark.asyncio
+async def test_identical_questions_take_one_place():
+    """
+    Test if jobs coalesced before admission take one worker, queue place
+    and rate limit token between them.
+    """
+    queue = AdmissionQueue(workers=1, max_size=0, user_burst=1)
+    flights = SingleFlight()
+    release = asyncio.Event()
+    calls = []
+
+    async def job():
+        calls.append(1)
+        await release.wait()
+        return 'answer'
+
+    askers = [asyncio.ensure_future(flights.run(
+        'key', lambda: queue.submit(job, user_id=1))) for _ in range(5)]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*askers)
+    assert [result for result, _ in results] == ['answer'] * 5
+    assert calls == [1]
+    await queue.close()
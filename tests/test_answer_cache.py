@@ -0,0 +1,132 @@
+import asyncio
+import pytest
+from landy.utils.answer_cache import (
+    SemanticAnswerCache,
+    SingleFlight,
+    normalize_question
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lookup_similar_question():
+    """
+    Test if a similar question hits the cache and a different one misses.
+    """
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.add('q1', 'How do I farm gold?', 'Farm Canyon Hills.', [1.0, 0.0])
+    cached = cache.lookup([0.99, 0.05])
+    assert cached.answer == 'Farm Canyon Hills.'
+    assert cached.question_uuids == ['q1']
+    assert cache.lookup([0.0, 1.0]) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_eviction_and_ttl():
+    """
+    Test if the least recently used entry is evicted and old entries expire.
+    """
+    clock = FakeClock()
+    cache = SemanticAnswerCache(threshold=0.9, max_size=2, ttl=10,
+                                clock=clock)
+    cache.add('q1', 'a', 'A', [1.0, 0.0, 0.0])
+    cache.add('q2', 'b', 'B', [0.0, 1.0, 0.0])
+    assert cache.lookup([1.0, 0.0, 0.0]).answer == 'A'
+    cache.add('q3', 'c', 'C', [0.0, 0.0, 1.0])
+    assert len(cache) == 2
+    assert cache.lookup([0.0, 1.0, 0.0]) is None
+
+    clock.now = 11
+    assert cache.lookup([1.0, 0.0, 0.0]) is None
+    assert len(cache) == 0
+
+    # Answers loaded from the database expire by their original age
+    cache.add('q4', 'd', 'D', [1.0, 0.0, 0.0], age=8)
+    clock.now = 14
+    assert cache.lookup([1.0, 0.0, 0.0]) is None
+
+def test_invalidate_through_reused_question():
+    """
+    Test if feedback on a question the answer was reused for drops it.
+    """
+    cache = SemanticAnswerCache(threshold=0.9)
+    cache.add('q1', 'a', 'A', [1.0, 0.0])
+    cache.link('q2', 'q1')
+    assert cache.lookup([1.0, 0.0]).question_uuids == ['q1', 'q2']
+    assert cache.invalidate('q2')
+    assert cache.lookup([1.0, 0.0]) is None
+    assert not cache.invalidate('q1')
+
+def test_version_change_clears_cache():
+    """
+    Test if changing the cache version drops every entry.
+    """
+    cache = SemanticAnswerCache()
+    assert not cache.set_version(('abc', 'index-1'))
+    cache.add('q1', 'a', 'A', [1.0, 0.0])
+    assert not cache.set_version(('abc', 'index-1'))
+    assert len(cache) == 1
+    assert cache.set_version(('abc', 'index-2'))
+    assert len(cache) == 0
+
+def test_normalize_question():
+    """
+    Test if case, punctuation and whitespace are folded.
+    """
+    assert normalize_question("  Where's  Canyon\tHills?? ") \
+        == normalize_question("where s canyon hills")
+
+def test_lookup_exact():
+    """
+    Test if a normalized question hits without an embedding until dropped.
+    """
+    cache = SemanticAnswerCache()
+    cache.add('q1', 'Is DFO P2W?', 'Pay to progress.', [1.0, 0.0])
+    assert cache.lookup_exact('is dfo p2w').answer == 'Pay to progress.'
+    assert cache.lookup_exact('is dfo fun') is None
+    cache.invalidate('q1')
+    assert cache.lookup_exact('is dfo p2w') is None
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_concurrent_calls():
+    """
+    Test if concurrent calls with one key share a single computation, and a
+    later call starts a new one.
+    """
+    flights = SingleFlight()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    results = await asyncio.gather(*[flights.run('key', compute)
+                                     for _ in range(5)])
+    assert [result for result, _ in results] == [1] * 5
+    assert [is_leader for _, is_leader in results].count(True) == 1
+    assert len(flights) == 0
+    assert await flights.run('key', compute) == (2, True)
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_caller():
+    """
+    Test if cancelling the first caller doesn't fail the others.
+    """
+    flights = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        return 'answer'
+
+    leader = asyncio.ensure_future(flights.run('key', compute))
+    await asyncio.sleep(0)
+    follower = asyncio.ensure_future(flights.run('key', compute))
+    await asyncio.sleep(0)
+    leader.cancel()
+    assert await follower == ('answer', False)
@@ -0,0 +1,79 @@
+import asyncio
+import pytest
+from landy.utils.async_llm import AsyncLLMClient
+
+
+class FakeEmbeddingAPI:
+    """Stands in for openai.Embedding, tracking concurrent requests."""
+    def __init__(self, delay):
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.requests = []
+
+    async def acreate(self, input, **kwargs):
+        self.requests.append(input)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+        # The API doesn't promise to return embeddings in input order
+        return {'data': [{'index': i, 'embedding': [float(len(text))]}
+                         for i, text in reversed(list(enumerate(input)))]}
+
+
+class FakeEmbedder:
+    model = 'text-embedding-ada-002'
+    deployment = 'text-embedding-ada-002'
+    embedding_ctx_length = 8191
+    chunk_size = 1000
+    allowed_special = set()
+    disallowed_special = 'all'
+    request_timeout = None
+    headers = None
+
+    def __init__(self, delay=0.01):
+        self.client = FakeEmbeddingAPI(delay)
+
+
+@pytest.mark.asyncio
+async def test_embed_respects_concurrency_limit():
+    """
+    Test if no more than the configured number of requests run at once and
+    embeddings come back in input order.
+    """
+    embedder = FakeEmbedder()
+    client = AsyncLLMClient(embedder, embedding_max_concurrency=2)
+    results = await asyncio.gather(*[client.embed(['a', 'bb'])
+                                     for _ in range(6)])
+    assert results == [[[1.0], [2.0]]] * 6
+    assert embedder.client.max_in_flight == 2
+
+@pytest.mark.asyncio
+async def test_embed_times_out():
+    """
+    Test if a request slower than the timeout is abandoned.
+    """
+    client = AsyncLLMClient(FakeEmbedder(delay=1), embedding_timeout=0.01)
+    with pytest.raises(asyncio.TimeoutError):
+        await client.embed(['a'])
+
+@pytest.mark.asyncio
+async def test_embed_batches_and_splits_long_texts():
+    """
+    Test if texts are sent at most chunk_size per request, and texts longer
+    than the context are embedded in pieces whose embeddings are averaged.
+    """
+    embedder = FakeEmbedder()
+    embedder.chunk_size = 2
+    embedder.embedding_ctx_length = 4
+    client = AsyncLLMClient(embedder)
+    # Stands in for tiktoken: one token per character
+    client._split_tokens = lambda text: [
+        [ord(char) for char in text[start:start + 4]]
+        for start in range(0, len(text), 4)]
+    results = await client.embed(['a', 'bb', 'ccc', 'dddddd'])
+    assert sorted(map(len, embedder.client.requests)) == [1, 2, 2]
+    assert results[:3] == [[1.0], [2.0], [3.0]]
+    # Pieces of 4 and 2 tokens, embedded as [4.0] and [2.0], normalized
+    assert results[3] == [1.0]
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+from landy.bot import StreamedFollowup, format_answer
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.edits = [content]
+
+    async def edit(self, content, view=None):
+        self.edits.append(content)
+
+
+class FakeContext:
+    def __init__(self):
+        self.messages = []
+
+    async def send_followup(self, content, ephemeral=False, view=None):
+        message = FakeMessage(content)
+        self.messages.append(message)
+        return message
+
+
+@pytest.mark.asyncio
+async def test_streamed_followup_batches_edits():
+    """
+    Test if streamed tokens are sent in one message that is edited at most
+    once per interval and ends with the complete answer.
+    """
+    ctx = FakeContext()
+    followup = StreamedFollowup(ctx, 'Is DFO P2W?', edit_interval=0.05)
+    for token in ['Pay', ' to', ' progress', '.']:
+        await followup.on_token(token)
+    await asyncio.sleep(0.01)
+    assert len(ctx.messages) == 1
+    assert 'Pay to progress.' in ctx.messages[0].edits[0]
+
+    await followup.finish('Pay to progress.', view=None)
+    assert len(ctx.messages) == 1
+    assert ctx.messages[0].edits[-1] == format_answer('Is DFO P2W?',
+                                                      'Pay to progress.')
+    assert len(ctx.messages[0].edits) == 2
+
+@pytest.mark.asyncio
+async def test_unstreamed_answer_is_sent_once():
+    """
+    Test if an answer without streamed tokens is sent as a single message.
+    """
+    ctx = FakeContext()
+    followup = StreamedFollowup(ctx, 'Is DFO P2W?')
+    await followup.finish('Pay to progress.', view=None)
+    assert [message.edits for message in ctx.messages] == [
+        [format_answer('Is DFO P2W?', 'Pay to progress.')]]
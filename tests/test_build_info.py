@@ -0,0 +1,45 @@
+import json
+from datetime import datetime, timezone
+from landy.utils.build_info import (
+    get_build_info,
+    write_build_info,
+    UNKNOWN_COMMIT_HASH
+)
+
+def test_write_and_read_build_info(tmp_path):
+    """
+    Test if baked build metadata round-trips and is cached per path.
+    """
+    path = str(tmp_path / 'build_info.json')
+    written = write_build_info(path)
+    with open(path) as f:
+        assert json.load(f)['commit_hash'] == written.commit_hash
+
+    # Outside a git checkout the baked file is read
+    build_info = get_build_info(path, repo_dir=str(tmp_path))
+    assert build_info == written
+    assert build_info.commit_timestamp.tzinfo is not None
+    # A second call is served from the cache, even if the file changes
+    with open(path, 'w') as f:
+        json.dump({'commit_hash': 'changed',
+                   'commit_timestamp': datetime.now(timezone.utc).isoformat()},
+                  f)
+    assert get_build_info(path, repo_dir=str(tmp_path)) is build_info
+
+def test_build_info_prefers_git(tmp_path):
+    """
+    Test if the git commit is used in a checkout, even over a stale baked
+    file, and if the commit is unknown with neither.
+    """
+    path = str(tmp_path / 'build_info.json')
+    with open(path, 'w') as f:
+        json.dump({'commit_hash': 'stale',
+                   'commit_timestamp': datetime.now(timezone.utc).isoformat()},
+                  f)
+    build_info = get_build_info(path)
+    assert build_info.commit_hash != 'stale'
+    assert len(build_info.commit_hash) == 40
+
+    missing = get_build_info(str(tmp_path / 'missing.json'),
+                             repo_dir=str(tmp_path))
+    assert missing.commit_hash == UNKNOWN_COMMIT_HASH
@@ -0,0 +1,32 @@
+from landy.utils.context_assembler import ContextAssembler
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_select_fits_budget():
+    """
+    Test if chunks are taken in rank order, chunks overflowing the budget
+    are skipped and stored token counts are trusted.
+    """
+    assembler = ContextAssembler(token_budget=9, max_chunks=3,
+                                 count_tokens=count_words, separator=' | ')
+    chunks = [('one two three four', None),
+              ('five six seven eight nine', None),
+              ('ten eleven', None),
+              ('twelve', 1)]
+    assert assembler.select(chunks) == ['one two three four', 'ten eleven',
+                                        'twelve']
+    assert assembler.assemble(chunks[2:]) == 'ten eleven | twelve'
+
+def test_oversized_best_chunk_is_truncated():
+    """
+    Test if a best chunk larger than the budget is cut down rather than
+    dropped.
+    """
+    assembler = ContextAssembler(token_budget=5, count_tokens=count_words)
+    text = ' '.join(['word'] * 20)
+    selected = assembler.select([(text, 20), ('small', 1)])
+    assert len(selected) == 1
+    assert count_words(selected[0]) <= 5
@@ -0,0 +1,52 @@
+import json
+
+import pytest
+
+from landy.utils.corpus_store import (
+    Post,
+    append_posts,
+    content_hash,
+    read_corpus,
+    read_legacy,
+    write_corpus
+)
+
+
+def test_convert_legacy_corpus(tmp_path):
+    """
+    Test if the pandas-shaped blogs.json converts with its row keys as IDs.
+    """
+    legacy = tmp_path / 'blogs.json'
+    legacy.write_text(json.dumps({'blog': {'0': 'Broka raid', '1': 'Slenikon'},
+                                  'date': {'0': 1, '1': 1}}))
+    corpus = str(tmp_path / 'corpus.jsonl')
+    assert write_corpus(read_legacy(str(legacy)), corpus) == 2
+    posts = list(read_corpus(corpus))
+    assert [post.id for post in posts] == ['0', '1']
+    assert posts[0] == Post('0', None, None, content_hash('Broka raid'),
+                            'Broka raid')
+
+
+def test_appended_posts_replace_earlier_versions(tmp_path):
+    """
+    Test if the last version of each post is read, in order, and a
+    half-written last line is skipped.
+    """
+    corpus = str(tmp_path / 'corpus.jsonl')
+    url = 'https://dfoarchive.blogspot.com/2023/05/broka.html'
+    append_posts([Post.from_text(url, 'Broka raid', url=url,
+                                 date='2023-05-05'),
+                  Post.from_text('1', 'Slenikon')], corpus)
+    append_posts([Post.from_text(url, 'Broka raid, updated', url=url,
+                                 date='2023-05-08')], corpus)
+    with open(corpus, 'a') as f:
+        f.write('{"id": "2", "te')
+    posts = list(read_corpus(corpus))
+    assert [(post.id, post.date) for post in posts] == [('1', None),
+                                                        (url, '2023-05-08')]
+    assert posts[1].content_hash == content_hash('Broka raid, updated')
+
+    with open(corpus, 'a') as f:
+        f.write('\n{"id": "3", "text": "Sirocco"}\n')
+    with pytest.raises(ValueError):
+        list(read_corpus(corpus))
@@ -0,0 +1,22 @@
+from scraper.scraper.crawl_state import CrawlStateStore, content_hash
+
+
+def test_crawl_state_round_trip(tmp_path):
+    """
+    Test if a URL's crawl state is stored, replaced and read back.
+    """
+    store = CrawlStateStore(str(tmp_path / 'state.sqlite3'))
+    assert store.get('https://dfoarchive.blogspot.com/p') is None
+    item = {'blog': 'Broka raid', 'metadata': {'date': '2023-05-05'}}
+    store.put('https://dfoarchive.blogspot.com/p', lastmod='2023-05-05',
+              etag='"abc"', content_hash=content_hash(item['blog']),
+              item=item)
+    store.put('https://dfoarchive.blogspot.com/p', lastmod='2023-06-01',
+              etag='"abc"', content_hash=content_hash(item['blog']),
+              item=item)
+    state = store.get('https://dfoarchive.blogspot.com/p')
+    assert len(store) == 1
+    assert state.lastmod == '2023-06-01'
+    assert state.etag == '"abc"' and state.last_modified is None
+    assert state.item == item
+    store.close()
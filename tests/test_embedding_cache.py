@@ -0,0 +1,108 @@
+import itertools
+import sqlite3
+from typing import List
+
+import pytest
+from langchain.embeddings.base import Embeddings
+import landy.utils.embedding_cache as embedding_cache
+from landy.utils.embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    """Deterministic embedder that counts the texts it is asked to embed."""
+    model = 'counting'
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def test_only_new_texts_are_embedded(tmp_path):
+    """
+    Test if cached texts skip the wrapped embedder, also across instances
+    sharing one file.
+    """
+    path = str(tmp_path / 'embeddings.sqlite3')
+    inner = CountingEmbeddings()
+    embedder = CachedEmbeddings(inner, path=path)
+    assert embedder.embed_documents(['a', 'bb', 'a']) == [[1.0, 1.0],
+                                                           [2.0, 1.0],
+                                                           [1.0, 1.0]]
+    assert inner.calls == ['a', 'bb']
+    assert embedder.embed_query('bb') == [2.0, 1.0]
+    assert (embedder.hits, embedder.misses) == (2, 2)
+    embedder.close()
+
+    inner = CountingEmbeddings()
+    embedder = CachedEmbeddings(inner, path=path)
+    assert embedder.embed_documents(['a', 'ccc']) == [[1.0, 1.0], [3.0, 1.0]]
+    assert inner.calls == ['ccc']
+    embedder.close()
+
+def test_keys_include_model(tmp_path):
+    """
+    Test if the same text embedded by another model isn't served.
+    """
+    path = str(tmp_path / 'embeddings.sqlite3')
+    CachedEmbeddings(CountingEmbeddings(), path=path).embed_query('a')
+    inner = CountingEmbeddings()
+    CachedEmbeddings(inner, path=path, model='other').embed_query('a')
+    assert inner.calls == ['a']
+
+def test_eviction(tmp_path):
+    """
+    Test if the store is trimmed once it grows past max_entries.
+    """
+    embedder = CachedEmbeddings(CountingEmbeddings(),
+                                path=str(tmp_path / 'embeddings.sqlite3'),
+                                max_entries=10)
+    embedder.embed_documents([str(i) for i in range(12)])
+    assert len(embedder) == 9
+
+@pytest.mark.asyncio
+async def test_recently_served_embeddings_survive_eviction(tmp_path,
+                                                           monkeypatch):
+    """
+    Test if hits served by the async methods are remembered as recent uses
+    when the next insert evicts.
+    """
+    ticks = itertools.count()
+    monkeypatch.setattr(embedding_cache.time, 'time', lambda: next(ticks))
+    embedder = CachedEmbeddings(CountingEmbeddings(),
+                                path=str(tmp_path / 'embeddings.sqlite3'),
+                                max_entries=3)
+    await embedder.aembed_documents(['0', '11', '222'])
+    assert await embedder.aembed_query('0') == [1.0, 1.0]
+    await embedder.aembed_documents(['3333'])
+    assert len(embedder) == 2
+    inner = embedder.embedder
+    await embedder.aembed_documents(['0', '3333'])
+    assert inner.calls == ['0', '11', '222', '3333']
+    embedder.close()
+
+
+def test_failed_write_is_rolled_back(tmp_path):
+    """
+    Test if an insert that fails because another connection holds the write
+    lock leaves no transaction open, so later inserts still work.
+    """
+    path = str(tmp_path / 'embeddings.sqlite3')
+    embedder = CachedEmbeddings(CountingEmbeddings(), path=path)
+    embedder._conn.execute('PRAGMA busy_timeout = 0;')
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute('BEGIN IMMEDIATE;')
+    with pytest.raises(sqlite3.OperationalError):
+        embedder.embed_documents(['a'])
+    assert not embedder._conn.in_transaction
+    other.execute('ROLLBACK;')
+    other.close()
+
+    assert embedder.embed_documents(['a', 'bb']) == [[1.0, 1.0], [2.0, 1.0]]
+    assert len(embedder) == 2
+    embedder.close()
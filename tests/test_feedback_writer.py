@@ -0,0 +1,95 @@
+import uuid
+from datetime import datetime
+
+import pytest
+
+import landy.utils.feedback_writer as feedback_writer
+from landy.utils.feedback_writer import FeedbackWriter
+
+
+class FakeDatabase:
+    rows = {}
+    down = False
+
+    def __init__(self, db_uri):
+        pass
+
+    async def __aenter__(self):
+        if self.down:
+            raise ConnectionRefusedError('database is down')
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def insert_data(self, table_name, data, ignore_conflicts=False):
+        for row in [data] if isinstance(data, dict) else data:
+            self.rows.setdefault(row['feedback_uuid'], row)
+
+
+def _feedback(is_positive=True):
+    return {
+        'feedback_uuid': str(uuid.uuid4()),
+        'question_uuid': str(uuid.uuid4()),
+        'feedback_timestamp': datetime.utcnow(),
+        'is_positive': is_positive,
+        'feedback_commentary': None if is_positive else 'Wrong dungeon'
+    }
+
+
+@pytest.mark.asyncio
+async def test_feedback_spills_and_replays(monkeypatch, tmp_path):
+    """
+    Test if feedback is kept in the spill file while the database is down,
+    and written once, with its values intact, when it is back.
+    """
+    monkeypatch.setattr(feedback_writer, 'QnADatabase', FakeDatabase)
+    FakeDatabase.rows = {}
+    FakeDatabase.down = True
+    now = [0.0]
+    spill_path = str(tmp_path / 'spill.jsonl')
+    writer = FeedbackWriter('postgresql://', flush_interval=1,
+                            spill_path=spill_path, clock=lambda: now[0])
+
+    first, second = _feedback(), _feedback(is_positive=False)
+    writer.submit(first)
+    assert await writer.flush() == 0
+    assert writer.database_down
+    # Not retried before the interval passes, but still kept
+    writer.submit(second)
+    FakeDatabase.down = False
+    assert await writer.flush() == 0
+    assert writer.spilled == 2
+    assert not FakeDatabase.rows
+
+    now[0] = 1
+    assert await writer.flush() == 2
+    assert not writer.database_down
+    assert FakeDatabase.rows == {first['feedback_uuid']: first,
+                                 second['feedback_uuid']: second}
+    assert not list(tmp_path.iterdir())
+
+
+@pytest.mark.asyncio
+async def test_full_buffer_spills(monkeypatch, tmp_path):
+    """
+    Test if feedback beyond the buffer goes to the spill file, and a
+    half-written last line left by a crash is skipped on replay without
+    losing the row spilled after it.
+    """
+    monkeypatch.setattr(feedback_writer, 'QnADatabase', FakeDatabase)
+    FakeDatabase.rows = {}
+    FakeDatabase.down = False
+    spill_path = tmp_path / 'spill.jsonl'
+    with open(spill_path, 'w', encoding='utf-8') as f:
+        f.write('{"feedback_uuid": ')
+    writer = FeedbackWriter('postgresql://', max_buffer=1,
+                            spill_path=str(spill_path))
+
+    writer.submit(_feedback())
+    writer.submit(_feedback())
+    assert writer.spilled == 0
+    assert await writer.flush() == 2
+    assert writer.spilled == 1
+    assert len(FakeDatabase.rows) == 2
+    assert not spill_path.exists()
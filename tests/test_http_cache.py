@@ -0,0 +1,25 @@
+import pytest
+from scrapy.settings import Settings
+
+from scraper.scraper.http_cache import apply_http_cache_mode
+
+
+def test_replay_mode_settings():
+    """
+    Test if replay mode goes offline and unthrottled, without overriding
+    settings given on the command line.
+    """
+    settings = Settings({'CRAWL_STATE_PATH': 'crawl_state.sqlite3',
+                         'DOWNLOAD_DELAY': 3}, priority='project')
+    settings.set('HTTPCACHE_MODE', 'replay', priority='cmdline')
+    settings.set('CONCURRENT_REQUESTS', 8, priority='cmdline')
+    assert apply_http_cache_mode(settings) == 'replay'
+    assert settings.getbool('HTTPCACHE_ENABLED')
+    assert settings.getbool('HTTPCACHE_IGNORE_MISSING')
+    assert settings.get('CRAWL_STATE_PATH') is None
+    assert settings.getfloat('DOWNLOAD_DELAY') == 0
+    assert settings.getint('CONCURRENT_REQUESTS') == 8
+
+    assert apply_http_cache_mode(Settings()) is None
+    with pytest.raises(ValueError):
+        apply_http_cache_mode(Settings({'HTTPCACHE_MODE': 'replya'}))
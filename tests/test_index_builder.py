@@ -0,0 +1,61 @@
+from langchain.text_splitter import CharacterTextSplitter
+
+from landy.index_builder import IndexBuilder, iter_corpus
+from landy.utils.corpus_store import Post, append_posts
+
+
+def _builder(tmp_path):
+    # Splitting by characters needs no tokenizer download; nothing here
+    # embeds, so no API key is needed either
+    return IndexBuilder(persist_directory=str(tmp_path), chunk_size=500,
+                        text_splitter=CharacterTextSplitter(
+                            separator=' ', chunk_size=500, chunk_overlap=50))
+
+
+def test_plan_only_touches_changed_documents(tmp_path):
+    """
+    Test if unchanged documents are skipped, changed documents swap their
+    chunks and removed documents have their chunks deleted.
+    """
+    builder = _builder(tmp_path)
+    corpus = [('0', 'Canyon Hills is a good place to farm gold.'),
+              ('1', 'Broka can only be damaged by saders.')]
+    documents, upserts, deletes = builder.plan(corpus)
+    assert set(documents) == {'0', '1'}
+    assert len(upserts) == 2
+    assert deletes == []
+
+    # Pretend the first sync happened
+    builder.manifest = {'chunk_size': 500, 'documents': documents}
+    corpus = [('0', 'Canyon Hills is a good place to farm gold.'),
+              ('2', 'Slenikon has a new phase.')]
+    new_documents, upserts, deletes = builder.plan(corpus)
+    assert new_documents['0'] == documents['0']
+    assert [doc_id for doc_id, _, _ in upserts.values()] == ['2']
+    assert deletes == documents['1']['chunk_ids']
+
+def test_dry_run_leaves_index_alone(tmp_path):
+    """
+    Test if a dry run reports counts without writing a manifest.
+    """
+    builder = _builder(tmp_path)
+    stats = builder.sync([('0', 'Some post.')], dry_run=True)
+    assert stats == {'documents': 1, 'upserted': 1, 'deleted': 0}
+    assert not (tmp_path / 'manifest.json').exists()
+
+
+def test_scraped_posts_replace_legacy_rows(tmp_path):
+    """
+    Test if a blogs.json row is left out of the corpus once the same text is
+    scraped under a URL, and kept while its scraped text differs.
+    """
+    path = str(tmp_path / 'corpus.jsonl')
+    url = 'https://dfoarchive.blogspot.com/2023/05/slenikon.html'
+    append_posts([Post.from_text('0', 'Slenikon raid'),
+                  Post.from_text('1', 'Broka raid'),
+                  Post.from_text(url, 'Slenikon raid', url=url),
+                  Post.from_text(url + '?m=1', 'Broka raid, updated')],
+                 path)
+    assert list(iter_corpus(path)) == [
+        ('1', 'Broka raid'), (url, 'Slenikon raid'),
+        (url + '?m=1', 'Broka raid, updated')]
@@ -1,24 +1,86 @@
+import asyncio
 import pytest
 import uuid
+
+import landy.utils.lc_handler as lc_handler
+from landy.index_builder import empty_manifest, save_manifest
 from landy.utils.lc_handler import LangChainHandler
+from landy.utils.vector_store import NumpyVectorStore
 
 # Test if the LangChainHandler builds templates correctly
 @pytest.mark.asyncio
-async def test_build_templates():
+async def test_build_templates(tmp_path):
     """
     Test if the LangChainHandler's chat_template is not None and if the
     number of messages in the template is 2.
     """
-    async with LangChainHandler() as handler:
+    async with LangChainHandler(str(tmp_path)) as handler:
         assert handler.chat_template is not None
         assert len(handler.chat_template.messages) == 2
 
 # Test if the LangChainHandler can get ChromaDB
 @pytest.mark.asyncio
-async def test_get_chroma_db():
+async def test_get_chroma_db(tmp_path):
     """
     Test if the LangChainHandler's db attribute is not None and if the
     db.persist_directory ends with "db".
     """
-    async with LangChainHandler() as handler:
+    async with LangChainHandler(str(tmp_path)) as handler:
         assert handler.db is not None
+
+# Test if a shared LangChainHandler is only warmed once
+@pytest.mark.asyncio
+async def test_setup_is_shared(tmp_path):
+    """
+    Test if concurrent setup calls on one LangChainHandler load the Chroma DB
+    only once and if close releases it.
+    """
+    # An index of its own, so the repo's db/ is never written to
+    handler = LangChainHandler(str(tmp_path))
+    await asyncio.gather(handler.setup(), handler.setup())
+    db = handler.db
+    await handler.setup()
+    assert handler.is_ready
+    assert handler.db is db
+    await handler.close()
+    assert not handler.is_ready
+    assert handler.db is None
+
+def _index(persist_directory, texts):
+    """Write a numpy index of texts, as landy-index would."""
+    store = NumpyVectorStore(persist_directory)
+    ids = [str(number) for number in range(len(texts))]
+    store.upsert(ids, [[1.0, float(number)] for number in range(len(texts))],
+                 texts, [{'doc_id': chunk_id, 'n_tokens': 10}
+                         for chunk_id in ids])
+    store.persist()
+    manifest = empty_manifest()
+    manifest['documents'] = {chunk_id: {'content_hash': chunk_id,
+                                        'chunk_ids': [chunk_id]}
+                             for chunk_id in ids}
+    save_manifest(persist_directory, manifest)
+
+# Test if a re-indexed store is picked up without a restart
+@pytest.mark.asyncio
+async def test_reindexed_store_is_reloaded(monkeypatch, tmp_path):
+    """
+    Test if the handler reloads the index, with a new version, once the
+    manifest changes, and keeps it as is otherwise.
+    """
+    monkeypatch.setattr(lc_handler, 'VECTOR_BACKEND', 'numpy')
+    monkeypatch.setattr(lc_handler, 'INDEX_RELOAD_INTERVAL', 1e-9)
+    _index(str(tmp_path), ['Canyon Hills is a good place to farm gold.'])
+
+    handler = LangChainHandler(str(tmp_path))
+    await handler.setup()
+    version, db = handler.index_version, handler.db
+    await handler._reload_if_reindexed()
+    assert handler.db is db
+
+    _index(str(tmp_path), ['Canyon Hills is a good place to farm gold.',
+                           'Broka can only be damaged by saders.'])
+    await handler._reload_if_reindexed()
+    assert handler.index_version != version
+    assert handler.db is not db and handler.db.count() == 2
+    assert len(handler.lexical_index) == 2
+    await handler.close()
@@ -0,0 +1,46 @@
+from landy.utils.lexical_index import (
+    BM25Index,
+    reciprocal_rank_fusion,
+    tokenize
+)
+
+DOCUMENTS = [
+    ('c1', 'Slenikon drops from the Broka raid on Hell mode.'),
+    ('c2', 'Farm gold in Canyon Hills with any class.'),
+    ('c3', 'Every class can farm gold, but some farm it faster.'),
+]
+
+
+def test_tokenize():
+    """
+    Test if text is split into case-folded word terms.
+    """
+    assert tokenize("Where's Slenikon? Canyon-Hills!") == [
+        'where', 's', 'slenikon', 'canyon', 'hills']
+
+def test_search_ranks_exact_names_first():
+    """
+    Test if documents containing rare query terms rank first, documents
+    sharing no term are left out and a unique match is decisive.
+    """
+    index = BM25Index()
+    index.build(DOCUMENTS)
+    assert len(index) == 3
+
+    hits = index.search('Where does Slenikon drop?')
+    assert [doc_id for doc_id, _ in hits] == ['c1']
+    assert BM25Index.is_decisive(hits, ratio=2.0)
+    assert not BM25Index.is_decisive(hits, ratio=0)
+    assert index.text('c1') == DOCUMENTS[0][1]
+
+    hits = index.search('farm gold')
+    assert [doc_id for doc_id, _ in hits][0] == 'c3'
+    assert not BM25Index.is_decisive(hits, ratio=2.0)
+    assert index.search('unrelated words') == []
+
+def test_reciprocal_rank_fusion():
+    """
+    Test if documents ranked well by both rankings come first.
+    """
+    fused = reciprocal_rank_fusion([['a', 'b', 'c'], ['b', 'd', 'a']], k=60)
+    assert [doc_id for doc_id, _ in fused] == ['b', 'a', 'd', 'c']
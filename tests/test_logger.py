@@ -0,0 +1,52 @@
+import json
+import queue
+import logging
+
+from landy.utils.logger import (
+    BoundedQueueHandler,
+    CustomLogger,
+    configure_logging,
+    shutdown_logging
+)
+
+
+def test_queue_mode_writes_json(capsys):
+    """
+    Test if queued records come out as JSON, with their arguments and extra
+    fields, once the listener is stopped.
+    """
+    try:
+        configure_logging(mode='queue', fmt='json')
+        logger = CustomLogger('test_queue_mode_writes_json')
+        logger.debug('Not logged: %s', 'debug is off')
+        logger.info('Answered %r', 'Broka', extra={'question_uuid': 'q-1'})
+        shutdown_logging()
+        lines = capsys.readouterr().out.splitlines()
+        assert len(lines) == 1
+        entry = json.loads(lines[0])
+        assert entry['level'] == 'INFO'
+        assert entry['logger'] == 'test_queue_mode_writes_json'
+        assert entry['message'] == "Answered 'Broka'"
+        assert entry['question_uuid'] == 'q-1'
+    finally:
+        configure_logging(mode='sync', fmt='text')
+
+
+def test_full_queue_drops_and_reports():
+    """
+    Test if records are dropped while the queue is full, and the drop is
+    reported once there is room again.
+    """
+    log_queue = queue.Queue(maxsize=2)
+    handler = BoundedQueueHandler(log_queue, policy='drop')
+    record = logging.makeLogRecord({'msg': 'Slenikon %d', 'args': (1,)})
+    for _ in range(4):
+        handler.emit(record)
+    assert handler.dropped == 2
+    for _ in range(2):
+        assert log_queue.get_nowait().getMessage() == 'Slenikon 1'
+    handler.emit(record)
+    assert handler.dropped == 0
+    assert log_queue.get_nowait().getMessage() == 'Slenikon 1'
+    assert log_queue.get_nowait().getMessage().startswith(
+        'Dropped 2 log records')
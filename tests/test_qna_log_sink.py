@@ -0,0 +1,74 @@
+import json
+import uuid
+import logging
+
+import pytest
+
+import landy.utils.qna_log_sink as qna_log_sink
+from landy.utils.admission import AdmissionQueue
+from landy.utils.qna_log_sink import QnALogSink, question_context
+
+
+class FakeDatabase:
+    copied = []
+
+    def __init__(self, db_uri):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def copy_records(self, table_name, columns, records):
+        self.copied.extend(dict(zip(columns, record)) for record in records)
+
+
+@pytest.mark.asyncio
+async def test_records_wait_for_their_question(monkeypatch):
+    """
+    Test if a question's records, including those of its queued job, are
+    written once the question is stored, and those of a question never
+    stored lose the reference after the hold time.
+    """
+    monkeypatch.setattr(qna_log_sink, 'QnADatabase', FakeDatabase)
+    FakeDatabase.copied = []
+    now = [0.0]
+    sink = QnALogSink('postgresql://', hold_seconds=60,
+                      clock=lambda: now[0])
+    logger = logging.getLogger('test_records_wait_for_their_question')
+    logger.addHandler(sink)
+    queue = AdmissionQueue(workers=1)
+    stored, rejected = str(uuid.uuid4()), str(uuid.uuid4())
+    try:
+        logger.warning('Not answering anything')
+        with question_context(stored):
+            logger.warning('Starting')
+            await queue.submit(
+                lambda: _log(logger, 'Answered', extra={'chunks': 3}),
+                user_id=1)
+        with question_context(rejected):
+            logger.warning('Rejected')
+
+        assert await sink.flush_to_db() == 0
+        sink.question_stored(stored)
+        assert await sink.flush_to_db() == 2
+        rows = FakeDatabase.copied
+        assert [row['log_message'] for row in rows] == ['Starting',
+                                                        'Answered']
+        assert rows[1]['question_uuid'] == uuid.UUID(stored)
+        assert json.loads(rows[1]['log_additional_data'])['chunks'] == 3
+
+        now[0] = 61
+        assert await sink.flush_to_db() == 1
+        assert FakeDatabase.copied[2]['question_uuid'] is None
+        assert json.loads(FakeDatabase.copied[2]['log_additional_data'])[
+            'question_uuid'] == rejected
+    finally:
+        logger.removeHandler(sink)
+        await queue.close()
+
+
+async def _log(logger, msg, **kwargs):
+    logger.warning(msg, **kwargs)
@@ -77,3 +77,68 @@ async def test_qna_database():
             qna_results_data['question_uuid']
         )
         assert result == None
+
+@pytest.mark.asyncio
+async def test_qna_database_pool():
+    """
+    Test if contexts borrow connections from the shared pool and return them,
+    and if init_pool reuses an existing pool.
+    """
+    await QnADatabase.init_pool(DB_URI, min_size=1, max_size=2)
+    try:
+        # Pooled contexts borrow and return connections from the shared pool
+        async with QnADatabase(DB_URI) as db:
+            pooled_connection = db.connection
+            assert await db.connection.fetchval('SELECT 1') == 1
+        assert db.connection is None
+        async with QnADatabase(DB_URI) as db:
+            assert db.connection is pooled_connection
+
+        # Calling init_pool again reuses the existing pool
+        assert await QnADatabase.init_pool(DB_URI) is QnADatabase.pool
+    finally:
+        await QnADatabase.close_pool()
+    assert QnADatabase.pool is None
+
+class _FailingConnection:
+    """A connection whose schema statements fail, as on a lock timeout."""
+
+    def transaction(self):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self, query):
+        raise ConnectionError('lock timeout')
+
+
+class _FakePool:
+    closed = False
+
+    def acquire(self):
+        return _FailingConnection()
+
+    async def close(self):
+        self.closed = True
+
+@pytest.mark.asyncio
+async def test_failed_schema_setup_leaves_no_pool(monkeypatch):
+    """
+    Test if init_pool closes and forgets the pool when the schema can't be
+    set up, so the next call tries again.
+    """
+    pool = _FakePool()
+
+    async def create_pool(*args, **kwargs):
+        return pool
+
+    monkeypatch.setattr('asyncpg.create_pool', create_pool)
+    with pytest.raises(ConnectionError):
+        await QnADatabase.init_pool('postgresql://')
+    assert pool.closed
+    assert QnADatabase.pool is None
+    assert not QnADatabase.schema_ready
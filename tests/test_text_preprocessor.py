@@ -0,0 +1,61 @@
+from landy.utils.text_preprocessor import TextPreprocessor
+
+
+def test_preprocess_many_keeps_order():
+    """
+    Test if texts preprocessed in a process pool come back in input order
+    and match serial preprocessing, with and without markup.
+    """
+    preprocessor = TextPreprocessor()
+    texts = [f'<p>Post {i}</p>\nsee https://dfoneople.com/{i}' if i % 2
+             else f'Plain post {i} &amp; more' for i in range(50)]
+    expected = [preprocessor.preprocess(text) for text in texts]
+    assert list(preprocessor.preprocess_many(iter(texts), processes=2,
+                                             chunksize=4)) == expected
+    assert list(preprocessor.preprocess_many(texts, processes=1)) == expected
+    assert expected[1] == 'Post 1 see '
+    assert expected[2] == 'Plain post 2 & more'
+
+def test_plain_text_skips_html_parsing():
+    """
+    Test if text without markup is returned as is.
+    """
+    text = 'Use 3 < 4 and R&D, no tags here'
+    assert TextPreprocessor.remove_html_tags(text) is text
+
+def test_compiled_token_pass_and_timings():
+    """
+    Test if the enabled token steps run in one pass and each step's time is
+    recorded.
+    """
+    preprocessor = TextPreprocessor(token_steps=['remove_punctuation'],
+                                    timed=True)
+    token_pass = preprocessor.compile_token_pass()
+    assert token_pass(['Farm', ',', 'gold', '!']) == ['Farm', 'gold']
+
+    preprocessor = TextPreprocessor(timed=True)
+    assert preprocessor.preprocess('<b>Broka</b>\nraid') == 'Broka raid'
+    preprocessor.preprocess('Slenikon')
+    calls, seconds, characters = preprocessor.timings['remove_html_tags']
+    assert calls == 2 and seconds > 0 and characters == 25
+
+def test_worker_timings_reach_the_parent():
+    """
+    Test if timed token steps are staged one by one, and timings recorded
+    in pool workers are added to the parent's.
+    """
+    token_steps = ['remove_punctuation', 'lemmatize']
+    assert [name for name, _ in TextPreprocessor(token_steps).stages][-2:] \
+        == ['remove_punctuation+lemmatize', 'tokens_to_text']
+    timed = TextPreprocessor(token_steps, timed=True)
+    assert [name for name, _ in timed.stages][-3:] \
+        == ['remove_punctuation', 'lemmatize', 'tokens_to_text']
+
+    preprocessor = TextPreprocessor(timed=True)
+    texts = [f'<p>Raid {i}</p>' for i in range(20)]
+    cleaned = list(preprocessor.preprocess_many(texts, processes=2,
+                                                chunksize=4))
+    assert cleaned[0] == 'Raid 0'
+    calls, seconds, characters = preprocessor.timings['remove_html_tags']
+    assert calls == 20 and seconds > 0
+    assert characters == sum(map(len, texts))
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from landy.utils.tracing import (
+    LatencyHistogram,
+    LatencyRecorder,
+    span,
+    start_metrics_server,
+    trace
+)
+
+
+def test_histogram_percentiles():
+    """
+    Test if percentiles are interpolated within the bucket they fall in.
+    """
+    histogram = LatencyHistogram(buckets=(1.0, 2.0, 4.0))
+    for seconds in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(seconds)
+    assert histogram.count == 4
+    assert histogram.sum == pytest.approx(6.5)
+    assert histogram.percentile(25) == pytest.approx(1.0)
+    assert histogram.percentile(50) == pytest.approx(1.5)
+    assert histogram.percentile(100) == pytest.approx(4.0)
+    # Slower than every bucket
+    histogram.observe(10.0)
+    assert histogram.percentile(100) == 4.0
+    assert LatencyHistogram().percentile(50) is None
+
+
+def test_prometheus_text():
+    """
+    Test if the histograms are exposed with cumulative buckets per stage.
+    """
+    recorder = LatencyRecorder(buckets=(1.0, 2.0))
+    recorder.observe('llm', 0.5)
+    recorder.observe('llm', 1.5)
+    recorder.observe('llm', 5.0)
+    text = recorder.to_prometheus('latency_seconds')
+    assert '# TYPE latency_seconds histogram' in text
+    assert 'latency_seconds_bucket{stage="llm",le="1.0"} 1\n' in text
+    assert 'latency_seconds_bucket{stage="llm",le="2.0"} 2\n' in text
+    assert 'latency_seconds_bucket{stage="llm",le="+Inf"} 3\n' in text
+    assert 'latency_seconds_sum{stage="llm"} 7.0\n' in text
+    assert 'latency_seconds_count{stage="llm"} 3\n' in text
+
+
+@pytest.mark.asyncio
+async def test_trace_breakdown():
+    """
+    Test if a trace collects the spans inside it, including those of tasks
+    it starts, and spans outside a trace only reach the histograms.
+    """
+    recorder = LatencyRecorder()
+
+    async def job():
+        with span('llm', recorder):
+            await asyncio.sleep(0.01)
+
+    with trace('ask', recorder) as stages:
+        with span('embed', recorder):
+            pass
+        await asyncio.create_task(job())
+    with span('embed', recorder):
+        pass
+
+    assert set(stages) == {'ask', 'embed', 'llm'}
+    assert stages['ask'] >= stages['llm'] >= 0.01
+    counts = {stage: count for stage, count, *_ in recorder.summary()}
+    assert counts == {'ask': 1, 'embed': 2, 'llm': 1}
+
+
+@pytest.mark.asyncio
+async def test_metrics_server_on_taken_port():
+    """
+    Test if a second server on the same port fails with OSError, so the bot
+    can carry on without metrics.
+    """
+    runner = await start_metrics_server('127.0.0.1', 19108)
+    try:
+        with pytest.raises(OSError):
+            await start_metrics_server('127.0.0.1', 19108)
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,86 @@
+import os
+import numpy as np
+import pytest
+from landy.utils.vector_store import (
+    NumpyVectorStore,
+    VectorStore,
+    default_persist_directory,
+    get_vector_store
+)
+
+
+def test_numpy_store_query_and_persist(tmp_path):
+    """
+    Test if the nearest chunks come first, upserts replace chunks with the
+    same ID, deletes drop chunks and a reloaded store is memory-mapped.
+    """
+    store = get_vector_store('numpy', str(tmp_path))
+    assert store.query([[1.0, 0.0, 0.0]], k=3) == [[]]
+    store.upsert(ids=['a', 'b', 'c'],
+                 embeddings=[[1.0, 0.0, 0.0], [0.0, 2.0, 0.0],
+                             [1.0, 1.0, 0.0]],
+                 documents=['A', 'B', 'C'],
+                 metadatas=[{'n_tokens': 1}, {}, {}])
+    hits = store.query([[1.0, 0.1, 0.0], [0.0, 1.0, 0.0]], k=2)
+    assert [chunk_id for chunk_id, _, _ in hits[0]] == ['a', 'c']
+    assert [chunk_id for chunk_id, _, _ in hits[1]] == ['b', 'c']
+    assert np.isclose(hits[1][0][2], 1.0)
+
+    store.upsert(ids=['a'], embeddings=[[0.0, 0.0, 1.0]], documents=['A2'],
+                 metadatas=[{}])
+    store.delete(['b', 'missing'])
+    store.persist()
+    store.close()
+
+    store = NumpyVectorStore(str(tmp_path))
+    assert isinstance(store._vectors, np.memmap)
+    assert store.count() == 2
+    assert store.get_all() == (['a', 'c'], ['A2', 'C'], [{}, {}])
+    assert store.query([[0.0, 0.0, 1.0]], k=5)[0][0][:2] == ('a', 'A2')
+
+def test_quantized_store(tmp_path):
+    """
+    Test if float16 and int8 indexes are smaller, find the same nearest
+    chunks as float32 and re-score them exactly from the float32 copy.
+    """
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(200, 64)).astype(np.float32)
+    queries = vectors[:20] + rng.normal(scale=0.1, size=(20, 64))
+    ids = [str(i) for i in range(200)]
+
+    results = {}
+    for dtype in ('float32', 'float16', 'int8'):
+        store = NumpyVectorStore(str(tmp_path / dtype), dtype=dtype,
+                                 rescore_factor=4)
+        store.upsert(ids, vectors.tolist(), ids, [{}] * 200)
+        store.persist()
+        results[dtype] = store.query(queries.tolist(), k=5)
+        assert store._vectors.dtype == dtype
+    assert (tmp_path / 'int8' / 'vectors.npy').stat().st_size < (
+        tmp_path / 'float32' / 'vectors.npy').stat().st_size / 3
+    assert (tmp_path / 'int8' / 'scales.npy').exists()
+    assert not (tmp_path / 'float32' / 'vectors.f32.npy').exists()
+    for exact, rescored in zip(results['float32'], results['int8']):
+        assert [hit[0] for hit in exact] == [hit[0] for hit in rescored]
+        assert np.isclose(exact[0][2], rescored[0][2])
+
+    store = NumpyVectorStore(str(tmp_path / 'int8'), rescore_factor=0)
+    hits = store.query(queries[:1].tolist(), k=1)[0]
+    assert hits[0][0] == '0'
+    assert abs(hits[0][2] - results['float32'][0][0][2]) < 0.01
+
+
+def test_backends_are_complete_and_apart():
+    """
+    Test if a backend missing methods fails when created, and the numpy
+    index doesn't live inside Chroma's directory.
+    """
+    class CountOnly(VectorStore):
+        def count(self):
+            return 0
+
+    with pytest.raises(TypeError):
+        CountOnly('db')
+    chroma = os.path.realpath(default_persist_directory('chroma'))
+    numpy_dir = os.path.realpath(default_persist_directory('numpy'))
+    assert not numpy_dir.startswith(chroma + os.sep)